@@ -0,0 +1,107 @@
+#!/usr/bin/env python
+
+
+"""Tests the offline catalog index
+"""
+
+import os
+import shutil
+import datetime
+import tempfile
+
+from helpers import assertEquals
+
+from videonamer.catalog import (CatalogIndex, CatalogEntry, import_dumps,
+                                make_show, normalize_title)
+
+
+JSON_DUMP = """
+{"series": [
+    {"id": 76156, "SeriesName": "Scrubs", "FirstAired": "2001-10-02",
+     "episodes": [
+        {"SeasonNumber": 1, "EpisodeNumber": 1, "absolute_number": 1,
+         "FirstAired": "2001-10-02", "EpisodeName": "My First Day"},
+        {"SeasonNumber": 1, "EpisodeNumber": 2, "absolute_number": 2,
+         "FirstAired": "2001-10-04", "EpisodeName": "My Mentor"}]},
+    {"id": 78874, "SeriesName": "Firefly", "FirstAired": "2002-09-20",
+     "episodes": []}
+ ],
+ "movies": [
+    {"id": 194, "title": "Am\\u00e9lie", "release_date": "2001-04-25",
+     "genres": [{"name": "Comedy"}], "vote_average": 7.8},
+    {"id": 1, "title": "Scrubs The Movie", "release_date": "2010"}
+ ]}
+"""
+
+XML_DUMP = """<?xml version="1.0" encoding="UTF-8" ?>
+<Data>
+<Series><id>70679</id><SeriesName>Brass Eye</SeriesName>
+<FirstAired>1997-01-29</FirstAired></Series>
+<Episode><id>1</id><SeasonNumber>1</SeasonNumber>
+<EpisodeNumber>1</EpisodeNumber><EpisodeName>Animals</EpisodeName>
+<FirstAired>1997-01-29</FirstAired><seriesid>70679</seriesid></Episode>
+</Data>
+"""
+
+
+def _build():
+    tmpdir = tempfile.mkdtemp()
+    json_path = os.path.join(tmpdir, "dump.json")
+    xml_path = os.path.join(tmpdir, "dump.xml")
+    open(json_path, "w").write(JSON_DUMP)
+    open(xml_path, "w").write(XML_DUMP)
+
+    index_path = os.path.join(tmpdir, "catalog.idx")
+    count = import_dumps([json_path, xml_path], index_path)
+    return tmpdir, index_path, count
+
+
+def test_normalize_title():
+    """Titles are folded to lower case ASCII words
+    """
+    assertEquals(normalize_title(u"Am\xe9lie: The Movie (2001)"),
+                 u"amelie the movie 2001")
+    assertEquals(normalize_title("  Scrubs.  "), u"scrubs")
+
+
+def test_search_and_get():
+    """Records are found by normalised title and by id
+    """
+    tmpdir, index_path, count = _build()
+    try:
+        assertEquals(count, 5)
+        index = CatalogIndex(index_path)
+
+        assertEquals([r['id'] for r in index.search('tv', 'scrubs')], [76156])
+        assertEquals([r['id'] for r in index.search('tv', 'Scrubs (2001)')],
+                     [76156])
+        assertEquals([r['id'] for r in index.search('movie', 'scrubs')], [1])
+        assertEquals(index.search('tv', 'unknown show'), [])
+
+        movie = CatalogEntry(index.get('movie', 194))
+        assertEquals(movie.title, u"Am\xe9lie")
+        assertEquals(movie.releasedate, datetime.date(2001, 4, 25))
+        assertEquals([g.name for g in movie.genres], [u"Comedy"])
+        assertEquals(index.get('movie', 76156), None)
+        index.close()
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_show_from_record():
+    """Catalog shows behave like tvdb_api shows
+    """
+    tmpdir, index_path, count = _build()
+    try:
+        index = CatalogIndex(index_path)
+        show = make_show(index.get('tv', 76156))
+        assertEquals(show['seriesname'], u"Scrubs")
+        assertEquals(show[1][2]['episodename'], u"My Mentor")
+        assertEquals(show.airedOn(datetime.date(2001, 10, 2))[0]['episodename'],
+                     u"My First Day")
+
+        show = make_show(index.get('tv', 70679))
+        assertEquals(show[1][1]['episodename'], u"Animals")
+        index.close()
+    finally:
+        shutil.rmtree(tmpdir)
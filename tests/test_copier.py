@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+
+
+"""Tests copying files with copy_file_range, sendfile and buffers
+"""
+
+import os
+import errno
+import shutil
+import tempfile
+
+from helpers import assertEquals
+
+from videonamer.config import Config
+from videonamer import copier
+from videonamer.copier import copy_file
+
+
+def test_methods():
+    """Every method copies the contents exactly
+    """
+    Config['copy_buffer_size'] = 64 * 1024
+    tmpdir = tempfile.mkdtemp()
+    source = os.path.join(tmpdir, "source")
+    data = os.urandom(1024 * 1024 + 12345)
+    open(source, "wb").write(data)
+    try:
+        for method in copier.COPY_METHODS:
+            destination = os.path.join(tmpdir, method)
+            used = copy_file(source, destination, method=method)
+            if method != 'auto':
+                assert used in (method, 'buffered'), used
+            assertEquals(open(destination, "rb").read(), data)
+
+        empty = os.path.join(tmpdir, "empty")
+        open(empty, "wb").close()
+        copy_file(empty, os.path.join(tmpdir, "empty copy"))
+        assertEquals(os.path.getsize(os.path.join(tmpdir, "empty copy")), 0)
+    finally:
+        Config['copy_buffer_size'] = 8 * 1024 * 1024
+        shutil.rmtree(tmpdir)
+
+
+def test_fallback():
+    """A method which can't copy between the files falls back to the next
+    """
+    tmpdir = tempfile.mkdtemp()
+    source = os.path.join(tmpdir, "source")
+    open(source, "wb").write("data" * 1000)
+
+    def unsupported(source, destination, start, end):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    original = copier._copy_range_kernel, copier._copy_range_sendfile
+    copier._copy_range_kernel = copier._copy_range_sendfile = unsupported
+    try:
+        destination = os.path.join(tmpdir, "destination")
+        assertEquals(copy_file(source, destination, method='auto'),
+                     'buffered')
+        assertEquals(open(destination, "rb").read(), "data" * 1000)
+    finally:
+        copier._copy_range_kernel, copier._copy_range_sendfile = original
+        shutil.rmtree(tmpdir)
+
+
+def test_sparse():
+    """Holes in a sparse file are not written out
+    """
+    tmpdir = tempfile.mkdtemp()
+    source = os.path.join(tmpdir, "source")
+    size = 64 * 1024 * 1024
+    f = open(source, "wb")
+    f.write("start" * 1000)
+    f.seek(size / 2)
+    f.write("middle" * 1000)
+    f.truncate(size)
+    f.close()
+    try:
+        for method in ('auto', 'buffered'):
+            destination = os.path.join(tmpdir, method)
+            copy_file(source, destination, method=method)
+            assertEquals(os.path.getsize(destination), size)
+            assert open(destination, "rb").read() == open(source,
+                                                          "rb").read()
+            if os.stat(source).st_blocks * 512 < size:
+                # The filesystem supports holes
+                assert os.stat(destination).st_blocks * 512 < size / 4
+    finally:
+        shutil.rmtree(tmpdir)
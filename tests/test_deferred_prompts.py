@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+
+
+"""Tests deferring search result prompts until the other files are done
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+
+from helpers import assertEquals
+
+from videonamer.config import Config
+from videonamer.catalog import import_dumps
+from videonamer.fakeserver import FakeProviderServer
+from videonamer.info import BaseInfo
+from videonamer.selector import ConsoleSelector, no_prompts, prompts_deferred
+from videonamer.tv import TvInfo
+from videonamer.tvnamer_exceptions import SelectionDeferred
+from videonamer import main
+
+
+DUMP = """
+{"series": [
+    {"id": 1, "SeriesName": "Manor", "FirstAired": "1990-01-01",
+     "episodes": [
+        {"SeasonNumber": 1, "EpisodeNumber": 1, "EpisodeName": "One"},
+        {"SeasonNumber": 1, "EpisodeNumber": 2, "EpisodeName": "Two"}]},
+    {"id": 2, "SeriesName": "Manor", "FirstAired": "2009-03-09",
+     "episodes": [
+        {"SeasonNumber": 1, "EpisodeNumber": 1, "EpisodeName": "Flowers"},
+        {"SeasonNumber": 1, "EpisodeNumber": 2, "EpisodeName": "Nanny"}]},
+    {"id": 76156, "SeriesName": "Scrubs", "FirstAired": "2001-10-02",
+     "episodes": [
+        {"SeasonNumber": 1, "EpisodeNumber": 1,
+         "EpisodeName": "My First Day"}]},
+    {"id": 3, "SeriesName": "Dynasty", "FirstAired": "1981-01-12",
+     "episodes": [
+        {"SeasonNumber": 1, "EpisodeNumber": 1, "EpisodeName": "Oil"}]},
+    {"id": 4, "SeriesName": "Dynasty", "FirstAired": "2017-10-11",
+     "episodes": [
+        {"SeasonNumber": 1, "EpisodeNumber": 1, "EpisodeName": "Pilot"}]},
+    {"id": 5, "SeriesName": "Hotel", "FirstAired": "1983-09-21",
+     "episodes": [
+        {"SeasonNumber": 1, "EpisodeNumber": 1,
+         "EpisodeName": "Intimate Strangers"}]},
+    {"id": 6, "SeriesName": "Hotel", "FirstAired": "2012-06-13",
+     "episodes": [
+        {"SeasonNumber": 1, "EpisodeNumber": 1, "EpisodeName": "Changing"}]},
+    {"id": 7, "SeriesName": "Taxi", "FirstAired": "1978-09-12",
+     "episodes": [
+        {"SeasonNumber": 1, "EpisodeNumber": 1, "EpisodeName": "Like"}]},
+    {"id": 8, "SeriesName": "Taxi", "FirstAired": "2004-10-06",
+     "episodes": [
+        {"SeasonNumber": 1, "EpisodeNumber": 1, "EpisodeName": "Ride"}]}
+ ]}
+"""
+
+
+def test_deferred_prompts():
+    """Unambiguous files are renamed before any prompt, and each name is
+    asked about once
+    """
+    tmpdir = tempfile.mkdtemp()
+    dump = os.path.join(tmpdir, "dump.json")
+    open(dump, "w").write(DUMP)
+    import_dumps([dump], os.path.join(tmpdir, "catalog.idx"))
+
+    files = os.path.join(tmpdir, "files")
+    os.mkdir(files)
+    for name in ("manor.s01e01.avi", "scrubs.s01e01.avi",
+                 "manor.s01e02.avi"):
+        open(os.path.join(files, name), "w").close()
+
+    prompts = []
+
+    def do_select(self, name, ratiomap, candidate_name):
+        prompts.append((name, sorted(os.listdir(files))))
+        return [c for c, ratio in ratiomap if c.id == 2][0]
+
+    original = ConsoleSelector.do_select
+    ConsoleSelector.do_select = do_select
+    Config.update(catalog_path=os.path.join(tmpdir, "catalog.idx"),
+                  catalog_only=True, cache_dir=tmpdir, defer_prompts=True,
+                  always_rename=True, select_first=False, media_type='tv',
+                  remember_selections=False, title_index=False,
+                  notfound_cache_ttl=0, force_name=None, force_id=None,
+                  lookup_workers=1, lookup_prefetch=0)
+    try:
+        main.run([files])
+
+        # asked once, after Scrubs was renamed
+        assertEquals(prompts,
+                     [(u"manor", ["Scrubs - [01x01] - My First Day.avi",
+                                   "manor.s01e01.avi",
+                                   "manor.s01e02.avi"])])
+        assertEquals(sorted(os.listdir(files)),
+                     ["Manor - [01x01] - Flowers.avi",
+                      "Manor - [01x02] - Nanny.avi",
+                      "Scrubs - [01x01] - My First Day.avi"])
+    finally:
+        ConsoleSelector.do_select = original
+        Config.update(catalog_path=None, catalog_only=False,
+                      defer_prompts=False, always_rename=False,
+                      remember_selections=True, title_index=True)
+        shutil.rmtree(tmpdir)
+
+
+def test_no_prompts():
+    """Lookups which must not ask are deferred instead
+    """
+
+    class Asking(ConsoleSelector):
+
+        def do_select(self, name, ratiomap, candidate_name):
+            raise AssertionError("Asked about %s" % name)
+
+    Config['select_first'] = False
+    try:
+        with no_prompts():
+            Asking().select(u"Manor", [u"Manor", u"Manor"])
+    except SelectionDeferred:
+        pass
+    else:
+        raise AssertionError("Selection not deferred")
+
+
+def test_interrupted():
+    """Nothing is renamed when the user interrupts a prompt
+    """
+    tmpdir = tempfile.mkdtemp()
+    dump = os.path.join(tmpdir, "dump.json")
+    open(dump, "w").write(DUMP)
+    import_dumps([dump], os.path.join(tmpdir, "catalog.idx"))
+
+    files = [os.path.join(tmpdir, name)
+             for name in ("scrubs.s01e01.avi", "dynasty.s01e01.avi")]
+    for name in files:
+        open(name, "w").close()
+
+    def do_select(self, name, ratiomap, candidate_name):
+        raise KeyboardInterrupt()
+
+    original = ConsoleSelector.do_select
+    ConsoleSelector.do_select = do_select
+    Config.update(catalog_path=os.path.join(tmpdir, "catalog.idx"),
+                  catalog_only=True, cache_dir=tmpdir, defer_prompts=False,
+                  always_rename=True, select_first=False, media_type='tv',
+                  remember_selections=False, title_index=False,
+                  notfound_cache_ttl=0, force_name=None, force_id=None,
+                  lookup_workers=1, lookup_prefetch=0)
+    try:
+        try:
+            main.run(files)
+        except KeyboardInterrupt:
+            pass
+        else:
+            raise AssertionError("Interrupt not raised")
+        assertEquals(sorted(os.listdir(tmpdir)),
+                     ["catalog.idx", "dump.json", "dynasty.s01e01.avi",
+                      "scrubs.s01e01.avi"])
+    finally:
+        ConsoleSelector.do_select = original
+        Config.update(catalog_path=None, catalog_only=False,
+                      always_rename=False, remember_selections=True,
+                      title_index=True)
+        shutil.rmtree(tmpdir)
+
+
+def test_prefetch_prompts_in_order():
+    """Files looked up ahead are only asked about when their turn comes
+    """
+    tmpdir = tempfile.mkdtemp()
+    dump = os.path.join(tmpdir, "dump.json")
+    open(dump, "w").write(DUMP)
+    import_dumps([dump], os.path.join(tmpdir, "catalog.idx"))
+
+    files = os.path.join(tmpdir, "files")
+    os.mkdir(files)
+    for name in ("hotel.s01e01.avi", "scrubs.s01e01.avi",
+                 "taxi.s01e01.avi"):
+        open(os.path.join(files, name), "w").close()
+
+    prompts = []
+
+    def do_select(self, name, ratiomap, candidate_name):
+        prompts.append((name, threading.current_thread().name))
+        return [c for c, ratio in ratiomap if c.id in (6, 8)][0]
+
+    original = ConsoleSelector.do_select
+    ConsoleSelector.do_select = do_select
+    Config.update(catalog_path=os.path.join(tmpdir, "catalog.idx"),
+                  catalog_only=True, cache_dir=tmpdir, defer_prompts=False,
+                  always_rename=True, select_first=False, media_type='tv',
+                  remember_selections=False, title_index=False,
+                  notfound_cache_ttl=0, force_name=None, force_id=None,
+                  lookup_workers=2, lookup_prefetch=4)
+    try:
+        main.run([files])
+
+        main_thread = threading.current_thread().name
+        assertEquals(prompts, [(u"hotel", main_thread),
+                               (u"taxi", main_thread)])
+        assertEquals(sorted(os.listdir(files)),
+                     ["Hotel - [01x01] - Changing.avi",
+                      "Scrubs - [01x01] - My First Day.avi",
+                      "Taxi - [01x01] - Ride.avi"])
+    finally:
+        ConsoleSelector.do_select = original
+        Config.update(catalog_path=None, catalog_only=False,
+                      always_rename=False, remember_selections=True,
+                      title_index=True, lookup_workers=1, lookup_prefetch=0)
+        shutil.rmtree(tmpdir)
+
+
+def test_online_deferred():
+    """Choices between thetvdb.com search results are deferred too
+    """
+    tmpdir = tempfile.mkdtemp()
+    records = [{'kind': 'tv', 'id': 90 + i, 'title': u"Kojak",
+                'data': {'firstaired': u"%s-10-24" % year},
+                'episodes': [{'seasonnumber': u"1", 'episodenumber': u"1",
+                              'episodename': u"Siege of Terror"}]}
+               for i, year in enumerate([1973, 2005])]
+    server = FakeProviderServer(records).start()
+    Config.update(catalog_path=None, catalog_only=False, cache_dir=tmpdir,
+                  select_first=False, media_type='tv',
+                  remember_selections=False, title_index=False,
+                  notfound_cache_ttl=0, force_name=None, force_id=None,
+                  tvdb_base_url=server.tvdb_base_url)
+    # only thetvdb.com is served
+    original = BaseInfo.__dict__['get_media_classes']
+    BaseInfo.get_media_classes = staticmethod(lambda: [TvInfo])
+    prompts_deferred.set()
+    try:
+        try:
+            main.lookupFile(os.path.join(tmpdir, "kojak.s01e01.avi"))
+        except SelectionDeferred, e:
+            assertEquals(e.name, u"kojak")
+        else:
+            raise AssertionError("Selection not deferred")
+    finally:
+        BaseInfo.get_media_classes = original
+        prompts_deferred.clear()
+        Config.update(tvdb_base_url=None, remember_selections=True,
+                      title_index=True)
+        server.stop()
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+
+"""Tests the run's cache of destination directories
+"""
+
+import os
+import shutil
+import tempfile
+
+from helpers import assertEquals
+
+from videonamer.config import Config
+from videonamer.dircache import DirectoryCache
+from videonamer.planner import RenamePlan
+
+
+def test_listing():
+    """Names are listed once per directory, and follow renames
+    """
+    tmpdir = tempfile.mkdtemp()
+    open(os.path.join(tmpdir, "a"), "w").close()
+    try:
+        directories = DirectoryCache()
+        assertEquals(directories.exists(os.path.join(tmpdir, "a")), True)
+        assertEquals(directories.exists(os.path.join(tmpdir, "b")), False)
+        assertEquals(directories.exists(os.path.join(tmpdir, "new", "c")),
+                     False)
+        assertEquals(directories.hits, 1)
+
+        directories.removed(os.path.join(tmpdir, "a"))
+        directories.added(os.path.join(tmpdir, "b"))
+        assertEquals(directories.exists(os.path.join(tmpdir, "a")), False)
+        assertEquals(directories.exists(os.path.join(tmpdir, "b")), True)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_directories_not_files():
+    """Directories don't count as files, as with os.path.isfile
+    """
+    tmpdir = tempfile.mkdtemp()
+    os.mkdir(os.path.join(tmpdir, "Season 1"))
+    try:
+        directories = DirectoryCache()
+        for i in range(2):
+            assertEquals(directories.exists(os.path.join(tmpdir, "Season 1")),
+                         False)
+        assertEquals(directories.hits, 2)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_moves():
+    """Moving many files into a few directories creates and stats each
+    directory once
+    """
+    Config.update(test_mode=False, always_move=False, placement_mode='move',
+                  move_files_fullpath_replacements=[])
+    tmpdir = tempfile.mkdtemp()
+    path = lambda *names: os.path.join(tmpdir, *names)
+    for i in range(20):
+        open(path("file%d" % i), "w").write(str(i))
+    open(path("taken"), "w").close()
+
+    created = []
+    original = os.makedirs
+
+    def makedirs(name, *args):
+        created.append(name)
+        return original(name, *args)
+
+    os.makedirs = makedirs
+    try:
+        plan = RenamePlan()
+        for i in range(20):
+            plan.add(path("file%d" % i), path("S%d" % (i % 2), "e%d" % i),
+                     move=True)
+        plan.add(path("file19"), path("taken"), move=True)
+        assertEquals(plan.apply(), 1)
+        assertEquals(sorted(created), [path("S0"), path("S1")])
+        assertEquals(sorted(os.listdir(tmpdir)), ["S0", "S1", "taken"])
+        assertEquals(open(path("S1", "e19")).read(), "19")
+        assert plan.directories.hits > 20
+    finally:
+        os.makedirs = original
+        shutil.rmtree(tmpdir)
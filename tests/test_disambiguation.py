@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+
+"""Tests choosing between similar search results without asking
+"""
+
+import operator
+
+from helpers import assertEquals
+
+from videonamer.config import Config
+from videonamer.catalog import CatalogEntry
+from videonamer.disambiguation import disambiguate
+from videonamer.selector import Selector
+
+
+def series(uid, title, year, seasons, popularity=None):
+    return CatalogEntry({'kind': 'tv', 'id': uid, 'title': title,
+                         'year': year,
+                         'data': {'ratingcount': popularity},
+                         'episodes': [{'seasonnumber': s, 'episodenumber': e}
+                                      for s in range(1, seasons + 1)
+                                      for e in range(1, 11)]})
+
+
+def movie(uid, title, year, popularity=None):
+    return CatalogEntry({'kind': 'movie', 'id': uid, 'title': title,
+                         'year': year, 'popularity': popularity})
+
+
+class NoPrompts(Selector):
+
+    def do_select(self, name, ratiomap, candidate_name):
+        raise AssertionError("Asked about %s" % name)
+
+
+def pick(name, candidates, **kwargs):
+    ratiomap = [(c, 1.0) for c in candidates]
+    return disambiguate(name, ratiomap, operator.attrgetter('title'),
+                        **kwargs)
+
+
+def test_signals():
+    """The year, episodes and popularity pick between equal names
+    """
+    Config['auto_select_confidence'] = 0.8
+    old, new = series(1, u"Castle", 1990, 1), series(2, u"Castle", 2009, 8)
+    assertEquals(pick(u"castle", [old, new], episode=(5, [3])), new)
+    assertEquals(pick(u"castle", [old, new], episode=(1, [3, 4])), None)
+    assertEquals(pick(u"castle", [old, new], year=1990), old)
+    assertEquals(pick(u"castle", [old, new], year=1991), old)
+
+    trek = [movie(3, u"Star Trek", 1979, 20.0), movie(4, u"Star Trek", 2009,
+                                                      30.0)]
+    assertEquals(pick(u"star trek", trek, year=2009), trek[1])
+    # popularity alone is not enough, nor with a better name score unless
+    # the threshold is lowered
+    assertEquals(pick(u"star trek", trek), None)
+    trek[0].popularity = 1.0
+    ratiomap = [(trek[0], 0.75), (trek[1], 1.0)]
+    assertEquals(disambiguate(u"star trek", ratiomap,
+                              operator.attrgetter('title')), None)
+    Config['auto_select_confidence'] = 0.5
+    assertEquals(disambiguate(u"star trek", ratiomap,
+                              operator.attrgetter('title')), trek[1])
+
+    Config['auto_select_confidence'] = None
+    assertEquals(pick(u"star trek", trek, year=2009), None)
+    Config['auto_select_confidence'] = 0.8
+
+
+def test_selector_skips_prompt():
+    """Selector.select only asks when there is no clear choice
+    """
+    # quick_ratio scores "Castle (US)" too low to be a candidate
+    Config.update(auto_select_confidence=0.8, select_first=False,
+                  scorer='ngram')
+    old, new = series(1, u"Castle", 1990, 1), series(2, u"Castle (US)",
+                                                     2009, 8)
+    try:
+        chosen = NoPrompts().select(
+                    u"Castle", [old, new],
+                    candidate_name=operator.attrgetter('title'),
+                    episode=(2, [1]))
+    finally:
+        Config['scorer'] = 'difflib'
+    assertEquals(chosen, new)
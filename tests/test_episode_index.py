@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+
+
+"""Tests the per-show episode indexes
+"""
+
+import datetime
+
+from helpers import assertEquals
+
+from videonamer.config import Config
+from videonamer.catalog import make_show
+from videonamer.tv import EpisodeIndex, TvInfo
+from videonamer.tvnamer_exceptions import EpisodeNotFound, SeasonNotFound
+
+
+def _show():
+    episodes = []
+    for absno in range(1, 221):
+        episodes.append({
+            'seasonnumber': unicode((absno - 1) // 100 + 1),
+            'episodenumber': unicode((absno - 1) % 100 + 1),
+            'absolute_number': unicode(absno),
+            'firstaired': unicode(datetime.date(2002, 10, 3) +
+                                  datetime.timedelta(days=7 * absno)),
+            'episodename': u"Episode %d" % absno})
+    return make_show({'kind': 'tv', 'id': 1, 'title': u"Naruto",
+                      'episodes': episodes})
+
+
+def test_index_lookups():
+    """Episodes are found by number, absolute number and air date
+    """
+    index = EpisodeIndex(_show())
+    assertEquals(index.seasons, set([1, 2, 3]))
+    assertEquals(index.episode(2, 5)['episodename'], u"Episode 105")
+    assertEquals(index.episode(4, 1), None)
+    assertEquals([e['episodename'] for e in index.absolute(143)],
+                 [u"Episode 143"])
+    assertEquals(index.absolute(999), [])
+    aired = datetime.date(2002, 10, 3) + datetime.timedelta(days=7 * 12)
+    assertEquals([e['episodename'] for e in index.aired_on(aired)],
+                 [u"Episode 12"])
+
+
+def test_absolute_number_fallback():
+    """Episode numbers missing from the season are looked up by absolute
+    number, matching exactly
+    """
+    Config['force_name'] = None
+    show = _show()
+
+    info = TvInfo("[Group] Naruto - 143 [ABCD1234].avi")
+    info._populate_episodes(show, u"Naruto")
+    assertEquals(info.episodename, [u"Episode 143"])
+
+    info = TvInfo("[Group] Naruto - 9999 [ABCD1234].avi")
+    try:
+        info._populate_episodes(show, u"Naruto")
+    except EpisodeNotFound:
+        pass
+    else:
+        raise AssertionError("Expected EpisodeNotFound")
+
+
+def test_missing_season():
+    """Unknown seasons raise SeasonNotFound
+    """
+    info = TvInfo("naruto.s09e01.avi")
+    try:
+        info._populate_episodes(_show(), u"Naruto")
+    except SeasonNotFound:
+        pass
+    else:
+        raise AssertionError("Expected SeasonNotFound")
+
+
+def test_index_reused():
+    """The index is built once per show
+    """
+    show = _show()
+    index = TvInfo._episode_index(show)
+    assert TvInfo._episode_index(show) is index
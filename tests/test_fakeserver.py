@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+
+"""Tests the local stand-in for the provider APIs
+"""
+
+import os
+import json
+import shutil
+import urllib2
+import tempfile
+
+import tmdb3
+from tvdb_api import Tvdb
+
+from helpers import assertEquals
+
+from videonamer.fakeserver import FakeProviderServer, load_records
+from videonamer.movie import use_tmdb_server
+from videonamer.tv import use_tvdb_server
+
+
+DUMP = {
+    "series": [
+        {"id": 76156, "SeriesName": "Scrubs", "FirstAired": "2001-10-02",
+         "episodes": [
+            {"SeasonNumber": 1, "EpisodeNumber": 1, "absolute_number": 1,
+             "FirstAired": "2001-10-02", "EpisodeName": "My First Day"},
+            {"SeasonNumber": 1, "EpisodeNumber": 2, "absolute_number": 2,
+             "FirstAired": "2001-10-04", "EpisodeName": "My Mentor"}]}],
+    "movies": [
+        {"id": 194, "title": "Amelie", "release_date": "2001-04-25",
+         "genres": [{"name": "Comedy"}], "vote_average": 7.8}]}
+
+
+def _server(**kwargs):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, "dump.json")
+        json.dump(DUMP, open(path, "w"))
+        records = load_records([path])
+    finally:
+        shutil.rmtree(tmpdir)
+    return FakeProviderServer(records, **kwargs).start()
+
+
+def _status(url):
+    try:
+        urllib2.urlopen(url).read()
+    except urllib2.HTTPError, e:
+        return e.code
+    return 200
+
+
+def test_tvdb_api():
+    """tvdb_api retrieves shows and episodes from the fake server
+    """
+    server = _server()
+    try:
+        tvdb = Tvdb(cache=False)
+        use_tvdb_server(tvdb, server.tvdb_base_url)
+        show = tvdb['scrubs']
+        assertEquals(show['seriesname'], u"Scrubs")
+        assertEquals(show[1][2]['episodename'], u"My Mentor")
+    finally:
+        server.stop()
+
+
+def test_tmdb3():
+    """tmdb3 searches movies on the fake server
+    """
+    server = _server()
+    tmdb3.set_key('0' * 32)
+    use_tmdb_server(server.tmdb_base_url)
+    try:
+        results = list(tmdb3.searchMovie(u"amelie"))
+        assertEquals([(m.id, m.title) for m in results], [(194, u"Amelie")])
+        assertEquals(results[0].releasedate.year, 2001)
+    finally:
+        use_tmdb_server(None)
+        server.stop()
+
+
+def test_injected_failures():
+    """Errors and rate limiting are injected as configured
+    """
+    server = _server(error_rate=1)
+    try:
+        url = server.tmdb_base_url + "movie/194?api_key=test"
+        assertEquals(_status(url), 503)
+        assertEquals(server.get_stats()['errors'], 1)
+    finally:
+        server.stop()
+
+    server = _server(rate_limit=2)
+    try:
+        url = server.tmdb_base_url + "movie/194?api_key=test"
+        codes = [_status(url) for i in range(4)]
+        assertEquals(codes[:2], [200, 200])
+        assertEquals(codes[-1], 429)
+    finally:
+        server.stop()
+
+
+def test_fixtures():
+    """The recorded responses bundled with the benchmarks are served
+    """
+    fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            "..", "tools", "fixtures")
+    records = load_records([os.path.join(fixtures, name)
+                            for name in sorted(os.listdir(fixtures))])
+    server = FakeProviderServer(records).start()
+    try:
+        tvdb = Tvdb(cache=False)
+        use_tvdb_server(tvdb, server.tvdb_base_url)
+        show = tvdb['doctor who (2005)']
+        assertEquals(show[1][1]['episodename'], u"Rose")
+        assertEquals(len([r for r in records if r['kind'] == 'movie']), 8)
+    finally:
+        server.stop()
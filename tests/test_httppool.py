@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+
+"""Tests reuse of HTTP connections to the providers
+"""
+
+import time
+import socket
+import httplib
+import urllib2
+import threading
+
+from helpers import assertEquals
+
+from videonamer.fakeserver import FakeProviderServer
+from videonamer.httppool import (ConnectionPool, KeepAliveHandler,
+                                 TimeoutHandler)
+
+
+MOVIE = {'kind': 'movie', 'id': 194, 'title': u"Amelie", 'year': 2001}
+
+
+def _opener(size):
+    pool = ConnectionPool(size)
+    return pool, urllib2.build_opener(KeepAliveHandler(pool))
+
+
+def test_connections_reused():
+    """Sequential requests to one host share a connection
+    """
+    server = FakeProviderServer([MOVIE]).start()
+    try:
+        pool, opener = _opener(4)
+        url = server.tmdb_base_url + "movie/194"
+        for i in range(5):
+            assertEquals(opener.open(url).code, 200)
+        try:
+            opener.open(server.tmdb_base_url + "movie/1")
+        except urllib2.HTTPError, e:
+            assertEquals(e.code, 404)
+        else:
+            raise AssertionError("Expected HTTPError")
+        assertEquals(opener.open(url).code, 200)
+
+        stats = pool.get_stats()
+        assertEquals((stats['opened'], stats['reused']), (1, 6))
+        assertEquals(server.get_stats()['connections'], 1)
+    finally:
+        server.stop()
+
+
+def test_per_host_limit():
+    """No more than the pool size of connections are used concurrently
+    """
+    server = FakeProviderServer([MOVIE], latency=0.05).start()
+    try:
+        pool, opener = _opener(2)
+        url = server.tmdb_base_url + "movie/194"
+
+        def fetch():
+            for i in range(3):
+                opener.open(url).read()
+
+        threads = [threading.Thread(target=fetch) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assertEquals(pool.get_stats()['requests'], 15)
+        assertEquals(server.get_stats()['connections'], 2)
+    finally:
+        server.stop()
+
+
+def test_reconnects_closed_connection():
+    """A connection closed by the server while idle is replaced
+    """
+    server = FakeProviderServer([MOVIE], idle_timeout=0.05).start()
+    try:
+        pool, opener = _opener(1)
+        url = server.tmdb_base_url + "movie/194"
+        assertEquals(opener.open(url).code, 200)
+        time.sleep(0.2)
+        assertEquals(opener.open(url).code, 200)
+        assertEquals(pool.get_stats()['retried'], 1)
+        assertEquals(server.get_stats()['connections'], 2)
+    finally:
+        server.stop()
+
+
+def test_timeout():
+    """Requests time out after the timeout given to the handlers, without
+    changing the default socket timeout
+    """
+    server = FakeProviderServer([MOVIE], latency=1).start()
+    try:
+        pool = ConnectionPool(4)
+        opener = urllib2.build_opener(KeepAliveHandler(pool),
+                                      TimeoutHandler(0.2))
+        start = time.time()
+        try:
+            opener.open(server.tmdb_base_url + "movie/194")
+        except urllib2.URLError:
+            pass
+        else:
+            raise AssertionError("Request did not time out")
+        assert time.time() - start < 0.9
+        assertEquals(socket.getdefaulttimeout(), None)
+    finally:
+        server.stop()
+
+
+def test_slot_returned_after_error():
+    """A request failing with any error gives its connection's slot back
+    """
+    server = FakeProviderServer([MOVIE]).start()
+    original = httplib.HTTPConnection.getresponse
+
+    def getresponse(self, *args, **kwargs):
+        raise ValueError("Bad response")
+
+    try:
+        pool, opener = _opener(1)
+        url = server.tmdb_base_url + "movie/194"
+        httplib.HTTPConnection.getresponse = getresponse
+        for i in range(2):
+            try:
+                opener.open(url)
+            except ValueError:
+                pass
+            else:
+                raise AssertionError("Expected ValueError")
+        httplib.HTTPConnection.getresponse = original
+        assertEquals(opener.open(url).code, 200)
+        assertEquals(pool.get_stats()['discarded'], 2)
+    finally:
+        httplib.HTTPConnection.getresponse = original
+        server.stop()
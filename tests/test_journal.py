@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+
+"""Tests the journal of renames and undoing them
+"""
+
+import os
+import shutil
+import tempfile
+
+from helpers import assertEquals
+
+from videonamer.config import Config
+from videonamer.journal import Journal, read_journal, undo, _groups
+from videonamer.planner import RenamePlan
+
+
+def contents(tmpdir):
+    found = {}
+    for dirpath, dirnames, filenames in os.walk(tmpdir):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            found[os.path.relpath(path, tmpdir)] = open(path).read()
+    return found
+
+
+def test_undo():
+    """Undoing a journal restores the names before the run
+    """
+    Config.update(test_mode=False, always_move=False,
+                  move_files_fullpath_replacements=[])
+    tmpdir = tempfile.mkdtemp()
+    files = os.path.join(tmpdir, "files")
+    os.mkdir(files)
+    path = lambda name: os.path.join(files, name)
+    for name in ("a", "b", "x", "caf\xe9"):
+        open(path(name), "w").write(name)
+    before = contents(files)
+    try:
+        journal = Journal(os.path.join(tmpdir, "run.jsonl"), fsync='always')
+        plan = RenamePlan()
+        plan.add(path("a"), path("b"))
+        plan.add(path("b"), path("a"))
+        plan.add(path("x"), path("sub/x"), move=True)
+        plan.add(path("caf\xe9"), path("caf\xc3\xa9"))
+        assertEquals(plan.apply(journal), 0)
+        journal.close()
+
+        assertEquals(journal.count, 5)
+        assertEquals(contents(files), {"a": "b", "b": "a",
+                                       os.path.join("sub", "x"): "x",
+                                       "caf\xc3\xa9": "caf\xe9"})
+        assert (('rename', path("caf\xe9"), path("caf\xc3\xa9"))
+                in read_journal(journal.path))
+
+        assertEquals(undo(journal.path, workers=2), 0)
+        assertEquals(contents(files), before)
+
+        # Undoing twice would swap a and b back
+        assertEquals(os.path.exists(journal.path), False)
+        try:
+            undo(journal.path + ".undone")
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("Journal undone twice")
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_truncated_journal():
+    """A partly written last record is ignored
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        journal = Journal(os.path.join(tmpdir, "run.jsonl"), batch_size=2)
+        journal.record('rename', u"/a/1", u"/a/2")
+        journal.record('move', u"/a/2", u"/b/2")
+        journal.record('rename', u"/c/1", u"/c/2")
+        journal.close()
+        open(journal.path, "a").write('{"op": "rename", "sou')
+
+        records = read_journal(journal.path)
+        assertEquals(records, [('rename', u"/a/1", u"/a/2"),
+                               ('move', u"/a/2", u"/b/2"),
+                               ('rename', u"/c/1", u"/c/2")])
+        # /a and /b are restored in order, /c on its own
+        assertEquals(sorted(_groups(records)),
+                     [[('rename', u"/a/1", u"/a/2"),
+                       ('move', u"/a/2", u"/b/2")],
+                      [('rename', u"/c/1", u"/c/2")]])
+    finally:
+        shutil.rmtree(tmpdir)
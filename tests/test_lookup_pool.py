@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+
+"""Tests the concurrent lookup stage
+"""
+
+import time
+import threading
+
+from helpers import assertEquals
+
+from videonamer.config import Config
+from videonamer.lookup import LookupPool, provider_slot
+
+
+def test_serial_inline():
+    """A single worker calls the function in the calling thread
+    """
+    threads = []
+
+    def func(item):
+        threads.append(threading.current_thread())
+        return item * 2
+
+    results = list(LookupPool(func, workers=1).imap([1, 2, 3]))
+    assertEquals(results, [(1, 2, None), (2, 4, None), (3, 6, None)])
+    assertEquals(set(threads), set([threading.current_thread()]))
+
+
+def test_results_in_order():
+    """Results are delivered in item order, even when later items
+    finish first
+    """
+
+    def func(item):
+        time.sleep(0.01 * (5 - item))
+        return item
+
+    results = [r for _, r, _ in LookupPool(func, workers=5).imap(range(5))]
+    assertEquals(results, range(5))
+
+
+def test_errors_delivered():
+    """Exceptions are returned with the item instead of stopping the pool
+    """
+
+    def func(item):
+        if item == 1:
+            raise ValueError(item)
+        return item
+
+    results = list(LookupPool(func, workers=3).imap(range(3)))
+    assertEquals(results[0], (0, 0, None))
+    assertEquals(results[1][2][0], ValueError)
+    assertEquals(results[2], (2, 2, None))
+
+
+def test_provider_limit():
+    """provider_slot never lets more than the configured number of
+    lookups run at once
+    """
+    Config['lookup_provider_limits'] = {'test': 2}
+    lock = threading.Lock()
+    state = {'running': 0, 'peak': 0}
+
+    def func(item):
+        with provider_slot('test'):
+            with lock:
+                state['running'] += 1
+                state['peak'] = max(state['peak'], state['running'])
+            time.sleep(0.02)
+            with lock:
+                state['running'] -= 1
+        return item
+
+    list(LookupPool(func, workers=6).imap(range(12)))
+    assertEquals(state['peak'], 2)
+
+
+def test_prefetch_runs_ahead():
+    """With prefetch, upcoming items are looked up in the background while
+    the current result is being handled, but no further than prefetch
+    items ahead
+    """
+    started = []
+    lock = threading.Lock()
+
+    def func(item):
+        with lock:
+            started.append(item)
+        return item
+
+    pool = LookupPool(func, workers=1, prefetch=2)
+    results = pool.imap(range(10))
+    assertEquals(results.next()[0], 0)
+
+    # while the first result is "being confirmed", the next ones are fetched
+    deadline = time.time() + 2
+    while len(started) < 3 and time.time() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.05)
+    assertEquals(sorted(started), [0, 1, 2])
+
+    assertEquals([r for _, r, _ in results], range(1, 10))
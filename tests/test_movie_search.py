@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+
+"""Tests reading themoviedb.org search results page by page
+"""
+
+import tmdb3
+
+from helpers import assertEquals
+
+from videonamer.config import Config
+from videonamer.fakeserver import FakeProviderServer
+from videonamer.movie import take_results, use_tmdb_server
+
+
+def _server():
+    records = [{'kind': 'movie', 'id': 1, 'title': u"The Matrix",
+                'year': 1999}]
+    for i in range(2, 46):
+        records.append({'kind': 'movie', 'id': i,
+                        'title': u"The Matrix Fan Edit %d" % i,
+                        'year': 2005})
+    server = FakeProviderServer(records).start()
+    tmdb3.set_key('0' * 32)
+    use_tmdb_server(server.tmdb_base_url)
+    return server
+
+
+def test_stops_after_good_page():
+    """No more pages are fetched once a page has a good match
+    """
+    Config['movie_search_good_ratio'] = 0.95
+    server = _server()
+    try:
+        results = take_results(tmdb3.searchMovie(u"The Matrix"),
+                               u"The Matrix", 1999, 40)
+        assertEquals(len(results), 20)
+        assertEquals(results[0].id, 1)
+        assertEquals(server.get_stats()['requests'], 1)
+    finally:
+        use_tmdb_server(None)
+        server.stop()
+
+
+def test_reads_on_without_match():
+    """Pages are fetched up to max_results while nothing matches well
+    """
+    Config['movie_search_good_ratio'] = 0.95
+    server = _server()
+    try:
+        results = take_results(tmdb3.searchMovie(u"The Matrix"),
+                               u"The Matrix", 2003, 30)
+        assertEquals(len(results), 30)
+        assertEquals(server.get_stats()['requests'], 2)
+    finally:
+        use_tmdb_server(None)
+        server.stop()
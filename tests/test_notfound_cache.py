@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+
+"""Tests the negative-result cache
+"""
+
+import os
+import time
+import shutil
+import tempfile
+
+from helpers import assertEquals
+
+from videonamer.config import Config
+from videonamer.fakeserver import FakeProviderServer
+from videonamer.notfound import NotFoundCache, get_notfound_cache
+from videonamer.tv import TvInfo
+from videonamer.tvnamer_exceptions import ShowNotFound, NoGoodMatch
+
+
+def test_keyed_on_query_and_detail():
+    """Entries only match the same query and lookup detail
+    """
+    cache = NotFoundCache(os.path.join(tempfile.gettempdir(), "nonexistent"),
+                          ttl=60)
+    cache.add('tv', u"Some Show (2010)", True)
+
+    assertEquals(cache.known('tv', u"some show (2010)", True), True)
+    assertEquals(cache.known('tv', u"Some Show (2010)", False), False)
+    assertEquals(cache.known('movie', u"Some Show (2010)", True), False)
+    assertEquals(cache.known('tv', u"Some Show", True), False)
+
+
+def test_ttl():
+    """Entries expire after the ttl
+    """
+    cache = NotFoundCache(os.path.join(tempfile.gettempdir(), "nonexistent"),
+                          ttl=0.05)
+    cache.add('movie', u"junk")
+    assertEquals(cache.known('movie', u"junk"), True)
+    time.sleep(0.06)
+    assertEquals(cache.known('movie', u"junk"), False)
+
+
+def test_save_and_purge():
+    """Entries are kept between runs until purged
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        path = os.path.join(tmpdir, "state", "notfound.json")
+        cache = NotFoundCache(path, ttl=60)
+        cache.add('tv-episode', u"Scrubs", 1, u"99")
+        synced = []
+        original = os.fsync
+        os.fsync = lambda fd: synced.append(fd) or original(fd)
+        try:
+            cache.save()
+        finally:
+            os.fsync = original
+        # forced to disk before replacing the old file
+        assertEquals(len(synced), 1)
+        assertEquals(os.listdir(os.path.dirname(path)), ["notfound.json"])
+
+        cache = NotFoundCache(path, ttl=60)
+        assertEquals(cache.known('tv-episode', u"Scrubs", 1, u"99"), True)
+        assertEquals(cache.purge(), 1)
+        assertEquals(os.path.exists(path), False)
+
+        cache = NotFoundCache(path, ttl=60)
+        assertEquals(cache.known('tv-episode', u"Scrubs", 1, u"99"), False)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_kind_ttls():
+    """Media types can expire sooner than the others
+    """
+    cache = NotFoundCache(os.path.join(tempfile.gettempdir(), "nonexistent"),
+                          ttl=60, kind_ttls={'tv-episode': 0.05})
+    cache.add('tv', u"Some Show")
+    cache.add('tv-episode', u"Some Show", 1, u"1")
+    time.sleep(0.06)
+    assertEquals(cache.known('tv', u"Some Show"), True)
+    assertEquals(cache.known('tv-episode', u"Some Show", 1, u"1"), False)
+
+
+def test_poor_matches_not_cached():
+    """Searches whose results all matched too poorly are not cached
+    """
+    tmpdir = tempfile.mkdtemp()
+    records = [{'kind': 'tv', 'id': 110,
+                'title': u"Zorro and the Riders of Old California",
+                'episodes': [{'seasonnumber': u"1", 'episodenumber': u"1",
+                              'episodename': u"Pilot"}]}]
+    server = FakeProviderServer(records).start()
+    Config.update(force_name=None, force_id=None, catalog_path=None,
+                  catalog_only=False, notfound_cache_ttl=60,
+                  cache_dir=tmpdir, title_index=False, select_first=False,
+                  tvdb_base_url=server.tvdb_base_url)
+    try:
+        for filename, error in [("zorro.s01e01.avi", NoGoodMatch),
+                                ("nothing.s01e01.avi", ShowNotFound)]:
+            try:
+                TvInfo(filename).populate_from_db()
+            except ShowNotFound, e:
+                assertEquals(type(e), error)
+            else:
+                raise AssertionError("%s found" % filename)
+        cache = get_notfound_cache()
+        assertEquals(cache.known('tv', u"zorro", False), False)
+        assertEquals(cache.known('tv', u"nothing", False), True)
+    finally:
+        Config.update(tvdb_base_url=None, notfound_cache_ttl=0,
+                      title_index=True)
+        server.stop()
+        shutil.rmtree(tmpdir)
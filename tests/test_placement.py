@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+
+"""Tests linking, cloning and copying files into the move destination
+"""
+
+import os
+import shutil
+import tempfile
+
+from helpers import assertEquals
+
+from videonamer.config import Config
+from videonamer import renamer
+from videonamer.journal import Journal, undo
+from videonamer.planner import RenamePlan
+
+
+def test_placement_modes():
+    """The mode of the longest directory containing the destination is
+    used
+    """
+    Config.update(placement_mode='move',
+                  placement_modes={'/media/seeding': 'hardlink',
+                                   '/media/seeding/tv/': 'reflink'})
+    try:
+        assertEquals(renamer.placement_mode("/media/tv/a.avi"), 'move')
+        assertEquals(renamer.placement_mode("/media/seeding/a.avi"),
+                     'hardlink')
+        assertEquals(renamer.placement_mode("/media/seeding-old/a.avi"),
+                     'move')
+        assertEquals(renamer.placement_mode("/media/seeding/tv/S/a.avi"),
+                     'reflink')
+    finally:
+        Config['placement_modes'] = {}
+
+
+def test_hardlink():
+    """Hardlinked files keep the original in place, and undoing removes
+    the link
+    """
+    Config.update(test_mode=False, placement_mode='hardlink',
+                  move_files_fullpath_replacements=[])
+    tmpdir = tempfile.mkdtemp()
+    source = os.path.join(tmpdir, "seeding", "show.s01e01.avi")
+    os.mkdir(os.path.dirname(source))
+    open(source, "wb").write("video")
+    destination = os.path.join(tmpdir, "Show", "Show - [01x01].avi")
+    try:
+        journal = Journal(os.path.join(tmpdir, "run.jsonl"))
+        plan = RenamePlan()
+        plan.add(source, destination, move=True)
+        assertEquals(plan.apply(journal), 0)
+        journal.close()
+
+        assert os.path.samefile(source, destination)
+        assertEquals(os.listdir(os.path.dirname(destination)),
+                     ["Show - [01x01].avi"])
+
+        assertEquals(undo(journal.path), 0)
+        assertEquals(os.path.exists(destination), False)
+        assertEquals(open(source, "rb").read(), "video")
+    finally:
+        Config['placement_mode'] = 'move'
+        shutil.rmtree(tmpdir)
+
+
+def test_link_fallback():
+    """Files which can't be linked are copied
+    """
+    Config.update(test_mode=False, move_verify='size')
+    tmpdir = tempfile.mkdtemp()
+    source = os.path.join(tmpdir, "source.avi")
+    open(source, "wb").write("video")
+
+    original = os.link
+
+    def no_links(source, destination):
+        raise OSError(18, "Invalid cross-device link")
+
+    os.link = no_links
+    try:
+        for mode in ('hardlink', 'reflink', 'link', 'copy'):
+            destination = os.path.join(tmpdir, mode + ".avi")
+            renamer.move_file(source, destination, mode=mode)
+            assertEquals(open(destination, "rb").read(), "video")
+            assert not os.path.samefile(source, destination)
+        assertEquals(sorted(os.listdir(tmpdir)),
+                     ["copy.avi", "hardlink.avi", "link.avi", "reflink.avi",
+                      "source.avi"])
+    finally:
+        os.link = original
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+
+
+"""Tests planning and applying the renames of a run
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+
+from helpers import assertEquals
+
+from videonamer.config import Config
+from videonamer.planner import RenamePlan, connected_groups
+
+
+def make_files(names):
+    """Creates a temporary directory with files containing their own names
+    """
+    tmpdir = tempfile.mkdtemp()
+    for name in names:
+        open(os.path.join(tmpdir, name), "w").write(name)
+    return tmpdir
+
+
+def contents(tmpdir):
+    return dict((name, open(os.path.join(tmpdir, name)).read())
+                for name in os.listdir(tmpdir))
+
+
+def test_chains_and_cycles():
+    """Files are renamed out of the way first, and swaps go through a
+    temporary name
+    """
+    Config['test_mode'] = False
+    tmpdir = make_files(["a", "b", "c", "x", "y", "p", "q", "r"])
+    path = lambda name: os.path.join(tmpdir, name)
+    try:
+        plan = RenamePlan()
+        # a -> b -> c -> d, given in the worst order
+        plan.add(path("a"), path("b"))
+        plan.add(path("b"), path("c"))
+        plan.add(path("c"), path("d"))
+        # x <-> y
+        plan.add(path("x"), path("y"))
+        plan.add(path("y"), path("x"))
+        # p -> q -> r -> p
+        plan.add(path("p"), path("q"))
+        plan.add(path("q"), path("r"))
+        plan.add(path("r"), path("p"))
+        assertEquals(plan.add(path("d"), path("d")), None)
+
+        assertEquals(plan.conflicts(), [])
+        assertEquals(len(plan.steps()), 10)
+        assertEquals(plan.apply(), 0)
+        assertEquals(contents(tmpdir), {"b": "a", "c": "b", "d": "c",
+                                        "x": "y", "y": "x",
+                                        "q": "p", "r": "q", "p": "r"})
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_conflicts():
+    """Duplicate and existing destinations are found before renaming
+    """
+    Config['test_mode'] = False
+    tmpdir = make_files(["a", "b", "c", "taken", "e"])
+    path = lambda name: os.path.join(tmpdir, name)
+    try:
+        plan = RenamePlan()
+        plan.add(path("a"), path("new"))
+        plan.add(path("b"), path("new"))
+        plan.add(path("c"), path("taken"))
+        # e can't take c's name, as c stays where it is
+        plan.add(path("e"), path("c"))
+
+        assertEquals([(os.path.basename(op.source), reason.split(" ", 1)[1])
+                      for op, reason in plan.conflicts()],
+                     [("b", "is also the destination of %s" % path("a")),
+                      ("c", "%s already exists" % path("taken")),
+                      ("e", "%s already exists" % path("c"))])
+        assertEquals(plan.apply(), 3)
+        assertEquals(contents(tmpdir), {"new": "a", "b": "b", "c": "c",
+                                        "taken": "taken", "e": "e"})
+        assertEquals(len(plan), 0)
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_moves():
+    """Moves are ordered with renames, and create directories
+    """
+    Config.update(test_mode=False, always_move=False,
+                  move_files_fullpath_replacements=[])
+    tmpdir = make_files(["a", "b"])
+    path = lambda name: os.path.join(tmpdir, name)
+    try:
+        plan = RenamePlan()
+        plan.add(path("b"), path("sub/b"), move=True)
+        plan.add(path("a"), path("b"))
+        assertEquals(plan.apply(), 0)
+        assertEquals(sorted(os.listdir(tmpdir)), ["b", "sub"])
+        assertEquals(open(path("sub/b")).read(), "b")
+        assertEquals(open(path("b")).read(), "a")
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_groups():
+    """Operations are only applied in order when they share a file
+    """
+    ops = [("a", "b"), ("x", "y"), ("b", "c"), ("c", ".a.tmp"),
+           (".a.tmp", "a"), ("p", "q")]
+    assertEquals(connected_groups(ops, lambda op: op),
+                 [[("a", "b"), ("b", "c"), ("c", ".a.tmp"), (".a.tmp", "a")],
+                  [("x", "y")], [("p", "q")]])
+
+
+def test_parallel():
+    """Independent renames in one directory happen at the same time, and
+    each result is reported
+    """
+    Config['test_mode'] = False
+    names = ["file%d" % i for i in range(16)]
+    tmpdir = make_files(names + ["x", "y"])
+    path = lambda name: os.path.join(tmpdir, name)
+
+    running = [0]
+    most = [0]
+    lock = threading.Lock()
+    original = os.rename
+
+    def slow_rename(source, destination):
+        with lock:
+            running[0] += 1
+            most[0] = max(most[0], running[0])
+        time.sleep(0.02)
+        try:
+            return original(source, destination)
+        finally:
+            with lock:
+                running[0] -= 1
+
+    os.rename = slow_rename
+    try:
+        plan = RenamePlan()
+        for name in names:
+            plan.add(path(name), path(name.upper()))
+        plan.add(path("x"), path("y"))
+        plan.add(path("y"), path("x"))
+        assertEquals(plan.apply(workers=4), 0)
+        assert 1 < most[0] <= 4, most[0]
+        assertEquals([error for op, error in plan.results], [None] * 19)
+        assertEquals(contents(tmpdir),
+                     dict([(name.upper(), name) for name in names] +
+                          [("x", "y"), ("y", "x")]))
+    finally:
+        os.rename = original
+        shutil.rmtree(tmpdir)
+
+
+def test_parallel_collisions():
+    """Operations racing for the same new name leave one file there and
+    the others where they were, however many are applied at once
+    """
+    Config.update(test_mode=False, always_move=False,
+                  move_files_fullpath_replacements=[])
+    names = []
+    for i in range(8):
+        names.extend(["a%d" % i, "b%d" % i, "x%d" % i, "y%d" % i,
+                      "w%d" % i, "m%d" % i, "n%d" % i])
+    tmpdir = make_files(names)
+    path = lambda name: os.path.join(tmpdir, name)
+
+    original = os.rename
+
+    def slow_rename(source, destination):
+        time.sleep(0.005)
+        return original(source, destination)
+
+    os.rename = slow_rename
+    try:
+        plan = RenamePlan()
+        for i in range(8):
+            # a and b are renamed to the same new name
+            plan.add(path("a%d" % i), path("new%d" % i))
+            plan.add(path("b%d" % i), path("new%d" % i))
+            # w is renamed to the name x takes from y, which moves away
+            plan.add(path("x%d" % i), path("y%d" % i))
+            plan.add(path("y%d" % i), path("z%d" % i))
+            plan.add(path("w%d" % i), path("y%d" % i))
+            # m and n are moved to the same new directory and name
+            plan.add(path("m%d" % i), path("sub/s%d" % i), move=True)
+            plan.add(path("n%d" % i), path("sub/s%d" % i), move=True)
+
+        assertEquals(plan.apply(workers=8), 24)
+        expected = {}
+        for i in range(8):
+            expected.update({"new%d" % i: "a%d" % i, "b%d" % i: "b%d" % i,
+                             "y%d" % i: "x%d" % i, "z%d" % i: "y%d" % i,
+                             "w%d" % i: "w%d" % i, "n%d" % i: "n%d" % i})
+        assertEquals(sorted(os.listdir(tmpdir)), sorted(list(expected) + ["sub"]))
+        assertEquals(dict((name, open(path(name)).read())
+                          for name in expected), expected)
+        assertEquals(contents(path("sub")),
+                     dict(("s%d" % i, "m%d" % i) for i in range(8)))
+    finally:
+        os.rename = original
+        shutil.rmtree(tmpdir)
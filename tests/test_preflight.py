@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+
+"""Tests checking for free space before moving files
+"""
+
+import os
+import shutil
+import tempfile
+from collections import namedtuple
+
+from helpers import assertEquals
+
+from videonamer.config import Config
+from videonamer.planner import RenamePlan
+
+
+StatVFS = namedtuple("StatVFS", "f_frsize f_blocks f_bavail f_files f_favail")
+
+
+def planned(tmpdir, mode):
+    """Plans moving two files into new directories, with placement mode
+    """
+    plan = RenamePlan()
+    for name, size in (("a", 1000), ("b", 3000)):
+        open(os.path.join(tmpdir, name), "wb").write("x" * size)
+        plan.add(os.path.join(tmpdir, name),
+                 os.path.join(tmpdir, "lib", "S", name), move=True)
+    for op in plan.operations:
+        op.mode = mode
+    return plan
+
+
+def test_space_needed():
+    """Copies need their size and an inode, links and new directories
+    only an inode
+    """
+    Config.update(test_mode=False, move_files_fullpath_replacements=[])
+    tmpdir = tempfile.mkdtemp()
+    try:
+        assertEquals(planned(tmpdir, 'copy').space_needed(),
+                     {tmpdir: [4000, 4]})
+        assertEquals(planned(tmpdir, 'hardlink').space_needed(),
+                     {tmpdir: [0, 2]})
+        assertEquals(planned(tmpdir, 'move').space_needed(),
+                     {tmpdir: [0, 2]})
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_preflight():
+    """Nothing is moved when the destination is too full
+    """
+    Config.update(test_mode=False, preflight=True, preflight_margin=0.01,
+                  move_files_fullpath_replacements=[])
+    tmpdir = tempfile.mkdtemp()
+    original = os.statvfs
+    try:
+        # 1MB filesystem with 13KB free, of which 10KB is kept free
+        os.statvfs = lambda path: StatVFS(1024, 1000, 13, 1000, 500)
+        plan = planned(tmpdir, 'copy')
+        assertEquals(plan.preflight(),
+                     ["%s needs 0.0MB free for the files copied to it, but"
+                      " has 0.0MB (after keeping 1%% free)" % tmpdir])
+        assertEquals(plan.apply(), 2)
+        assertEquals(sorted(os.listdir(tmpdir)), ["a", "b"])
+
+        # Enough space, but not inodes
+        os.statvfs = lambda path: StatVFS(1024, 1000, 500, 1000, 13)
+        plan = planned(tmpdir, 'copy')
+        assertEquals(len(plan.preflight()), 1)
+        assert "inodes" in plan.preflight()[0]
+
+        os.statvfs = lambda path: StatVFS(1024, 1000, 500, 1000, 500)
+        plan = planned(tmpdir, 'copy')
+        assertEquals(plan.apply(), 0)
+        assertEquals(sorted(os.listdir(os.path.join(tmpdir, "lib", "S"))),
+                     ["a", "b"])
+    finally:
+        os.statvfs = original
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+
+
+"""Tests retries and circuit breakers around provider requests
+"""
+
+import time
+
+from helpers import assertEquals
+
+from videonamer.config import Config
+from videonamer import lookup
+from videonamer.resilience import CircuitBreaker, call_provider, get_breaker
+from videonamer.tvnamer_exceptions import ProviderUnavailable
+
+
+class Flaky(object):
+    """Fails the first `failures` calls with error
+    """
+
+    def __init__(self, failures, error=IOError):
+        self.failures = failures
+        self.error = error
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error("failure %d" % self.calls)
+        return "ok"
+
+
+def _transient(error):
+    return isinstance(error, IOError)
+
+
+def _setup(retries=2, threshold=100):
+    Config.update(provider_retries=retries,
+                  provider_retry_delay=0,
+                  provider_retry_max_delay=0,
+                  provider_breaker_threshold=threshold,
+                  provider_breaker_cooldown=60)
+
+
+def test_retries_transient_errors():
+    """Transient errors are retried until the request succeeds
+    """
+    _setup(retries=2)
+    func = Flaky(2)
+    assertEquals(call_provider('test-retry', func, _transient), "ok")
+    assertEquals(func.calls, 3)
+
+
+def test_gives_up_after_retries():
+    """The error is raised once the retries are used up
+    """
+    _setup(retries=1)
+    func = Flaky(5)
+    try:
+        call_provider('test-giveup', func, _transient)
+    except IOError:
+        pass
+    else:
+        raise AssertionError("Expected IOError")
+    assertEquals(func.calls, 2)
+
+
+def test_other_errors_not_retried():
+    """Errors which are not transient are raised straight away
+    """
+    _setup(retries=3)
+    func = Flaky(1, error=KeyError)
+    try:
+        call_provider('test-other', func, _transient)
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("Expected KeyError")
+    assertEquals(func.calls, 1)
+    assertEquals(get_breaker('test-other').failures, 0)
+
+
+def test_breaker_fails_fast():
+    """Once open, the breaker refuses requests without calling func
+    """
+    _setup(retries=10, threshold=3)
+    func = Flaky(100)
+    try:
+        call_provider('test-breaker', func, _transient)
+    except IOError:
+        pass
+    assertEquals(func.calls, 3)
+
+    try:
+        call_provider('test-breaker', func, _transient)
+    except ProviderUnavailable:
+        pass
+    else:
+        raise AssertionError("Expected ProviderUnavailable")
+    assertEquals(func.calls, 3)
+
+
+def test_breaker_trial_after_cooldown():
+    """After the cooldown one trial request is allowed, closing the
+    breaker when it succeeds
+    """
+    breaker = CircuitBreaker('test', threshold=2, cooldown=0.05)
+    breaker.failure()
+    breaker.failure()
+    assertEquals(breaker.allow(), False)
+
+    time.sleep(0.06)
+    assertEquals(breaker.allow(), True)
+    assertEquals(breaker.allow(), False)
+    breaker.failure()
+    assertEquals(breaker.allow(), False)
+
+    time.sleep(0.06)
+    assertEquals(breaker.allow(), True)
+    breaker.success()
+    assertEquals(breaker.allow(), True)
+    assertEquals(breaker.is_open, False)
+
+
+def test_slot_released_for_backoff():
+    """The provider's slot is given up while waiting to retry
+    """
+    _setup(retries=1)
+    limits = Config['lookup_provider_limits']
+    Config['lookup_provider_limits'] = {'test-slot': 1}
+    free = []
+
+    def sleep(delay):
+        semaphore = lookup._provider_semaphores['test-slot']
+        free.append(semaphore.acquire(False))
+        if free[-1]:
+            semaphore.release()
+
+    original = time.sleep
+    time.sleep = sleep
+    try:
+        assertEquals(call_provider('test-slot', Flaky(1), _transient), "ok")
+    finally:
+        time.sleep = original
+        Config['lookup_provider_limits'] = limits
+    assertEquals(free, [True])
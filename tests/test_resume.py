@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+
+"""Tests carrying on interrupted copies of large files
+"""
+
+import os
+import shutil
+import tempfile
+
+from helpers import assertEquals
+
+from videonamer.config import Config
+from videonamer import copier
+from videonamer import renamer
+
+MB = 1024 * 1024
+
+
+class Interrupted(Exception):
+    pass
+
+
+def copy(source, destination, fail_at=None):
+    """Copies source into place, interrupted at block fail_at. Returns the
+    offsets of the blocks copied.
+    """
+    blocks = []
+    original = copier._copy_regions
+
+    def copy_regions(source, source_fd, destination_fd, start, end, *args):
+        if start / MB == fail_at:
+            # Part of the block is written
+            os.lseek(destination_fd, start, os.SEEK_SET)
+            os.write(destination_fd, "x" * 1000)
+            raise Interrupted()
+        blocks.append(start / MB)
+        return original(source, source_fd, destination_fd, start, end, *args)
+
+    copier._copy_regions = copy_regions
+    try:
+        renamer.copy_into_place(source, destination)
+    finally:
+        copier._copy_regions = original
+    return blocks
+
+
+def resumable(test):
+
+    def wrapper():
+        Config.update(copy_resume=True, copy_resume_block_size=1)
+        tmpdir = tempfile.mkdtemp()
+        source = os.path.join(tmpdir, "source.mkv")
+        open(source, "wb").write(os.urandom(5 * MB + 1234))
+        try:
+            test(source, os.path.join(tmpdir, "copy.mkv"))
+        finally:
+            Config['copy_resume_block_size'] = 64
+            shutil.rmtree(tmpdir)
+    wrapper.__name__ = test.__name__
+    wrapper.__doc__ = test.__doc__
+    return wrapper
+
+
+def interrupt(source, destination, block):
+    try:
+        copy(source, destination, fail_at=block)
+    except Interrupted:
+        pass
+    else:
+        raise AssertionError("Copy not interrupted")
+    partial = renamer.partial_path(destination)
+    assert os.path.exists(partial)
+    assert os.path.exists(copier.progress_path(partial))
+    assertEquals(os.path.exists(destination), False)
+    return partial
+
+
+@resumable
+def test_resume(source, destination):
+    """An interrupted copy carries on after the last block copied
+    """
+    interrupt(source, destination, 3)
+    assertEquals(copy(source, destination), [3, 4, 5])
+    assertEquals(open(destination, "rb").read(), open(source, "rb").read())
+    assertEquals(sorted(os.listdir(os.path.dirname(source))),
+                 ["copy.mkv", "source.mkv"])
+
+
+@resumable
+def test_damaged_block(source, destination):
+    """Blocks which don't match their checksum are copied again
+    """
+    partial = interrupt(source, destination, 4)
+    f = open(partial, "r+b")
+    f.seek(MB + 10)
+    f.write("damaged")
+    f.close()
+    assertEquals(copy(source, destination), [1, 2, 3, 4, 5])
+    assertEquals(open(destination, "rb").read(), open(source, "rb").read())
+
+
+@resumable
+def test_changed_source(source, destination):
+    """A copy of a file which changed since is started again
+    """
+    interrupt(source, destination, 2)
+    open(source, "ab").write("more")
+    assertEquals(copy(source, destination), [0, 1, 2, 3, 4, 5])
+    assertEquals(open(destination, "rb").read(), open(source, "rb").read())
+
+
+@resumable
+def test_unreadable_progress(source, destination):
+    """A progress file which can't be read is ignored
+    """
+    partial = interrupt(source, destination, 2)
+    os.remove(copier.progress_path(partial))
+    os.mkdir(copier.progress_path(partial))
+    assertEquals(copier._load_progress(source, os.stat(source), partial,
+                                       MB), [])
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+
+"""Tests moving files between partitions
+"""
+
+import os
+import shutil
+import tempfile
+
+from helpers import assertEquals
+
+from videonamer.config import Config
+from videonamer import renamer
+
+
+def other_partition(test):
+    """Runs test with every directory treated as another partition
+    """
+
+    def wrapper():
+        Config.update(test_mode=False, move_verify='checksum')
+        original = renamer.same_partition
+        renamer.same_partition = lambda f1, f2: False
+        tmpdir = tempfile.mkdtemp()
+        try:
+            test(tmpdir)
+        finally:
+            renamer.same_partition = original
+            Config['move_verify'] = 'size'
+            shutil.rmtree(tmpdir)
+    wrapper.__name__ = test.__name__
+    wrapper.__doc__ = test.__doc__
+    return wrapper
+
+
+@other_partition
+def test_move(tmpdir):
+    """The original is deleted once the copy is in place, and keeps its
+    modification time
+    """
+    source = os.path.join(tmpdir, "source.avi")
+    open(source, "wb").write("video" * 1000)
+    os.utime(source, (1000000000, 1000000000))
+    destination = os.path.join(tmpdir, "Show", "Show - [01x01].avi")
+
+    renamer.move_file(source, destination, always_move=True)
+    assertEquals(os.listdir(tmpdir), ["Show"])
+    assertEquals(os.listdir(os.path.dirname(destination)),
+                 ["Show - [01x01].avi"])
+    assertEquals(open(destination, "rb").read(), "video" * 1000)
+    assertEquals(os.path.getmtime(destination), 1000000000)
+
+
+@other_partition
+def test_failed_copy(tmpdir):
+    """A copy which doesn't match leaves the original alone and nothing at
+    the destination
+    """
+    source = os.path.join(tmpdir, "source.avi")
+    open(source, "wb").write("video" * 1000)
+    destination = os.path.join(tmpdir, "destination.avi")
+
+    def bad_copy(source, destination, **kwargs):
+        open(destination, "wb").write("vidoe" * 1000)
+
+    original = renamer.copy_file
+    renamer.copy_file = bad_copy
+    try:
+        renamer.move_file(source, destination, always_move=True)
+    except OSError, e:
+        assert "wrong contents" in str(e), e
+    else:
+        raise AssertionError("Bad copy not noticed")
+    finally:
+        renamer.copy_file = original
+    assertEquals(os.listdir(tmpdir), ["source.avi"])
+    assertEquals(open(source, "rb").read(), "video" * 1000)
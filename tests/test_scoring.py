@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+
+"""Tests the search result scorers
+"""
+
+from helpers import assertEquals
+
+from videonamer.config import Config
+from videonamer.config_defaults import defaults
+from videonamer import scoring
+from videonamer.scoring import NgramScorer, DifflibScorer
+
+
+class Result(object):
+
+    def __init__(self, title, year=None, aliases=()):
+        self.title = title
+        self.year = year
+        self.aliases = list(aliases)
+
+    def __repr__(self):
+        return "<Result %s (%s)>" % (self.title, self.year)
+
+
+def _title(result):
+    return result.title
+
+
+def test_ngram_scores():
+    """Normalised names score 1, anagrams (which quick_ratio scores 1)
+    score low
+    """
+    scorer = NgramScorer()
+    assertEquals(scorer.scores(u"the.office.us", [u"The Office (US)"]), [1.0])
+    assertEquals(DifflibScorer().scores(u"listen", [u"silent"]), [1.0])
+    assert scorer.scores(u"listen", [u"silent"])[0] < 0.2
+
+
+def test_numpy_matches_python():
+    """Scores are the same with and without numpy
+    """
+    if scoring.numpy is None:
+        return
+    scorer = NgramScorer()
+    names = [u"Star Trek %d" % i for i in range(scoring.NUMPY_MIN_BATCH)]
+    with_numpy = scorer.scores(u"star.trek", names)
+    saved, scoring.numpy = scoring.numpy, None
+    try:
+        assertEquals(scorer.scores(u"star.trek", names), with_numpy)
+    finally:
+        scoring.numpy = saved
+
+
+def test_rank_ties():
+    """Equal scores prefer the year in the query, then title over alias
+    """
+    scorer = NgramScorer()
+    old, new = Result(u"Doctor Who", 1963), Result(u"Doctor Who", 2005)
+    ranked = scorer.rank(u"Doctor Who (2005)", [old, new], _title)
+    assertEquals([r for r, _ in ranked], [new, old])
+    ranked = scorer.rank(u"Doctor Who", [old, new], _title, year=1963)
+    assertEquals([r for r, _ in ranked], [old, new])
+
+    alias = Result(u"Forbrydelsen", aliases=[u"The Killing"])
+    title = Result(u"The Killing")
+    ranked = scorer.rank(u"the killing", [alias, title], _title)
+    assertEquals([(r, s) for r, s in ranked], [(title, 1.0), (alias, 1.0)])
+
+
+def test_default_abbreviations():
+    """The default scorer scores abbreviated names as well as quick_ratio
+    did, which the selectors' thresholds were chosen for
+    """
+    Config['scorer'] = defaults['scorer']
+    names = [(u"law and order svu", u"Law & Order: Special Victims Unit"),
+             (u"star trek tng", u"Star Trek: The Next Generation")]
+    for name, title in names:
+        assertEquals(scoring.get_scorer().scores(name, [title]),
+                     DifflibScorer().scores(name, [title]))
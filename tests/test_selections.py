@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+
+"""Tests remembering search selections between runs
+"""
+
+import os
+import shutil
+import tempfile
+
+from helpers import assertEquals
+
+from videonamer import lookup
+from videonamer.catalog import import_dumps
+from videonamer.config import Config
+from videonamer.fakeserver import FakeProviderServer
+from videonamer.selector import ConsoleSelector
+from videonamer.selections import recall, remember, forget, list_selections
+from videonamer.state import get_state, save_state
+from videonamer.tv import TvInfo
+
+
+DUMP = """
+{"series": [
+    {"id": 30, "SeriesName": "Treme", "FirstAired": "2010-04-11",
+     "episodes": [
+        {"SeasonNumber": 1, "EpisodeNumber": 1,
+         "EpisodeName": "Do You Know What It Means"}]},
+    {"id": 31, "SeriesName": "Hawaii Five-0", "FirstAired": "1968-09-20",
+     "episodes": [
+        {"SeasonNumber": 1, "EpisodeNumber": 1, "EpisodeName": "Cocoon"}]},
+    {"id": 32, "SeriesName": "Hawaii Five-0", "FirstAired": "2010-09-20",
+     "episodes": [
+        {"SeasonNumber": 1, "EpisodeNumber": 1, "EpisodeName": "Ohana"}]}
+ ]}
+"""
+
+
+def test_remember_and_forget():
+    """Selections are stored by media type and normalised query
+    """
+    tmpdir = tempfile.mkdtemp()
+    try:
+        Config.update(cache_dir=tmpdir, remember_selections=True)
+        remember('tv', u"The.Office.US", 73244, u"The Office (US)")
+        remember('movie', u"the office us", 1, u"Not a series")
+        save_state()
+
+        assertEquals(recall('tv', u"the office (US)"), 73244)
+        assertEquals([s[:4] for s in list_selections()],
+                     [(u'movie', u'the office us', 1, u"Not a series"),
+                      (u'tv', u'the office us', 73244, u"The Office (US)")])
+
+        assertEquals(forget(u"The Office US", kind='tv'), 1)
+        assertEquals(recall('tv', u"the office us"), None)
+        assertEquals(forget(None), 1)
+        assertEquals(list_selections(), [])
+
+        Config['remember_selections'] = False
+        remember('tv', u"Scrubs", 76156, u"Scrubs")
+        assertEquals(recall('tv', u"Scrubs"), None)
+    finally:
+        Config['remember_selections'] = True
+        shutil.rmtree(tmpdir)
+
+
+def test_remembered_series_skips_search():
+    """A remembered series is fetched by id, without searching
+    """
+    tmpdir = tempfile.mkdtemp()
+    records = [{'kind': 'tv', 'id': 70, 'title': u"Shameless (US)",
+                'aliases': [u"Shameless"],
+                'episodes': [{'seasonnumber': u"1", 'episodenumber': u"1",
+                              'episodename': u"Pilot"}]}]
+    server = FakeProviderServer(records).start()
+    Config.update(force_name=None, force_id=None, catalog_path=None,
+                  catalog_only=False, notfound_cache_ttl=0, cache_dir=tmpdir,
+                  remember_selections=True,
+                  tvdb_base_url=server.tvdb_base_url)
+    try:
+        # as if chosen on an earlier run
+        remember('tv', u"shameless", 70, u"Shameless (US)")
+
+        info = TvInfo("shameless.s01e01.avi")
+        info.populate_from_db()
+        assertEquals(info.seriesname, u"Shameless (US)")
+        assertEquals(info.episodename, [u"Pilot"])
+        assertEquals(server.get_stats()['requests'], 2)
+    finally:
+        Config['tvdb_base_url'] = None
+        server.stop()
+        shutil.rmtree(tmpdir)
+
+
+def test_only_choices_remembered():
+    """Series picked automatically are not remembered, those the user
+    chose are
+    """
+    tmpdir = tempfile.mkdtemp()
+    dump = os.path.join(tmpdir, "dump.json")
+    open(dump, "w").write(DUMP)
+    import_dumps([dump], os.path.join(tmpdir, "catalog.idx"))
+
+    def do_select(self, name, ratiomap, candidate_name):
+        return [c for c, ratio in ratiomap if c.id == 32][0]
+
+    original = ConsoleSelector.do_select
+    ConsoleSelector.do_select = do_select
+    Config.update(force_name=None, force_id=None, cache_dir=tmpdir,
+                  catalog_path=os.path.join(tmpdir, "catalog.idx"),
+                  catalog_only=True, notfound_cache_ttl=0,
+                  remember_selections=True, title_index=False,
+                  select_first=False, auto_select_confidence=None)
+    try:
+        info = TvInfo("treme.s01e01.avi")
+        info.populate_from_db()
+        assertEquals(info.episodename, [u"Do You Know What It Means"])
+        assertEquals(recall('tv', u"treme"), None)
+
+        info = TvInfo("hawaii.five-0.s01e01.avi")
+        info.populate_from_db()
+        assertEquals(info.episodename, [u"Ohana"])
+        assertEquals(recall('tv', u"hawaii five-0"), 32)
+    finally:
+        ConsoleSelector.do_select = original
+        Config.update(catalog_path=None, catalog_only=False,
+                      title_index=True, auto_select_confidence=0.8)
+        shutil.rmtree(tmpdir)
+
+
+def test_tvdb_choice():
+    """thetvdb.com search results are chosen between by the selector
+    """
+    tmpdir = tempfile.mkdtemp()
+    episodes = [(1980, u"Don't Eat the Snow in Hawaii"), (2018, u"Pilot")]
+    records = [{'kind': 'tv', 'id': 80 + i, 'title': u"Magnum P.I.",
+                'data': {'firstaired': u"%s-09-28" % year},
+                'episodes': [{'seasonnumber': u"1", 'episodenumber': u"1",
+                              'episodename': name}]}
+               for i, (year, name) in enumerate(episodes)]
+    server = FakeProviderServer(records).start()
+    asked = []
+
+    def do_select(self, name, ratiomap, candidate_name):
+        asked.append(name)
+        return [c for c, ratio in ratiomap if c.id == 81][0]
+
+    original = ConsoleSelector.do_select
+    ConsoleSelector.do_select = do_select
+    Config.update(force_name=None, force_id=None, catalog_path=None,
+                  catalog_only=False, notfound_cache_ttl=0, cache_dir=tmpdir,
+                  remember_selections=True, title_index=False,
+                  select_first=False, auto_select_confidence=None,
+                  tvdb_base_url=server.tvdb_base_url)
+    try:
+        info = TvInfo("magnum.p.i.s01e01.avi")
+        info.populate_from_db()
+        assertEquals(info.episodename, [u"Pilot"])
+        assertEquals(asked, [u"magnum p i"])
+        assertEquals(recall('tv', u"magnum p i"), 81)
+    finally:
+        ConsoleSelector.do_select = original
+        Config.update(tvdb_base_url=None, title_index=True,
+                      auto_select_confidence=0.8)
+        server.stop()
+        shutil.rmtree(tmpdir)
+
+
+def test_tvdb_prompt_without_slot():
+    """No thetvdb.com slot is held while the user chooses a search result
+    """
+    tmpdir = tempfile.mkdtemp()
+    records = [{'kind': 'tv', 'id': 120 + i, 'title': u"Columbo",
+                'data': {'firstaired': u"%s-02-20" % year},
+                'episodes': [{'seasonnumber': u"1", 'episodenumber': u"1",
+                              'episodename': name}]}
+               for i, (year, name) in enumerate([(1971, u"Murder by the Book"),
+                                                 (2024, u"Pilot")])]
+    server = FakeProviderServer(records).start()
+    free = []
+
+    def do_select(self, name, ratiomap, candidate_name):
+        semaphore = lookup._provider_semaphores['tvdb']
+        free.append(semaphore.acquire(False))
+        if free[-1]:
+            semaphore.release()
+        return [c for c, ratio in ratiomap if c.id == 120][0]
+
+    original = ConsoleSelector.do_select
+    ConsoleSelector.do_select = do_select
+    limits = Config['lookup_provider_limits']
+    semaphore = lookup._provider_semaphores.pop('tvdb', None)
+    Config.update(force_name=None, force_id=None, catalog_path=None,
+                  catalog_only=False, notfound_cache_ttl=0, cache_dir=tmpdir,
+                  remember_selections=False, title_index=False,
+                  select_first=False, auto_select_confidence=None,
+                  tvdb_base_url=server.tvdb_base_url,
+                  lookup_provider_limits={'tvdb': 1})
+    try:
+        info = TvInfo("columbo.s01e01.avi")
+        info.populate_from_db()
+        assertEquals(info.episodename, [u"Murder by the Book"])
+        assertEquals(free, [True])
+    finally:
+        ConsoleSelector.do_select = original
+        Config.update(tvdb_base_url=None, title_index=True,
+                      auto_select_confidence=0.8, remember_selections=True,
+                      lookup_provider_limits=limits)
+        if semaphore is None:
+            lookup._provider_semaphores.pop('tvdb', None)
+        else:
+            lookup._provider_semaphores['tvdb'] = semaphore
+        server.stop()
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+
+"""Tests resolving known titles from the local title index
+"""
+
+import shutil
+import tempfile
+
+from helpers import assertEquals
+
+from videonamer.config import Config
+from videonamer.fakeserver import FakeProviderServer
+from videonamer.selections import list_selections
+from videonamer.state import save_state, StateFile
+from videonamer.titleindex import TitleIndex, add_title, get_title_index
+from videonamer.tv import TvInfo
+
+
+def test_resolve():
+    """Only confident, unambiguous matches are resolved
+    """
+    Config.update(title_index_confidence=0.9, scorer='ngram')
+    index = TitleIndex()
+    index.add('tv', 76156, u"Scrubs", 2001)
+    index.add('tv', 78107, u"The Office", 2001)
+    index.add('tv', 73244, u"The Office (US)", 2005)
+    index.add('tv', 73244, u"The Office: An American Workplace", 2005)
+    index.add('tv', 76107, u"Doctor Who", 1963)
+    index.add('movie', 76156, u"Not a series", 2001)
+    assertEquals(len(index), 6)
+    assertEquals(index.add('tv', 76156, u"scrubs!", 2001), False)
+
+    assertEquals(index.resolve('tv', u"scrubs").id, 76156)
+    assertEquals(index.resolve('tv', u"the.office").id, 78107)
+    assertEquals(index.resolve('tv', u"the office us").id, 73244)
+    assertEquals(index.resolve('movie', u"scrubs"), None)
+    assertEquals(index.resolve('tv', u"shameless"), None)
+
+    # A series from another year is left to the search
+    assertEquals(index.resolve('tv', u"doctor who", year=2005), None)
+    assertEquals(index.resolve('tv', u"doctor who (1963)").id, 76107)
+
+    # As is a name matching two series equally well
+    index.add('tv', 1, u"Castle", 2009)
+    index.add('tv', 2, u"Castle", 1999)
+    assertEquals(index.resolve('tv', u"castle"), None)
+    assertEquals(index.resolve('tv', u"castle", year=2009).id, 1)
+
+
+def test_known_series_skips_search():
+    """A series seen on an earlier run is fetched by id, without searching
+    """
+    tmpdir = tempfile.mkdtemp()
+    records = [{'kind': 'tv', 'id': 71, 'title': u"Shameless (US)",
+                'episodes': [{'seasonnumber': u"1", 'episodenumber': u"1",
+                              'episodename': u"Pilot"}]}]
+    server = FakeProviderServer(records).start()
+    Config.update(force_name=None, force_id=None, catalog_path=None,
+                  catalog_only=False, notfound_cache_ttl=0, cache_dir=tmpdir,
+                  remember_selections=True, title_index=True,
+                  tvdb_base_url=server.tvdb_base_url)
+    try:
+        add_title('tv', 71, u"Shameless (US)", u"2011")
+        save_state()
+        assertEquals(StateFile(tmpdir + "/titles.json").items(),
+                     [(u"tv\t71", {u'title': u"Shameless (US)",
+                                   u'year': 2011})])
+
+        info = TvInfo("shameless.us.s01e01.avi")
+        info.populate_from_db()
+        assertEquals(info.seriesname, u"Shameless (US)")
+        assertEquals(info.episodename, [u"Pilot"])
+        assertEquals(server.get_stats()['requests'], 2)
+        assertEquals(len(get_title_index()), 1)
+        # found without a search, so there was no selection to remember
+        assertEquals(list_selections(), [])
+    finally:
+        Config['tvdb_base_url'] = None
+        server.stop()
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+
+"""Tests scheduling copies by device, and limiting their rate
+"""
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+
+from helpers import assertEquals
+
+from videonamer.config import Config
+from videonamer.transfers import DeviceScheduler, get_scheduler
+from videonamer import renamer
+
+
+def test_streams():
+    """Copies sharing a device wait for each other, others don't
+    """
+    scheduler = DeviceScheduler(streams=1)
+    running = set()
+    overlaps = []
+    lock = threading.Lock()
+
+    def copy(name, devices, seconds):
+        with scheduler.slot(devices):
+            with lock:
+                overlaps.extend((name, other) for other in running)
+                running.add(name)
+            time.sleep(seconds)
+            with lock:
+                running.discard(name)
+
+    threads = [threading.Thread(target=copy, args=args)
+               for args in [("a", [1, 2], 0.1), ("b", [2, 3], 0.1),
+                            ("c", [4, 5], 0.5)]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assertEquals(set(frozenset(pair) for pair in overlaps),
+                 set([frozenset("ac"), frozenset("bc")]))
+
+
+def test_rate_limit():
+    """Copies keep to the rate limit of their devices
+    """
+    Config.update(test_mode=False, copy_rate_limit=4,
+                  copy_buffer_size=256 * 1024)
+    tmpdir = tempfile.mkdtemp()
+    source = os.path.join(tmpdir, "source")
+    data = os.urandom(6 * 1024 * 1024)
+    open(source, "wb").write(data)
+    try:
+        assert get_scheduler().rate == 4 * 1024 * 1024
+        start = time.time()
+        renamer.copy_into_place(source, os.path.join(tmpdir, "copy"))
+        elapsed = time.time() - start
+        # 2MB may go at once, the other 4MB take a second
+        assert 0.8 < elapsed < 3, elapsed
+        assertEquals(open(os.path.join(tmpdir, "copy"), "rb").read(), data)
+    finally:
+        Config.update(copy_rate_limit=0, copy_buffer_size=8 * 1024 * 1024)
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+
+
+"""Tests searching for series names with and without the year
+"""
+
+import shutil
+import tempfile
+
+from helpers import assertEquals
+
+from videonamer.config import Config
+from videonamer.fakeserver import FakeProviderServer
+from videonamer.state import get_state
+from videonamer.tv import TvInfo
+
+
+def _series(uid, title, episodename):
+    return {'kind': 'tv', 'id': uid, 'title': title,
+            'episodes': [{'seasonnumber': u"1", 'episodenumber': u"1",
+                          'episodename': episodename}]}
+
+
+RECORDS = [
+    _series(1, u"Castle", u"Flowers for Your Grave"),
+    _series(2, u"Doctor Who (2005)", u"Rose"),
+    _series(3, u"Dallas", u"Changing of the Guard"),
+    _series(4, u"Cosmos (2014)", u"Standing Up in the Milky Way"),
+    _series(5, u"Battlestar Galactica", u"33"),
+]
+
+server = None
+tmpdir = None
+
+
+def setup():
+    global server, tmpdir
+    server = FakeProviderServer(RECORDS).start()
+    tmpdir = tempfile.mkdtemp()
+    Config.update(force_name=None, force_id=None, catalog_path=None,
+                  catalog_only=False, notfound_cache_ttl=0,
+                  cache_dir=tmpdir, tvdb_base_url=server.tvdb_base_url)
+
+
+def teardown():
+    Config.update(tvdb_base_url=None, year_query_mode='serial')
+    server.stop()
+    shutil.rmtree(tmpdir)
+
+
+def _lookup(mode, filename):
+    """Returns the episode name and the number of requests made
+    """
+    Config['year_query_mode'] = mode
+    before = server.get_stats()['requests']
+    info = TvInfo(filename)
+    info.populate_from_db()
+    return info.episodename, server.get_stats()['requests'] - before
+
+
+def test_serial_fallback():
+    """Without a match for the year, the name is searched on its own
+    """
+    assertEquals(_lookup('serial', "Castle (2009) - 1x01.avi"),
+                 ([u"Flowers for Your Grave"], 4))
+
+
+def test_parallel():
+    """Both searches are made at once, and the year match is preferred
+    """
+    assertEquals(_lookup('parallel', "Doctor Who (2005) - 1x01.avi")[0],
+                 [u"Rose"])
+    assertEquals(
+        _lookup('parallel', "Battlestar Galactica (2004) - 1x01.avi")[0],
+        [u"33"])
+
+
+def test_learn():
+    """The form of name which found a series is searched for first
+    """
+    state = get_state("year_queries.json")
+    state.set(u"dallas", 'plain')
+    assertEquals(_lookup('learn', "Dallas (2012) - 1x01.avi"),
+                 ([u"Changing of the Guard"], 3))
+
+    assertEquals(_lookup('learn', "Cosmos (2014) - 1x01.avi")[0],
+                 [u"Standing Up in the Milky Way"])
+    assertEquals(state.get(u"cosmos"), 'year')
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+
+"""Benchmarks copying large files between directories
+
+Copies a file of --size MB from the source directory to the destination
+directory (put them on different filesystems to measure moves between
+disks) with shutil.copyfile and each method of videonamer.copier, and
+reports the throughput of each, including forcing the copy to disk.
+--sparse makes the file mostly holes, as a preallocated download would be.
+
+    python tools/bench_copy.py [--size 2048] [--sparse] source_dir dest_dir
+
+Unless the page cache is dropped between runs (as root:
+"sync; echo 3 > /proc/sys/vm/drop_caches") the source is read from memory
+after the first run, which favours the later methods; --repeat helps.
+"""
+
+import os
+import sys
+import time
+import shutil
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from videonamer.config import Config
+from videonamer import copier
+
+
+def make_source(path, size, sparse):
+    chunk = os.urandom(1024 * 1024)
+    f = open(path, "wb")
+    if sparse:
+        # 1MB of data every 64MB
+        for offset in xrange(0, size, 64 * 1024 * 1024):
+            f.seek(offset)
+            f.write(chunk)
+        f.truncate(size)
+    else:
+        for i in xrange(size / len(chunk)):
+            f.write(chunk)
+        f.write(chunk[:size % len(chunk)])
+    f.close()
+
+
+def timed(copy, source, destination):
+    if os.path.exists(destination):
+        os.remove(destination)
+    start = time.time()
+    copy(source, destination)
+    fd = os.open(destination, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+    return time.time() - start
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] source_dir dest_dir")
+    parser.add_option("--size", type="int", default=2048,
+                      help="size of the file copied, in MB")
+    parser.add_option("--sparse", action="store_true", default=False,
+                      help="copy a file which is mostly holes")
+    parser.add_option("--repeat", type="int", default=3,
+                      help="copies with each method (the best is shown)")
+    parser.add_option("--buffer-size", type="int", default=None,
+                      help="copy_buffer_size for the buffered method, in KB")
+    opts, args = parser.parse_args()
+    if len(args) != 2:
+        parser.error("Give a source and a destination directory")
+    if opts.buffer_size:
+        Config['copy_buffer_size'] = opts.buffer_size * 1024
+
+    size = opts.size * 1024 * 1024
+    source = os.path.join(args[0], "videonamer-bench-source")
+    destination = os.path.join(args[1], "videonamer-bench-copy")
+    print "Writing %dMB%s source file..." % (opts.size,
+                                              " sparse" if opts.sparse else "")
+    make_source(source, size, opts.sparse)
+
+    methods = [("shutil.copyfile", shutil.copyfile)]
+    for method in copier.COPY_METHODS[1:]:
+        methods.append((method, lambda s, d, method=method:
+                        copier.copy_file(s, d, method=method)))
+    try:
+        print "%-16s %10s %10s" % ("method", "MB/s", "seconds")
+        for name, copy in methods:
+            best = min(timed(copy, source, destination)
+                       for i in range(opts.repeat))
+            print "%-16s %10.1f %10.2f" % (name, opts.size / best, best)
+        blocks = os.stat(destination).st_blocks * 512
+        print
+        print "Last copy uses %.1fMB on disk" % (blocks / 1024.0 / 1024)
+    finally:
+        for path in (source, destination):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+if __name__ == '__main__':
+    main()
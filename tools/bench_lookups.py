@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+"""Benchmarks the lookup pipeline against the fake providers
+
+Serves the recorded responses in tools/fixtures (or the data dumps given)
+with videonamer.fakeserver, adding latency as the real services would,
+and looks up a filename for every episode and movie in them with
+main.lookupFile on a LookupPool, as a run would. Reports the throughput,
+the latency of each file (median and tail), and the requests made.
+
+    python tools/bench_lookups.py [--workers 4] [--latency 0.1] [dump ...]
+
+Series and movies are only searched for once per run, so --repeat (files
+per episode) shows how well later files of a series reuse the lookup.
+Each run starts without any cached data, so compare settings with
+separate runs.
+"""
+
+import os
+import re
+import sys
+import time
+import shutil
+import logging
+import tempfile
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from videonamer.config import Config
+from videonamer.fakeserver import FakeProviderServer, load_records
+from videonamer.lookup import LookupPool
+from videonamer import httppool
+from videonamer import main as videonamer_main
+from videonamer import movie
+
+log = logging.getLogger("bench_lookups")
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        "fixtures")
+
+
+def filenames(records, repeat, kinds):
+    """Returns a filename for each episode and movie in records (repeat
+    times each, as for different releases of the same episode)
+    """
+    names = []
+    for record in records:
+        if record['kind'] not in kinds:
+            continue
+        title = ".".join(re.sub(r"[^\w ]", "", record['title']).split())
+        if record['kind'] == 'movie':
+            names.extend("%s.%s.r%d.mkv" % (title, record['year'], i)
+                         for i in range(repeat))
+            continue
+        for episode in record['episodes']:
+            names.extend("%s.s%02de%02d.r%d.avi" % (
+                             title, int(episode['seasonnumber']),
+                             int(episode['episodenumber']), i)
+                         for i in range(repeat))
+    return names
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] [dump ...]")
+    parser.add_option("--workers", type="int", default=4,
+                      help="lookup_workers (default %default)")
+    parser.add_option("--latency", type="float", default=0.1,
+                      help="seconds added to every response (default"
+                           " %default)")
+    parser.add_option("--jitter", type="float", default=0.02,
+                      help="mean extra delay, exponentially distributed"
+                           " (default %default)")
+    parser.add_option("--error-rate", type="float", default=0,
+                      help="fraction of requests answered with a 503")
+    parser.add_option("--repeat", type="int", default=1,
+                      help="files per episode or movie (default %default)")
+    parser.add_option("--kinds", default="tv,movie",
+                      help="media types to look up (default %default)")
+    parser.add_option("--pool-size", type="int", default=4,
+                      help="http_pool_size (default %default)")
+    opts, args = parser.parse_args()
+
+    # videonamer.main configures logging when imported
+    logging.getLogger().setLevel(logging.CRITICAL)
+    log.setLevel(logging.ERROR)
+    records = load_records(args or [os.path.join(FIXTURES, name)
+                                     for name in sorted(os.listdir(FIXTURES))])
+    paths = filenames(records, opts.repeat, opts.kinds.split(","))
+
+    server = FakeProviderServer(records, latency=opts.latency,
+                                jitter=opts.jitter,
+                                error_rate=opts.error_rate, seed=1).start()
+    tmpdir = tempfile.mkdtemp()
+    Config.update(tvdb_base_url=server.tvdb_base_url,
+                  tmdb_base_url=server.tmdb_base_url,
+                  cache_dir=tmpdir, catalog_path=None, catalog_only=False,
+                  lookup_workers=opts.workers, lookup_prefetch=0,
+                  select_first=True, force_name=None, force_id=None,
+                  http_pool_size=opts.pool_size)
+    movie.use_tmdb_server(server.tmdb_base_url)
+    httppool.install(opts.pool_size, Config['provider_timeout'] or None)
+
+    latencies = []
+
+    def timed(path):
+        start = time.time()
+        try:
+            return videonamer_main.lookupFile(path)
+        finally:
+            latencies.append(time.time() - start)
+
+    found = failed = errors = 0
+    try:
+        start = time.time()
+        pool = LookupPool(timed, workers=opts.workers)
+        for path, info, error in pool.imap(paths):
+            if error is not None:
+                log.error("Error looking up %s: %s" % (path, error[1]))
+                errors += 1
+            elif info is None:
+                failed += 1
+            else:
+                found += 1
+        elapsed = time.time() - start
+    finally:
+        stats = server.get_stats()
+        server.stop()
+        movie.use_tmdb_server(None)
+        httppool.install(0)
+        shutil.rmtree(tmpdir)
+
+    print "%d files, %d workers, %.0fms latency" % (len(paths), opts.workers,
+                                                   opts.latency * 1000)
+    print "found %d, not found %d, errors %d" % (found, failed, errors)
+    print "%.1f files/s (%.2fs)" % (len(paths) / elapsed, elapsed)
+    print ("latency: median %.0fms  p90 %.0fms  p99 %.0fms  max %.0fms"
+           % tuple(1000 * v for v in (percentile(latencies, 0.5),
+                                      percentile(latencies, 0.9),
+                                      percentile(latencies, 0.99),
+                                      max(latencies))))
+    print "requests %d, connections %d" % (stats.get('requests', 0),
+                                           stats.get('connections', 0))
+
+
+if __name__ == '__main__':
+    main()
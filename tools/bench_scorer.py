@@ -0,0 +1,204 @@
+#!/usr/bin/env python
+
+"""Benchmarks the search result scorers
+
+Reports how many candidate names per second each scorer handles, and for a
+set of noisy filename-style queries how often the right title is ranked
+first, how often it is picked without asking the user (with and without
+automatic disambiguation), and how often an automatic pick is wrong.
+
+    python tools/bench_scorer.py [--catalog index] [--candidates 2000]
+"""
+
+import os
+import sys
+import time
+import random
+import logging
+from optparse import OptionParser
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                ".."))
+
+from videonamer.config import Config
+from videonamer.catalog import CatalogIndex, CatalogEntry
+from videonamer.selector import Selector
+from videonamer.tvnamer_exceptions import MatchingDataNotFound
+from videonamer import scoring
+from videonamer.scoring import query_year
+
+
+TITLES = [
+    (u"The Office", 2001), (u"The Office (US)", 2005),
+    (u"Office Space", 1999), (u"Shameless", 2004),
+    (u"Shameless (US)", 2011), (u"Doctor Who", 1963),
+    (u"Doctor Who (2005)", 2005), (u"Battlestar Galactica", 1978),
+    (u"Battlestar Galactica (2003)", 2003), (u"House of Cards", 1990),
+    (u"House of Cards (US)", 2013), (u"The Killing", 2011),
+    (u"Forbrydelsen", 2007), (u"Life on Mars", 2006),
+    (u"Life on Mars (US)", 2008), (u"Being Human", 2008),
+    (u"Being Human (US)", 2011), (u"The Matrix", 1999),
+    (u"The Matrix Reloaded", 2003), (u"The Matrix Revolutions", 2003),
+    (u"Star Wars", 1977), (u"Star Trek", 1966),
+    (u"Star Trek: The Next Generation", 1987), (u"Star Trek", 2009),
+    (u"Scrubs", 2001), (u"Firefly", 2002), (u"Serenity", 2005),
+    (u"Amelie", 2001), (u"Castle", 2009), (u"Castle Rock", 2018),
+    (u"The Castle", 1997), (u"Sherlock", 2010),
+    (u"Sherlock Holmes", 2009), (u"Sherlock Holmes: A Game of Shadows", 2011),
+    (u"Elementary", 2012), (u"Cosmos", 1980),
+    (u"Cosmos: A Spacetime Odyssey", 2014), (u"The Wire", 2002),
+    (u"Wired", 2008), (u"Breaking Bad", 2008),
+]
+
+
+class Title(object):
+
+    def __init__(self, title, year, uid):
+        self.title = title
+        self.year = year
+        self.id = uid
+        self.aliases = []
+
+
+class CountingSelector(Selector):
+    """Picks the best match instead of prompting, counting the prompts
+    """
+
+    def __init__(self):
+        super(CountingSelector, self).__init__()
+        self.prompts = 0
+
+    def do_select(self, name, ratiomap, candidate_name):
+        self.prompts += 1
+        return ratiomap[0][0]
+
+
+def noisy(rng, title, year):
+    """Turns a title into something like the name part of a filename
+    """
+    name = title
+    for suffix in (u" (US)", u" (2005)", u" (2003)"):
+        if name.endswith(suffix) and rng.random() < 0.5:
+            name = name[:-len(suffix)]
+    if name.startswith(u"The ") and rng.random() < 0.3:
+        name = name[4:]
+    name = name.replace(u":", u"")
+    name = rng.choice([u".", u" ", u"_"]).join(name.split())
+    if rng.random() < 0.5:
+        name = name.lower()
+    if rng.random() < 0.3:
+        name = u"%s (%d)" % (name, year)
+    return name
+
+
+def cases(titles, rng, count):
+    """Yields (query, correct candidate, candidates), the candidates being
+    every title sharing a word with the correct one
+    """
+    words = {}
+    for t in titles:
+        for word in t.title.lower().split():
+            words.setdefault(word, []).append(t)
+    for i in range(count):
+        correct = rng.choice(titles)
+        candidates = set([correct])
+        for word in correct.title.lower().split():
+            if len(words[word]) < 50:
+                candidates.update(words[word])
+        candidates = sorted(candidates, key=lambda t: t.id)
+        rng.shuffle(candidates)
+        yield noisy(rng, correct.title, correct.year), correct, candidates
+
+
+def accuracy(name, titles, count, confidence=None):
+    Config['scorer'] = name
+    Config['auto_select_confidence'] = confidence
+    rng = random.Random(1)
+    ranked = automatic = wrong = 0
+    for query, correct, candidates in cases(titles, rng, count):
+        if scoring.get_scorer().rank(query, candidates,
+                                     lambda t: t.title)[0][0] is correct:
+            ranked += 1
+        selector = CountingSelector()
+        try:
+            chosen = selector.select(query, candidates, lambda t: t.title,
+                                     year=query_year(query))
+        except MatchingDataNotFound:
+            continue
+        if not selector.prompts:
+            automatic += 1
+            if chosen is not correct:
+                wrong += 1
+    label = name if confidence is None else "%s+auto" % name
+    print "%-12s ranked first %5.1f%%   automatic %5.1f%%   wrong %5.1f%%" % (
+        label, 100.0 * ranked / count, 100.0 * automatic / count,
+        100.0 * wrong / count)
+
+
+def throughput(name, titles, candidates, queries, use_numpy=None):
+    Config['scorer'] = name
+    scorer = scoring.get_scorer()
+    rng = random.Random(2)
+    names = [rng.choice(titles).title + u" %d" % i for i in range(candidates)]
+    query_names = [noisy(rng, t.title, t.year)
+                   for t in rng.sample(titles, min(queries, len(titles)))]
+
+    saved = scoring.numpy
+    if use_numpy is False:
+        scoring.numpy = None
+    try:
+        start = time.time()
+        for query in query_names:
+            scorer.scores(query, names)
+        elapsed = time.time() - start
+    finally:
+        scoring.numpy = saved
+
+    label = name if use_numpy is None else "%s%s" % (
+                name, " (numpy)" if use_numpy else " (python)")
+    print "%-17s %10.0f candidates/s" % (
+        label, len(names) * len(query_names) / elapsed)
+
+
+def main():
+    parser = OptionParser(usage="%prog [options]")
+    parser.add_option("--catalog", help="also use the titles in this"
+                                        " catalog index")
+    parser.add_option("--candidates", type="int", default=2000,
+                      help="candidates per query for the throughput test")
+    parser.add_option("--queries", type="int", default=40,
+                      help="queries for the throughput test")
+    parser.add_option("--cases", type="int", default=2000,
+                      help="queries for the accuracy test")
+    parser.add_option("--confidence", type="float", default=0.8,
+                      help="auto_select_confidence for the last accuracy"
+                           " test")
+    opts, args = parser.parse_args()
+
+    titles = [Title(t, y, i) for i, (t, y) in enumerate(TITLES)]
+    if opts.catalog:
+        index = CatalogIndex(opts.catalog)
+        titles.extend(Title(e.title, e.year, len(titles) + i)
+                      for i, e in enumerate(CatalogEntry(r)
+                                            for r in index.records()))
+    Config['select_first'] = False
+    logging.getLogger('videonamer.disambiguation').setLevel(logging.WARNING)
+
+    print "Throughput (%d candidates x %d queries)" % (opts.candidates,
+                                                      opts.queries)
+    throughput('difflib', titles, opts.candidates, opts.queries)
+    if scoring.numpy is not None:
+        throughput('ngram', titles, opts.candidates, opts.queries, True)
+        throughput('ngram', titles, opts.candidates, opts.queries, False)
+    else:
+        throughput('ngram', titles, opts.candidates, opts.queries)
+
+    print
+    print "Accuracy (%d queries, %d titles)" % (opts.cases, len(titles))
+    accuracy('difflib', titles, opts.cases)
+    accuracy('ngram', titles, opts.cases)
+    accuracy('ngram', titles, opts.cases, opts.confidence)
+
+
+if __name__ == '__main__':
+    main()
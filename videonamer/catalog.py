@@ -0,0 +1,468 @@
+#!/usr/bin/env python
+
+"""Offline catalog of series, episodes and movies for tvnamer/movienamer
+
+Provider data dumps (JSON or XML) are imported into a compact, read-only
+index file. The index is memory-mapped and holds two sorted tables, one by
+media type and normalised title, one by media type and id, so lookups are
+binary searches instead of HTTP requests.
+"""
+__all__ = ('CatalogIndex', 'CatalogEntry', 'normalize_title',
+           'build_index', 'import_dumps', 'load_dump', 'get_catalog',
+           'make_show')
+
+import os
+import re
+import mmap
+import struct
+import logging
+import datetime
+import threading
+import unicodedata
+from collections import namedtuple
+from xml.etree import cElementTree as ElementTree
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from tvdb_api import Show, Season, Episode
+
+from config import Config
+from tvnamer_exceptions import ConfigValueError
+
+log = logging.getLogger(__name__)
+
+MAGIC = "VNCAT\x01\x00\x00"
+KINDS = {'tv': 1, 'movie': 2}
+
+# magic, title count, id count, id table, title table, title keys
+HEADER = struct.Struct('<8sIIQQQ')
+# kind, id, record offset, record length
+ID_ENTRY = struct.Struct('<BQQI')
+# key offset (from start of title keys), key length, id table index
+TITLE_ENTRY = struct.Struct('<QHI')
+
+
+def normalize_title(title):
+    """Normalises a title for index keys: accents and punctuation are
+    removed, case is folded and whitespace collapsed.
+
+    >>> normalize_title(u"Am\\xe9lie: The Movie (2001)")
+    u'amelie the movie 2001'
+    """
+    if not isinstance(title, unicode):
+        title = title.decode('utf-8', 'ignore')
+    title = unicodedata.normalize('NFKD', title)
+    title = u"".join(c for c in title if not unicodedata.combining(c))
+    title = re.sub(r"[\W_]+", u" ", title.lower(), flags=re.UNICODE)
+    return title.strip()
+
+
+CatalogGenre = namedtuple('CatalogGenre', 'name')
+
+
+class CatalogEntry(object):
+    """A series or movie from the catalog, with the attributes the selectors
+    and info classes expect from search results
+    """
+
+    def __init__(self, record):
+        self.record = record
+        self.kind = record['kind']
+        self.id = record['id']
+        self.title = record['title']
+        self.year = record.get('year')
+        self.aliases = record.get('aliases', [])
+        self.userrating = record.get('userrating')
+        self.genres = [CatalogGenre(g) for g in record.get('genres', [])]
+        self.popularity = _number(record.get('popularity')
+                                  or record.get('data', {}).get('ratingcount'))
+
+        try:
+            self.releasedate = datetime.datetime.strptime(
+                                record['releasedate'], "%Y-%m-%d").date()
+        except (KeyError, TypeError, ValueError):
+            self.releasedate = self.year
+
+    @property
+    def episodes(self):
+        """The (season, episode) numbers of a series' episodes, or None for
+        movies
+        """
+        if 'episodes' not in self.record:
+            return None
+        numbers = set()
+        for episode in self.record['episodes']:
+            try:
+                numbers.add((int(episode['seasonnumber']),
+                             int(episode['episodenumber'])))
+            except (KeyError, ValueError):
+                pass
+        return numbers
+
+    def __eq__(self, other):
+        return (isinstance(other, CatalogEntry)
+                and (self.kind, self.id) == (other.kind, other.id))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash((self.kind, self.id))
+
+    def __repr__(self):
+        return "<CatalogEntry %s #%s: %s>" % (self.kind, self.id, self.title)
+
+
+def make_show(record):
+    """Builds a tvdb_api Show from a catalog series record, so it can be
+    used exactly like one retrieved from thetvdb.com
+    """
+    show = Show()
+    show.data.update(record.get('data', {}))
+    show.data[u'seriesname'] = record['title']
+    show.data[u'id'] = unicode(record['id'])
+
+    for epdata in record.get('episodes', []):
+        try:
+            seasno = int(float(epdata['seasonnumber']))
+            epno = int(float(epdata['episodenumber']))
+        except (KeyError, TypeError, ValueError):
+            continue
+
+        if seasno not in show:
+            dict.__setitem__(show, seasno, Season(show=show))
+        season = dict.__getitem__(show, seasno)
+        episode = Episode(season=season)
+        episode.update(epdata)
+        dict.__setitem__(season, epno, episode)
+
+    return show
+
+
+class CatalogIndex(object):
+    """Read-only access to a catalog index file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            self._file = open(path, 'rb')
+        except IOError, e:
+            raise ConfigValueError("Cannot open catalog %s: %s" % (path, e))
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        except (ValueError, mmap.error), e:
+            raise ConfigValueError("Cannot read catalog %s: %s" % (path, e))
+
+        if len(self._map) < HEADER.size:
+            raise ConfigValueError("%s is not a catalog index" % path)
+        (magic, self._n_titles, self._n_ids, self._ids_offset,
+         self._titles_offset, self._keys_offset) = HEADER.unpack_from(
+                                                        self._map, 0)
+        if magic != MAGIC:
+            raise ConfigValueError("%s is not a catalog index" % path)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+    def __len__(self):
+        return self._n_ids
+
+    def _id_entry(self, i):
+        return ID_ENTRY.unpack_from(self._map,
+                                    self._ids_offset + i * ID_ENTRY.size)
+
+    def _title_key(self, i):
+        key_off, key_len, id_index = TITLE_ENTRY.unpack_from(
+                    self._map, self._titles_offset + i * TITLE_ENTRY.size)
+        start = self._keys_offset + key_off
+        return self._map[start:start + key_len], id_index
+
+    def _record(self, id_index):
+        kind, uid, rec_off, rec_len = self._id_entry(id_index)
+        return json.loads(self._map[rec_off:rec_off + rec_len]
+                          .decode('utf-8'))
+
+    def get(self, kind, uid):
+        """Returns the record of the given media type and id, or None
+        """
+        target = (KINDS[kind], int(uid))
+        lo, hi = 0, self._n_ids
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._id_entry(mid)[:2] < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._n_ids and self._id_entry(lo)[:2] == target:
+            return self._record(lo)
+        return None
+
+    def search(self, kind, name, max_results=None):
+        """Returns records whose normalised title (or alias) equals name,
+        followed by those starting with it
+        """
+        if max_results is None:
+            max_results = Config['max_results']
+
+        key = chr(KINDS[kind]) + normalize_title(name).encode('utf-8')
+        lo, hi = 0, self._n_titles
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._title_key(mid)[0] < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        # The title keys are sorted, so exact matches come before titles
+        # that merely start with key
+        found, seen = [], set()
+        for i in xrange(lo, self._n_titles):
+            title_key, id_index = self._title_key(i)
+            if not title_key.startswith(key):
+                break
+            if id_index in seen:
+                continue
+            seen.add(id_index)
+            found.append(id_index)
+            if len(found) >= max_results:
+                break
+
+        return [self._record(i) for i in found]
+
+    def records(self, kind=None):
+        """Iterates over all records, optionally of one media type
+        """
+        for i in xrange(self._n_ids):
+            if kind is None or self._id_entry(i)[0] == KINDS[kind]:
+                yield self._record(i)
+
+
+def _title_keys(record):
+    titles = [record['title']] + list(record.get('aliases', []))
+    keys = set(normalize_title(t) for t in titles if t)
+    if record.get('year'):
+        keys.update(u"%s %s" % (k, record['year']) for k in list(keys))
+    return [k for k in keys if k]
+
+
+def build_index(records, path):
+    """Writes records to a catalog index file at path, replacing any
+    existing file
+    """
+    records = sorted(records, key=lambda r: (KINDS[r['kind']], r['id']))
+
+    blobs = [json.dumps(r, separators=(',', ':'), sort_keys=True)
+             .encode('utf-8') for r in records]
+
+    titles = []
+    for id_index, record in enumerate(records):
+        prefix = chr(KINDS[record['kind']])
+        for key in _title_keys(record):
+            titles.append((prefix + key.encode('utf-8'), id_index))
+    titles.sort()
+
+    ids_offset = HEADER.size + sum(len(b) for b in blobs)
+    titles_offset = ids_offset + ID_ENTRY.size * len(records)
+    keys_offset = titles_offset + TITLE_ENTRY.size * len(titles)
+
+    tmppath = path + ".tmp"
+    f = open(tmppath, 'wb')
+    try:
+        f.write(HEADER.pack(MAGIC, len(titles), len(records),
+                            ids_offset, titles_offset, keys_offset))
+        offset = HEADER.size
+        for blob in blobs:
+            f.write(blob)
+        for record, blob in zip(records, blobs):
+            f.write(ID_ENTRY.pack(KINDS[record['kind']], record['id'],
+                                  offset, len(blob)))
+            offset += len(blob)
+        key_off = 0
+        for key, id_index in titles:
+            f.write(TITLE_ENTRY.pack(key_off, len(key), id_index))
+            key_off += len(key)
+        for key, id_index in titles:
+            f.write(key)
+    finally:
+        f.close()
+    os.rename(tmppath, path)
+
+    log.debug("Wrote %d records (%d titles) to %s"
+              % (len(records), len(titles), path))
+
+
+def _year(value):
+    try:
+        return int(unicode(value)[:4])
+    except (TypeError, ValueError):
+        return None
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _aliases(value):
+    if not value:
+        return []
+    if isinstance(value, basestring):
+        return [a for a in value.split("|") if a]
+    return list(value)
+
+
+def _series_record(data, episodes):
+    data = dict((k.lower(), v) for k, v in data.items())
+    episodes = [dict((k.lower(), unicode(v)) for k, v in ep.items()
+                     if v is not None)
+                for ep in (data.pop('episodes', None) or episodes)]
+    title = data.pop('seriesname', None) or data.pop('title', None) \
+                                         or data.pop('name', None)
+    record = {
+        'kind': 'tv',
+        'id': int(data.pop('id')),
+        'title': title,
+        'year': _year(data.get('year') or data.get('firstaired')),
+        'aliases': _aliases(data.pop('aliasnames', None)),
+        'data': dict((k, unicode(v)) for k, v in data.items()
+                     if isinstance(v, (basestring, int, float))),
+        'episodes': episodes,
+    }
+    return record
+
+
+def _movie_record(data):
+    data = dict((k.lower(), v) for k, v in data.items())
+    releasedate = data.get('releasedate') or data.get('release_date')
+    genres = []
+    for genre in data.get('genres') or []:
+        genres.append(genre['name'] if isinstance(genre, dict) else genre)
+    rating = data.get('userrating') or data.get('vote_average')
+    record = {
+        'kind': 'movie',
+        'id': int(data['id']),
+        'title': data.get('title') or data.get('name'),
+        'year': _year(data.get('year') or releasedate),
+        'releasedate': releasedate if releasedate and len(
+                                    unicode(releasedate)) == 10 else None,
+        'genres': genres,
+        'userrating': float(rating) if rating else None,
+        'popularity': _number(data.get('popularity')),
+        'aliases': _aliases(data.get('aliases')
+                            or data.get('alternative_titles')),
+    }
+    return record
+
+
+def _element_dict(element):
+    result = {}
+    for child in element:
+        if len(child):
+            result[child.tag.lower()] = [c.text for c in child]
+        else:
+            result[child.tag.lower()] = child.text
+    return result
+
+
+def _load_xml(path):
+    root = ElementTree.parse(path).getroot()
+    series, episodes, movies = [], {}, []
+    for element in root.iter():
+        tag = element.tag.lower()
+        if tag == 'series':
+            series.append(_element_dict(element))
+        elif tag == 'episode':
+            episode = _element_dict(element)
+            sid = episode.get('seriesid') or (
+                    series[-1].get('id') if series else None)
+            episodes.setdefault(unicode(sid), []).append(episode)
+        elif tag == 'movie':
+            movies.append(_element_dict(element))
+
+    records = [_series_record(s, episodes.get(unicode(s.get('id')), []))
+               for s in series]
+    records.extend(_movie_record(m) for m in movies)
+    return records
+
+
+def _load_json(path):
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, dict):
+        items = [('tv', s) for s in data.get('series', [])]
+        items.extend(('movie', m) for m in data.get('movies', []))
+    else:
+        items = [(d.get('type', d.get('kind')), d) for d in data]
+
+    records = []
+    for kind, item in items:
+        if kind in ('tv', 'series'):
+            records.append(_series_record(item, []))
+        elif kind == 'movie':
+            records.append(_movie_record(item))
+        else:
+            log.warn("Skipping catalog item of unknown type %r in %s"
+                     % (kind, path))
+    return records
+
+
+def load_dump(path):
+    """Reads a JSON or XML data dump, returning catalog records
+    """
+    try:
+        if path.lower().endswith(".xml"):
+            return _load_xml(path)
+        return _load_json(path)
+    except (ValueError, KeyError, SyntaxError), e:
+        raise ConfigValueError("Cannot import %s: %s" % (path, e))
+
+
+def import_dumps(paths, index_path):
+    """Imports data dumps into the index at index_path. Records already in
+    the index are kept, unless a dump contains the same media type and id.
+    Returns the number of records in the new index.
+    """
+    records = {}
+    if os.path.isfile(index_path):
+        index = CatalogIndex(index_path)
+        for record in index.records():
+            records[(record['kind'], record['id'])] = record
+        index.close()
+
+    for path in paths:
+        log.info("Importing %s" % path)
+        for record in load_dump(path):
+            records[(record['kind'], record['id'])] = record
+
+    build_index(records.values(), index_path)
+    return len(records)
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """Returns the CatalogIndex for the catalog_path config value, or None
+    when no catalog is configured
+    """
+    global _catalog
+
+    path = Config['catalog_path']
+    if not path:
+        return None
+
+    path = os.path.expanduser(path)
+    with _catalog_lock:
+        if _catalog is None or _catalog.path != path:
+            log.debug("Opening catalog %s" % path)
+            _catalog = CatalogIndex(path)
+        return _catalog
@@ -54,12 +54,30 @@ def getCommandlineParser(defaults):
         g.add_option("-b", "--batch", action="store_true", dest = "batch", help = "Rename without human intervention, same as --always and --selectfirst combined")
         g.add_option("--not-batch", action="store_false", dest = "batch", help = "Overrides --batch")
 
+        g.add_option("--defer-prompts", action="store_true", dest = "defer_prompts", help = "Rename the files needing no choice of search result first, then ask about the rest grouped by series or movie")
+        g.add_option("--not-defer-prompts", action="store_false", dest = "defer_prompts", help = "Overrides --defer-prompts")
+
+        g.add_option("--lookup-workers", action="store", type="int", dest = "lookup_workers", help = "Number of files to look up concurrently (default 1)")
+        g.add_option("--prefetch", action="store", type="int", dest = "lookup_prefetch", help = "Look up this many upcoming files in the background while prompting (default 0)")
+        g.add_option("--year-query-mode", action="store", type="choice", choices=["serial", "parallel", "learn"], dest = "year_query_mode", help = "How to search for series names with a year: serial, parallel or learn")
+
 
     # Config options
     with Group(parser, "Config options") as g:
         g.add_option("-c", "--config", action = "store", dest = "loadconfig", help = "Load config from this file")
         g.add_option("-s", "--save", action = "store", dest = "saveconfig", help = "Save configuration to this file and exit")
         g.add_option("-p", "--preview-config", action = "store_true", dest = "showconfig", help = "Show current config values and exit")
+        g.add_option("--purge-notfound-cache", action = "store_true", dest = "purge_notfound_cache", help = "Forget all cached failed lookups and exit")
+        g.add_option("--undo", action = "store", dest = "undo_journal", metavar = "JOURNAL", help = "Reverse the renames and moves recorded in this journal (from the cache_dir journals directory) and exit")
+        g.add_option("--list-selections", action = "store_true", dest = "list_selections", help = "List the remembered series and movie selections and exit")
+        g.add_option("--forget-selection", action = "append", dest = "forget_selections", metavar = "NAME", help = "Forget the remembered selection for NAME ('all' for every one) and exit. May be given more than once")
+
+    # Catalog options
+    with Group(parser, "Catalog options") as g:
+        g.add_option("--catalog", action = "store", dest = "catalog_path", help = "Look up shows and movies in this local catalog index first")
+        g.add_option("--offline", action = "store_true", dest = "catalog_only", help = "Only use the local catalog, never contact the online databases")
+        g.add_option("--not-offline", action = "store_false", dest = "catalog_only", help = "Overrides --offline")
+        g.add_option("--import-catalog", action = "store", dest = "import_catalog", help = "Import the JSON/XML data dumps given as arguments into this catalog index and exit")
 
     # Override values
     with Group(parser, "Override values") as g:
@@ -81,6 +99,8 @@ def getCommandlineParser(defaults):
 
         g.add_option("-d", "--movedestination", action="store", dest = "move_files_destination", help = "Destination to move files to. Variables: %(seriesname)s %(seasonnumber)d %(episodenumbers)s")
 
+        g.add_option("--placement", action="store", dest = "placement_mode", choices = ["move", "copy", "hardlink", "reflink", "link"], metavar = "MODE", help = "How files are put in the move destination: move, copy, hardlink, reflink, or link (hardlink, then reflink). All but move leave the original in place, and files which can't be linked are copied")
+
         g.add_option("-h", "--help", action="help", help = "show this help message and exit")
 
 
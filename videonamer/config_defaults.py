@@ -10,9 +10,53 @@ defaults = {
     # Select first series search result
     'select_first': False,
     
+    # When several search results match the name about equally, pick one
+    # without asking if it leads the others by this much once the year,
+    # whether the episode exists, popularity and episode counts are
+    # added to the name scores (weighted as in disambiguation.SIGNALS).
+    # Popularity and episode counts add at most 0.5, and the name scores
+    # differ by at most 0.25, so above 0.75 only the year or the episode
+    # can decide. None always asks.
+    'auto_select_confidence': 0.8,
+
+    # Rename every file which needs no choice of search result first, then
+    # ask about the rest, once for all the files of each series or movie.
+    # Covers catalog, thetvdb.com and themoviedb.org searches. A file
+    # another media type finds without a choice is not deferred.
+    'defer_prompts': False,
+
     # Maximum results to return for a search (passed to fuzzy-matcher)
     'max_results': 15,
 
+    # How search results are scored against the name from the filename:
+    # 'difflib' uses difflib's quick_ratio, as earlier versions did.
+    # 'ngram' compares character trigrams of the normalised names. It
+    # scores abbreviated names (such as "star trek tng") lower, so fewer
+    # of them pass the selectors' minimum ratio of 0.65.
+    'scorer': 'difflib',
+
+    # themoviedb.org results come in pages of 20. No further pages are
+    # requested once a result matches the title at least this well (and
+    # has the same year, if the filename has one). Above 1, pages are
+    # fetched until there are max_results results.
+    'movie_search_good_ratio': 0.95,
+
+    # Number of files to look up on thetvdb.com/themoviedb.org at the
+    # same time. Results are still renamed, and prompts shown, in path
+    # order. 1 looks up one file after another.
+    'lookup_workers': 1,
+
+    # Number of upcoming files to look up in the background while the
+    # user answers a prompt. Files needing a choice of search result are
+    # looked up again when their turn comes, so questions are still asked
+    # in path order. 0 waits for each answer before looking up the next
+    # file.
+    'lookup_prefetch': 0,
+
+    # Maximum number of concurrent requests to each provider when
+    # lookup_workers is above 1. 0 means no limit.
+    'lookup_provider_limits': {'tvdb': 4, 'tmdb': 4},
+
     # Always rename files
     'always_rename': False,
 
@@ -84,6 +128,130 @@ defaults = {
     'move_files_fullpath_replacements': [
     ],
 
+    # Seconds before a request to thetvdb.com/themoviedb.org times out
+    'provider_timeout': 20,
+
+    # Connections to each thetvdb.com/themoviedb.org host kept open and
+    # reused between requests. Also the most requests made to one host at
+    # a time. 0 opens a new connection for every request.
+    'http_pool_size': 4,
+
+    # Number of times a failed request is retried. Before each retry
+    # tvnamer waits a random time of up to
+    # provider_retry_delay * 2 ** (number of the retry - 1) seconds,
+    # but never more than provider_retry_max_delay seconds.
+    'provider_retries': 2,
+    'provider_retry_delay': 1.0,
+    'provider_retry_max_delay': 10.0,
+
+    # After this many failed requests in a row, a provider is not
+    # contacted for provider_breaker_cooldown seconds. Lookups needing
+    # it fail straight away (but still use the local catalog, if set).
+    'provider_breaker_threshold': 5,
+    'provider_breaker_cooldown': 60,
+
+    # Remember which series or movie the user picked for each name, and
+    # fetch it directly on later runs instead of searching and asking
+    # again. Results picked automatically are not remembered.
+    # See --list-selections and --forget-selection.
+    'remember_selections': True,
+
+    # Resolve names of series and movies seen before from a local index of
+    # their titles (and those of the catalog), fetching them by id without
+    # a search. Only matches scoring at least title_index_confidence, and
+    # clearly better than any other title, are used.
+    'title_index': True,
+    'title_index_confidence': 0.9,
+
+    # Record every rename and move in a journal in cache_dir/journals, which
+    # --undo reverses. journal_fsync sets when records are forced to disk:
+    # 'always' after each, 'batch' every journal_batch_size records and at
+    # the end of the run, or 'never' (left to the operating system).
+    'journal': True,
+    'journal_fsync': 'batch',
+    'journal_batch_size': 100,
+
+    # Number of renames and moves done at the same time. Files are only
+    # renamed at the same time when neither takes the other's name, so
+    # this is safe, and saves time on network filesystems, where each
+    # rename waits for the server. 1 renames one file after another.
+    'rename_workers': 4,
+
+    # Number of unrelated directories restored at the same time by --undo
+    'undo_workers': 4,
+
+    # How files are copied when moved to another filesystem: 'auto' uses
+    # copy_file_range, then sendfile, then reads and writes of
+    # copy_buffer_size bytes, whichever the system supports first. Naming
+    # one of 'copy_file_range', 'sendfile' or 'buffered' uses only that
+    # (falling back to 'buffered'). Holes in sparse files are kept.
+    'copy_method': 'auto',
+    'copy_buffer_size': 8 * 1024 * 1024,
+
+    # Copy files larger than copy_resume_block_size MB a block at a time,
+    # recording a checksum of each block as it is finished, so a copy which
+    # is interrupted carries on from the last good block next time instead
+    # of starting again.
+    'copy_resume': True,
+    'copy_resume_block_size': 64,
+
+    # Before renaming or moving anything, check that each filesystem files
+    # are copied to has room for them (and inodes for them and any new
+    # directories), keeping preflight_margin of its size free. If one
+    # doesn't, no file is renamed or moved.
+    'preflight': True,
+    'preflight_margin': 0.01,
+
+    # Number of copies each disk (device) is read or written by at a time.
+    # Copies between other disks still run at the same time (up to
+    # rename_workers). 0 for no limit.
+    'copy_streams_per_device': 1,
+
+    # Limit in MB/s on the copying to and from each disk, so copies don't
+    # starve other users of it (such as a media server). 0 for no limit.
+    # copy_rate_limits sets limits for particular disks, as a dict of a
+    # path on the disk to MB/s, for example {'/mnt/array': 40}.
+    'copy_rate_limit': 0,
+    'copy_rate_limits': {},
+
+    # Local catalog index, built from provider data dumps with
+    # --import-catalog. When set, shows and movies are looked up in the
+    # catalog before thetvdb.com/themoviedb.org are contacted.
+    'catalog_path': None,
+
+    # Only use the local catalog, never contact the online databases
+    # (for machines without internet access)
+    'catalog_only': False,
+
+    # Directory for state kept between runs (such as the not-found cache)
+    'cache_dir': '~/.videonamer',
+
+    # Seconds to remember that a show, episode or movie could not be found.
+    # Until then the same query fails straight away, without searching
+    # again. Clear with --purge-notfound-cache. 0 disables the cache.
+    # Searches with results which only matched the name too poorly are not
+    # cached.
+    'notfound_cache_ttl': 86400,
+
+    # Seconds to remember that an episode could not be found, so episodes
+    # which have just aired are looked up again soon. At most
+    # notfound_cache_ttl.
+    'notfound_episode_cache_ttl': 3600,
+
+    # How series names from filenames with a year are searched for:
+    # 'serial' searches "Name (Year)", then "Name" if that is not found.
+    # 'parallel' sends both searches at once and uses the first that finds
+    # the series. 'learn' remembers which form found each series, and
+    # searches for that form first next time.
+    'year_query_mode': 'serial',
+
+    # Alternative servers for the thetvdb.com and themoviedb.org APIs, such
+    # as a local videonamer.fakeserver for benchmarks or offline runs.
+    # None uses the real services. The themoviedb.org value must include
+    # the API version path, e.g. "http://127.0.0.1:8080/3/".
+    'tvdb_base_url': None,
+    'tmdb_base_url': None,
+
     # Language to (try) and retrieve episode data in
     'language': 'en',
 
@@ -135,6 +303,26 @@ defaults = {
     # copied).  If True, this will delete the file from the original
     # volume, after the copy has complete.
     'always_move': False,
+
+    # How a file copied to another partition is checked before it is put
+    # in place (and, with always_move, before the original is deleted):
+    # 'size' compares the sizes, 'checksum' also reads both files back and
+    # compares their SHA-1, 'none' skips the check.
+    'move_verify': 'size',
+
+    # How files are put in the move_files destination. 'move' moves them
+    # (copying them between partitions, see always_move). The other modes
+    # leave the original in place, for files still being seeded: 'copy'
+    # copies them, 'hardlink' links them on the same partition, 'reflink'
+    # clones them on filesystems which support it (such as Btrfs and XFS),
+    # sharing their data, and 'link' tries a hardlink, then a reflink.
+    # Files which can't be linked are copied.
+    'placement_mode': 'move',
+
+    # placement_mode for particular destinations, as a dict of directory to
+    # mode, for example {'/media/seeding': 'hardlink'}. The longest
+    # directory containing the destination is used.
+    'placement_modes': {},
     
     # Allow user to copy files to specified move location without renaming files.
     'move_files_only': False,
@@ -0,0 +1,431 @@
+#!/usr/bin/env python
+
+"""Copies files between filesystems without passing the data through
+Python
+
+Where the C library has them, copy_file_range(2) is used first (the
+kernel copies the data, or the filesystem clones it), then sendfile(2),
+then reads and writes of copy_buffer_size bytes. Only the data regions of
+sparse files are copied, so holes stay holes.
+
+clone_file makes a reflink of a file instead: a new file sharing the
+original's data blocks until either is changed, on filesystems which
+support it (such as Btrfs and XFS).
+"""
+__all__ = ('copy_file', 'clone_file', 'progress_path', 'COPY_METHODS')
+
+import os
+import sys
+import zlib
+import errno
+import logging
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+try:
+    import ctypes
+    import ctypes.util
+except ImportError:
+    ctypes = None
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from config import Config
+from tvnamer_exceptions import ConfigValueError
+
+log = logging.getLogger(__name__)
+
+COPY_METHODS = ('auto', 'copy_file_range', 'sendfile', 'buffered')
+
+# Largest count passed to one copy_file_range or sendfile call
+MAX_CHUNK = 1 << 30
+
+# Added to the name of a file being copied resumably for the file
+# recording the progress of the copy
+PROGRESS_SUFFIX = ".progress"
+
+# Errors meaning a method can't copy between these two files (another
+# filesystem, an old kernel, a filesystem without support), rather than
+# that the copy failed
+UNSUPPORTED = set([errno.ENOSYS, errno.EXDEV, errno.EINVAL, errno.EOPNOTSUPP,
+                   errno.EBADF, errno.EPERM, errno.ETXTBSY])
+
+# lseek whences for finding the data and holes of sparse files. Python 2
+# has no names for them; these are the Linux values.
+if sys.platform.startswith('linux'):
+    SEEK_DATA, SEEK_HOLE = 3, 4
+else:
+    SEEK_DATA = SEEK_HOLE = None
+
+# ioctl(2) request cloning all of a file (_IOW(0x94, 9, int) on Linux)
+FICLONE = 0x40049409 if sys.platform.startswith('linux') else None
+
+# Errors meaning a file can't be cloned here, rather than that it failed
+CLONE_UNSUPPORTED = set([errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV,
+                         errno.EINVAL, errno.EBADF, errno.EPERM])
+
+
+def _load_libc():
+    if ctypes is None:
+        return None, None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+    except (OSError, TypeError):
+        return None, None
+
+    copy_file_range = getattr(libc, 'copy_file_range', None)
+    if copy_file_range is not None:
+        copy_file_range.argtypes = [ctypes.c_int,
+                                    ctypes.POINTER(ctypes.c_int64),
+                                    ctypes.c_int,
+                                    ctypes.POINTER(ctypes.c_int64),
+                                    ctypes.c_size_t, ctypes.c_uint]
+        copy_file_range.restype = ctypes.c_ssize_t
+
+    sendfile = getattr(libc, 'sendfile64', None)
+    if sendfile is not None:
+        sendfile.argtypes = [ctypes.c_int, ctypes.c_int,
+                             ctypes.POINTER(ctypes.c_int64), ctypes.c_size_t]
+        sendfile.restype = ctypes.c_ssize_t
+    return copy_file_range, sendfile
+
+_copy_file_range, _sendfile = _load_libc()
+
+
+def _check(result):
+    if result < 0:
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code))
+    return result
+
+
+def _copy_range_kernel(source, destination, start, end):
+    """Copies bytes start to end of source to the same offsets of
+    destination with copy_file_range. Returns the offset reached, which is
+    end unless copy_file_range stopped early.
+    """
+    offset_in = ctypes.c_int64(start)
+    offset_out = ctypes.c_int64(start)
+    while offset_in.value < end:
+        count = min(end - offset_in.value, MAX_CHUNK)
+        if _check(_copy_file_range(source, ctypes.byref(offset_in),
+                                   destination, ctypes.byref(offset_out),
+                                   count, 0)) == 0:
+            break
+    return offset_in.value
+
+
+def _copy_range_sendfile(source, destination, start, end):
+    offset = ctypes.c_int64(start)
+    os.lseek(destination, start, os.SEEK_SET)
+    while offset.value < end:
+        count = min(end - offset.value, MAX_CHUNK)
+        if _check(_sendfile(destination, source, ctypes.byref(offset),
+                            count)) == 0:
+            break
+    return offset.value
+
+
+def _copy_range_buffered(source, destination, start, end):
+    buf = bytearray(Config['copy_buffer_size'])
+    view = memoryview(buf)
+    reader = os.fdopen(os.dup(source), 'rb', 0)
+    try:
+        reader.seek(start)
+        os.lseek(destination, start, os.SEEK_SET)
+        offset = start
+        while offset < end:
+            read = reader.readinto(view[:min(len(buf), end - offset)])
+            if not read:
+                break
+            written = 0
+            while written < read:
+                written += os.write(destination, view[written:read])
+            offset += read
+    finally:
+        reader.close()
+    return offset
+
+
+def _methods(method):
+    if method not in COPY_METHODS:
+        raise ConfigValueError("Unknown copy_method %r, expected one of %s"
+                               % (method, ", ".join(COPY_METHODS)))
+    methods = []
+    if method in ('auto', 'copy_file_range') and _copy_file_range is not None:
+        methods.append(('copy_file_range', _copy_range_kernel))
+    if method in ('auto', 'sendfile') and _sendfile is not None:
+        methods.append(('sendfile', _copy_range_sendfile))
+    # Always possible, so also the fallback of the others
+    methods.append(('buffered', _copy_range_buffered))
+    return methods
+
+
+def _data_regions(fd, start, end, sparse):
+    """Yields (start, end) offsets of the data between start and end in the
+    file, which is all of it unless the file has holes and the filesystem
+    can find them
+    """
+    if not sparse or SEEK_DATA is None:
+        yield start, end
+        return
+    offset = start
+    while offset < end:
+        try:
+            data = os.lseek(fd, offset, SEEK_DATA)
+        except OSError, e:
+            if e.errno == errno.ENXIO:
+                # Only a hole is left
+                return
+            if e.errno != errno.EINVAL or offset != start:
+                raise
+            # Not supported by the filesystem
+            yield start, end
+            return
+        if data >= end:
+            return
+        hole = min(os.lseek(fd, data, SEEK_HOLE), end)
+        yield data, hole
+        offset = hole
+
+
+def _copy_regions(source, source_fd, destination_fd, start, end, sparse,
+                  methods, throttle):
+    # Copies the data between start and end of source to the same offsets
+    # of the destination, with the first of methods which works
+    for region_start, region_end in _data_regions(source_fd, start, end,
+                                                  sparse):
+        offset = region_start
+        while offset < region_end:
+            name, copy_range = methods[0]
+            stop = region_end
+            if throttle is not None:
+                stop = min(region_end, offset + Config['copy_buffer_size'])
+            try:
+                copied = copy_range(source_fd, destination_fd, offset, stop)
+            except OSError, e:
+                if e.errno not in UNSUPPORTED or len(methods) == 1:
+                    raise
+                log.debug("Can't copy %s with %s (%s), falling back to %s"
+                          % (source, name, e, methods[1][0]))
+                methods.pop(0)
+                continue
+            if throttle is not None:
+                throttle(copied - offset)
+            offset = copied
+            if offset < stop:
+                raise OSError(errno.EIO, "%s was shortened while being"
+                                         " copied" % source)
+
+
+def progress_path(destination):
+    """Returns the path of the file recording the progress of a resumable
+    copy to destination
+    """
+    return destination + PROGRESS_SUFFIX
+
+
+def _block_checksum(fd, start, end):
+    # CRC-32 of the bytes between start and end of the file, read back
+    # from the file
+    checksum = 0
+    reader = os.fdopen(os.dup(fd), 'rb', 0)
+    try:
+        reader.seek(start)
+        while start < end:
+            block = reader.read(min(1024 * 1024, end - start))
+            if not block:
+                break
+            checksum = zlib.crc32(block, checksum)
+            start += len(block)
+    finally:
+        reader.close()
+    return checksum & 0xffffffff
+
+
+def _load_progress(source, stat, destination, block_size):
+    """Returns the checksums of the blocks of destination which were copied
+    by an earlier, interrupted copy of source (as it still is), and which
+    still match
+    """
+    progress = progress_path(destination)
+    if not os.path.exists(progress) or not os.path.exists(destination):
+        return []
+    try:
+        with open(progress) as f:
+            saved = json.load(f)
+        if ((saved['source'], saved['size'], saved['mtime'],
+             saved['block_size'])
+            != (_dump_path(source), stat.st_size, stat.st_mtime,
+                block_size)):
+            log.info("%s has changed since it was partly copied, copying"
+                     " it again" % source)
+            return []
+        checksums = saved['blocks']
+    except (ValueError, KeyError, TypeError, IOError, OSError), e:
+        log.warning("Ignoring unreadable %s (%s)" % (progress, e))
+        return []
+
+    try:
+        destination_fd = os.open(destination, os.O_RDONLY)
+    except OSError, e:
+        log.warning("Copying %s again, as %s can't be read (%s)"
+                    % (source, destination, e))
+        return []
+    try:
+        size = os.fstat(destination_fd).st_size
+        verified = []
+        for number, checksum in enumerate(checksums):
+            start = number * block_size
+            end = min(start + block_size, stat.st_size)
+            if end > size or _block_checksum(destination_fd, start,
+                                             end) != checksum:
+                break
+            verified.append(checksum)
+    except (IOError, OSError), e:
+        log.warning("Copying %s again, as %s can't be read (%s)"
+                    % (source, destination, e))
+        return []
+    finally:
+        os.close(destination_fd)
+    return verified
+
+
+def _save_progress(source, stat, destination, block_size, checksums):
+    # Replaced in one rename, so an interrupted write leaves the last
+    # progress in place
+    progress = progress_path(destination)
+    f = open(progress + ".tmp", "w")
+    try:
+        json.dump({'source': _dump_path(source), 'size': stat.st_size,
+                   'mtime': stat.st_mtime, 'block_size': block_size,
+                   'blocks': checksums}, f)
+    finally:
+        f.close()
+    os.rename(progress + ".tmp", progress)
+
+
+def _dump_path(path):
+    # Paths which are byte strings are stored as latin-1, which maps every
+    # byte to a character
+    if isinstance(path, str):
+        return path.decode('latin-1')
+    return path
+
+
+def copy_file(source, destination, method=None, throttle=None,
+              resumable=False):
+    """Copies the contents of source to destination (like
+    shutil.copyfile), using the fastest method available in the order of
+    COPY_METHODS, or only method (then falling back to 'buffered') if
+    given. Returns the name of the last method used.
+
+    throttle, if given, is called with the number of bytes copied after
+    every copy_buffer_size bytes, and can wait to limit the rate.
+
+    With resumable, files larger than copy_resume_block_size are copied
+    a block at a time. After each block the destination is forced to disk
+    and a CRC-32 of the block, read back, is added to the file at
+    progress_path(destination). If the copy is interrupted, the next
+    resumable copy of the same (unchanged) source to destination checks
+    the blocks copied so far, and carries on after the last one which
+    matches. The progress file is removed once the copy is complete.
+    """
+    if method is None:
+        method = Config['copy_method']
+    methods = _methods(method)
+
+    if (os.path.exists(destination)
+        and os.path.samefile(source, destination)):
+        raise OSError(errno.EINVAL, "%s and %s are the same file"
+                                    % (source, destination))
+
+    source_fd = os.open(source, os.O_RDONLY)
+    try:
+        stat = os.fstat(source_fd)
+        # Fewer blocks than the size needs means the file has holes
+        sparse = stat.st_blocks * 512 < stat.st_size
+        block_size = Config['copy_resume_block_size'] * 1024 * 1024
+        if resumable and stat.st_size > block_size:
+            _copy_blocks(source, source_fd, stat, destination, block_size,
+                         sparse, methods, throttle)
+        else:
+            destination_fd = os.open(destination,
+                                     os.O_WRONLY | os.O_CREAT | os.O_TRUNC,
+                                     0666)
+            try:
+                _copy_regions(source, source_fd, destination_fd, 0,
+                              stat.st_size, sparse, methods, throttle)
+                # Extends the destination over a trailing hole
+                os.ftruncate(destination_fd, stat.st_size)
+            finally:
+                os.close(destination_fd)
+    finally:
+        os.close(source_fd)
+
+    log.debug("Copied %s to %s with %s%s" % (source, destination,
+                                              methods[0][0],
+                                              " (sparse)" if sparse else ""))
+    return methods[0][0]
+
+
+def _copy_blocks(source, source_fd, stat, destination, block_size, sparse,
+                 methods, throttle):
+    checksums = _load_progress(source, stat, destination, block_size)
+    offset = len(checksums) * block_size
+    if offset:
+        log.info("Resuming copy of %s after %dMB"
+                 % (source, offset / 1024 / 1024))
+
+    destination_fd = os.open(destination, os.O_RDWR | os.O_CREAT, 0666)
+    try:
+        # Anything after the verified blocks may be only partly written
+        os.ftruncate(destination_fd, offset)
+        while offset < stat.st_size:
+            end = min(offset + block_size, stat.st_size)
+            _copy_regions(source, source_fd, destination_fd, offset, end,
+                          sparse, methods, throttle)
+            # Extends the destination over a hole at the end of the block
+            os.ftruncate(destination_fd, end)
+            os.fsync(destination_fd)
+            checksums.append(_block_checksum(destination_fd, offset, end))
+            _save_progress(source, stat, destination, block_size, checksums)
+            offset = end
+    finally:
+        os.close(destination_fd)
+    os.remove(progress_path(destination))
+
+
+def clone_file(source, destination):
+    """Makes destination a reflink of source, sharing its data blocks.
+    Raises OSError, with an errno in CLONE_UNSUPPORTED, if the filesystem
+    (or system) can't clone source to destination. Nothing is left at
+    destination if cloning fails.
+    """
+    if fcntl is None or FICLONE is None:
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are not supported here")
+    source_file = open(source, "rb")
+    try:
+        destination_file = open(destination, "wb")
+        try:
+            try:
+                fcntl.ioctl(destination_file.fileno(), FICLONE,
+                            source_file.fileno())
+            except IOError, e:
+                raise OSError(e.errno, "Can't clone %s to %s: %s"
+                                       % (source, destination, e.strerror))
+        finally:
+            destination_file.close()
+    except:
+        if os.path.lexists(destination):
+            os.remove(destination)
+        raise
+    finally:
+        source_file.close()
+    log.debug("Cloned %s to %s" % (source, destination))
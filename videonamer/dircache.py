@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+"""Cache of the directories files are renamed and moved into during a run
+
+Moving thousands of files into a few directories otherwise repeats the
+same system calls for each file: creating the directory, finding which
+device it is on and checking whether the new name is taken. A
+DirectoryCache creates each directory once, stats it once, and lists it
+once, after which checking a name is a set lookup (and a stat, the first
+time a name is found, to tell files from directories). The listings are kept
+up to date with the renames and moves of the run, but not with changes
+made by anything else, so a cache should only live as long as one run.
+"""
+__all__ = ('DirectoryCache', )
+
+import os
+import errno
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+
+class DirectoryCache(object):
+    """Directories created, their device ids and the names in them, as seen
+    by one run. Safe to use from several threads.
+    """
+
+    def __init__(self):
+        self._devices = {}
+        self._listings = {}
+        # Whether the names found in listings are files, by (directory,
+        # name)
+        self._files = {}
+        self._lock = threading.Lock()
+        # System calls saved, for the debug log at the end of a run
+        self.hits = 0
+
+    def makedirs(self, directory):
+        """Creates directory (and its parents) unless it exists
+        """
+        with self._lock:
+            if directory in self._devices:
+                self.hits += 1
+                return
+        log.debug("Creating directory %s" % directory)
+        try:
+            os.makedirs(directory)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        self.device(directory)
+
+    def device(self, directory):
+        """Returns the device id of directory
+        """
+        with self._lock:
+            device = self._devices.get(directory)
+            if device is not None:
+                self.hits += 1
+                return device
+        device = os.stat(directory).st_dev
+        with self._lock:
+            self._devices[directory] = device
+        return device
+
+    def same_partition(self, path, directory):
+        """Returns True if the file at path is on the same partition as
+        directory (going by the directory the file is in)
+        """
+        return (self.device(os.path.dirname(path))
+                == self.device(directory))
+
+    def _listing(self, directory):
+        with self._lock:
+            names = self._listings.get(directory)
+            if names is not None:
+                self.hits += 1
+                return names
+        try:
+            names = set(os.path.normcase(name)
+                        for name in os.listdir(directory))
+        except OSError, e:
+            if e.errno not in (errno.ENOENT, errno.ENOTDIR):
+                raise
+            names = set()
+        with self._lock:
+            return self._listings.setdefault(directory, names)
+
+    def exists(self, path):
+        """Returns True if there is a file at path, like os.path.isfile
+        """
+        directory, name = os.path.split(path)
+        names = self._listing(directory)
+        key = (directory, os.path.normcase(name))
+        with self._lock:
+            if key[1] not in names:
+                return False
+            is_file = self._files.get(key)
+            if is_file is not None:
+                self.hits += 1
+                return is_file
+        is_file = os.path.isfile(path)
+        with self._lock:
+            self._files[key] = is_file
+        return is_file
+
+    def added(self, path):
+        """Records that a file was put at path
+        """
+        directory, name = os.path.split(path)
+        with self._lock:
+            if directory in self._listings:
+                self._listings[directory].add(os.path.normcase(name))
+                self._files[(directory, os.path.normcase(name))] = True
+
+    def removed(self, path):
+        """Records that the file at path was renamed or deleted
+        """
+        directory, name = os.path.split(path)
+        with self._lock:
+            if directory in self._listings:
+                self._listings[directory].discard(os.path.normcase(name))
+                self._files.pop((directory, os.path.normcase(name)), None)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python
+
+"""Automatic choice between search results matching a name about equally
+
+Selector.select asks the user when several results match the name nearly
+as well as the best. Other things known about the file and the results
+often make the choice clear: the year in the filename, whether the
+episode exists in each series, how popular each result is and how many
+episodes each series has. disambiguate() weighs these, and picks a result
+when it leads the others by auto_select_confidence.
+"""
+__all__ = ('disambiguate', )
+
+import logging
+
+from config import Config
+from scoring import candidate_year
+
+log = logging.getLogger(__name__)
+
+
+def year_signal(candidates, year, episode):
+    """The year in the filename, or close to it (release dates differ
+    between countries, and series start before later seasons air)
+    """
+    results = []
+    for candidate in candidates:
+        candidate_from = candidate_year(candidate)
+        if year is None or candidate_from is None:
+            results.append((None, None))
+        elif candidate_from == year:
+            results.append((1.0, "from %d" % year))
+        elif abs(candidate_from - year) == 1:
+            results.append((0.5, "from %d, a year from %d"
+                                  % (candidate_from, year)))
+        else:
+            results.append((-min(1.0, abs(candidate_from - year) / 5.0),
+                            "from %d, not %d" % (candidate_from, year)))
+    return results
+
+
+def episode_signal(candidates, year, episode):
+    """Whether the series has the season and episodes in the filename
+    """
+    results = []
+    for candidate in candidates:
+        numbers = getattr(candidate, 'episodes', None)
+        if episode is None or not numbers:
+            results.append((None, None))
+            continue
+        seasonnumber, episodenumbers = episode
+        label = "season %s episode %s" % (
+                    seasonnumber, "-".join(str(e) for e in episodenumbers))
+        if all((seasonnumber, e) in numbers for e in episodenumbers):
+            results.append((1.0, "has %s" % label))
+        else:
+            results.append((-1.0, "has no %s" % label))
+    return results
+
+
+def _relative(candidates, value, reason):
+    values = [value(c) for c in candidates]
+    best = max([v for v in values if v] or [0])
+    if not best:
+        return [(None, None)] * len(candidates)
+    return [(float(v) / best, reason % v) if v else (0.0, None)
+            for v in values]
+
+
+def popularity_signal(candidates, year, episode):
+    """Popularity on the provider, relative to the most popular result
+    """
+    return _relative(candidates,
+                     lambda c: getattr(c, 'popularity', None),
+                     "popularity %g")
+
+
+def episode_count_signal(candidates, year, episode):
+    """Number of episodes, relative to the series with the most
+    """
+
+    def count(candidate):
+        numbers = getattr(candidate, 'episodes', None)
+        return len(numbers) if numbers else None
+    return _relative(candidates, count, "%d episodes")
+
+
+# (signal, weight). The name score counts with weight 1, and is within
+# Selector.select's fuzz_ratio of the best for every result compared.
+SIGNALS = (
+    (year_signal, 1.0),
+    (episode_signal, 1.0),
+    (popularity_signal, 0.3),
+    (episode_count_signal, 0.2),
+)
+
+
+def disambiguate(name, ratiomap, candidate_name, year=None, episode=None):
+    """Returns the result from ratiomap, a list of (candidate, score) pairs,
+    leading the others by at least auto_select_confidence once all signals
+    are counted. Returns None if there is no such result (or automatic
+    selection is disabled). episode is a (seasonnumber, episodenumbers)
+    pair, for series.
+    """
+    confidence = Config['auto_select_confidence']
+    if confidence is None or len(ratiomap) < 2:
+        return None
+
+    candidates = [c for c, score in ratiomap]
+    totals = [score for c, score in ratiomap]
+    reasons = [[] for c in candidates]
+    for signal, weight in SIGNALS:
+        for i, (value, reason) in enumerate(signal(candidates, year,
+                                                   episode)):
+            if value is not None:
+                totals[i] += weight * value
+            if reason is not None:
+                reasons[i].append(reason)
+
+    ranked = sorted(range(len(candidates)), key=lambda i: -totals[i])
+    best, second = ranked[0], ranked[1]
+    lead = totals[best] - totals[second]
+    if lead < confidence:
+        log.debug("No clear choice for %s: %s (%.2f) and %s (%.2f)"
+                  % (name, candidate_name(candidates[best]), totals[best],
+                     candidate_name(candidates[second]), totals[second]))
+        return None
+
+    log.info("Automatically selecting %s for %s (%s), ahead of %s (%s)"
+             % (candidate_name(candidates[best]), name,
+                ", ".join(reasons[best]) or "name",
+                candidate_name(candidates[second]),
+                ", ".join(reasons[second]) or "name"))
+    return candidates[best]
@@ -0,0 +1,438 @@
+#!/usr/bin/env python
+
+"""Local stand-in for the thetvdb.com and themoviedb.org APIs
+
+Serves the parts of both APIs used by tvdb_api and tmdb3 from catalog data
+dumps (the same JSON/XML files accepted by --import-catalog), with optional
+latency, error and rate-limit injection. Point tvnamer at it with the
+tvdb_base_url and tmdb_base_url config values to benchmark lookups or run
+without network access:
+
+    python -m videonamer.fakeserver --port 8080 --latency 0.2 shows.json
+
+Request counts are available as JSON from /_stats.
+"""
+__all__ = ('FakeProviderServer', 'load_records')
+
+import re
+import socket
+import time
+import random
+import logging
+import urlparse
+import threading
+import BaseHTTPServer
+import SocketServer
+from optparse import OptionParser
+from xml.sax.saxutils import escape
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from catalog import CatalogIndex, load_dump, normalize_title
+
+log = logging.getLogger(__name__)
+
+# tvdb_api looks these episode elements up by name, so their case matters
+EPISODE_TAGS = {
+    'seasonnumber': 'SeasonNumber',
+    'episodenumber': 'EpisodeNumber',
+    'dvd_season': 'DVD_season',
+    'dvd_episodenumber': 'DVD_episodenumber',
+}
+
+TMDB_PAGE_SIZE = 20
+
+
+def load_records(paths):
+    """Reads catalog records from data dumps or catalog index files
+    """
+    records = []
+    for path in paths:
+        if path.endswith(".idx"):
+            index = CatalogIndex(path)
+            records.extend(index.records())
+            index.close()
+        else:
+            records.extend(load_dump(path))
+    return records
+
+
+def _title_keys(record):
+    keys = []
+    for title in [record['title']] + list(record.get('aliases') or []):
+        key = normalize_title(title)
+        keys.append(key)
+        if record.get('year'):
+            keys.append(u"%s %s" % (key, record['year']))
+    return keys
+
+
+def _xml(tag, fields):
+    parts = [u"<%s>" % tag]
+    for name, value in fields:
+        if value is None:
+            parts.append(u"<%s/>" % name)
+        else:
+            parts.append(u"<%s>%s</%s>" % (name, escape(unicode(value)), name))
+    parts.append(u"</%s>" % tag)
+    return u"".join(parts)
+
+
+def _series_fields(record):
+    fields = [('id', record['id']),
+              ('SeriesName', record['title']),
+              ('language', 'en')]
+    if record.get('aliases'):
+        fields.append(('AliasNames', u"|".join(record['aliases'])))
+    data = record.get('data') or {}
+    fields.extend((k, v) for k, v in sorted(data.items())
+                  if k not in ('id', 'seriesname', 'language', 'aliasnames'))
+    return fields
+
+
+def _movie_json(record):
+    return {
+        'id': record['id'],
+        'title': record['title'],
+        'original_title': record['title'],
+        'release_date': record.get('releasedate') or (
+                u"%s-01-01" % record['year'] if record.get('year') else None),
+        'vote_average': record.get('userrating') or 0,
+        'vote_count': record.get('votes') or 0,
+        'popularity': record.get('popularity') or 0,
+        'genres': [{'id': i + 1, 'name': g}
+                   for i, g in enumerate(record.get('genres') or [])],
+        'adult': False,
+    }
+
+
+class FakeProviderHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Handles a request to the fake providers. Keeps connections alive
+    like the real services.
+    """
+    protocol_version = "HTTP/1.1"
+    server_version = "videonamer-fakeserver"
+
+    routes = (
+        (re.compile(r'^/api/GetSeries\.php$'), 'tvdb_search'),
+        (re.compile(r'^/api/[^/]+/series/(\d+)/all/([\w-]+)\.xml$'),
+         'tvdb_episodes'),
+        (re.compile(r'^/api/[^/]+/series/(\d+)/([\w-]+)\.xml$'),
+         'tvdb_series'),
+        (re.compile(r'^/3/search/movie$'), 'tmdb_search'),
+        (re.compile(r'^/3/movie/(\d+)$'), 'tmdb_movie'),
+        (re.compile(r'^/_stats$'), 'stats'),
+    )
+
+    def setup(self):
+        # close kept-alive connections after idle_timeout, like real servers
+        self.timeout = self.server.idle_timeout
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+
+    def address_string(self):
+        # skip the reverse DNS lookup done by default
+        return self.client_address[0]
+
+    def log_message(self, format, *args):
+        log.debug("%s %s" % (self.address_string(), format % args))
+
+    def send(self, code, body, content_type, headers=()):
+        if isinstance(body, unicode):
+            body = body.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, code, data, headers=()):
+        self.send(code, json.dumps(data), "application/json", headers)
+
+    def send_xml(self, body):
+        self.send(200, u'<?xml version="1.0" encoding="UTF-8" ?>\n' + body,
+                  "text/xml; charset=utf-8")
+
+    def do_GET(self):
+        url = urlparse.urlsplit(self.path)
+        params = dict(urlparse.parse_qsl(url.query))
+
+        for pattern, name in self.routes:
+            match = pattern.match(url.path)
+            if match:
+                break
+        else:
+            self.server.count('not_found')
+            self.send_json(404, {'status_code': 34,
+                                 'status_message': "Unknown resource"})
+            return
+
+        if name != 'stats' and not self.server.inject(self):
+            return
+        self.server.count('requests')
+        getattr(self, name)(params, *match.groups())
+
+    def tvdb_search(self, params):
+        query = normalize_title(
+                    params.get('seriesname', '').decode("utf-8"))
+        results = self.server.search('tv', query)
+        self.send_xml(u"<Data>%s</Data>" % u"".join(
+                          _xml('Series', _series_fields(r)) for r in results))
+
+    def tvdb_series(self, params, sid, language, episodes=False):
+        record = self.server.get('tv', int(sid))
+        if record is None:
+            self.server.count('not_found')
+            self.send(404, "Not Found", "text/plain")
+            return
+
+        body = [_xml('Series', _series_fields(record))]
+        if episodes:
+            for i, episode in enumerate(record.get('episodes') or []):
+                fields = [('id', episode.get('id', i + 1)),
+                          ('seriesid', record['id'])]
+                fields.extend((EPISODE_TAGS.get(k, k), v)
+                              for k, v in sorted(episode.items())
+                              if k not in ('id', 'seriesid'))
+                body.append(_xml('Episode', fields))
+        self.send_xml(u"<Data>%s</Data>" % u"".join(body))
+
+    def tvdb_episodes(self, params, sid, language):
+        self.tvdb_series(params, sid, language, episodes=True)
+
+    def tmdb_search(self, params):
+        query = normalize_title(params.get('query', '').decode("utf-8"))
+        results = self.server.search('movie', query)
+        if params.get('year'):
+            results = [r for r in results
+                       if unicode(r.get('year')) == params['year']]
+
+        page = max(1, int(params.get('page') or 1))
+        start = (page - 1) * TMDB_PAGE_SIZE
+        self.send_json(200, {
+            'page': page,
+            'results': [_movie_json(r)
+                        for r in results[start:start + TMDB_PAGE_SIZE]],
+            'total_results': len(results),
+            'total_pages': (len(results) + TMDB_PAGE_SIZE - 1)
+                           // TMDB_PAGE_SIZE,
+        })
+
+    def tmdb_movie(self, params, uid):
+        record = self.server.get('movie', int(uid))
+        if record is None:
+            self.server.count('not_found')
+            self.send_json(404, {'status_code': 34, 'status_message':
+                                 "The resource you requested could not be"
+                                 " found."})
+            return
+        self.send_json(200, _movie_json(record))
+
+    def stats(self, params):
+        self.send_json(200, self.server.get_stats())
+
+
+class FakeProviderServer(SocketServer.ThreadingMixIn,
+                         BaseHTTPServer.HTTPServer):
+    """HTTP server answering thetvdb.com and themoviedb.org API requests
+    from catalog records.
+
+    Every request is delayed by `latency` seconds plus an exponentially
+    distributed extra delay with mean `jitter`, fails with a 503 with
+    probability `error_rate`, and is refused with a 429 once more than
+    `rate_limit` requests per second arrive (0 disables the limit). Idle
+    connections are closed after `idle_timeout` seconds.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, records, address=('127.0.0.1', 0), latency=0,
+                 jitter=0, error_rate=0, rate_limit=0, idle_timeout=5,
+                 seed=None):
+        BaseHTTPServer.HTTPServer.__init__(self, address, FakeProviderHandler)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.idle_timeout = idle_timeout
+        self._random = random.Random(seed)
+
+        self._records = {}
+        self._titles = {'tv': [], 'movie': []}
+        for record in records:
+            self._records[(record['kind'], record['id'])] = record
+            self._titles[record['kind']].append((_title_keys(record), record))
+
+        self._lock = threading.Lock()
+        self._tokens = float(rate_limit)
+        self._refilled = time.time()
+        self._stats = dict.fromkeys(('requests', 'errors', 'throttled',
+                                     'not_found', 'connections'), 0)
+        self._connections = set()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    @property
+    def tvdb_base_url(self):
+        """Value for the tvdb_base_url config option
+        """
+        return self.base_url
+
+    @property
+    def tmdb_base_url(self):
+        """Value for the tmdb_base_url config option
+        """
+        return self.base_url + "/3/"
+
+    def get(self, kind, uid):
+        return self._records.get((kind, uid))
+
+    def search(self, kind, query):
+        if not query:
+            return []
+        exact, partial = [], []
+        for keys, record in self._titles[kind]:
+            if query in keys:
+                exact.append(record)
+            elif any(query in key for key in keys):
+                partial.append(record)
+        return exact + partial
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self._stats[name] += amount
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _take_token(self):
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.rate_limit, self._tokens
+                               + (now - self._refilled) * self.rate_limit)
+            self._refilled = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    def inject(self, handler):
+        """Applies the configured latency and failures to a request.
+        Returns False when an error response was sent instead.
+        """
+        if self.rate_limit and not self._take_token():
+            self.count('throttled')
+            handler.send_json(429, {'status_code': 25, 'status_message':
+                                    "Your request count is over the"
+                                    " allowed limit"},
+                              headers=[('Retry-After', '1')])
+            return False
+
+        delay = self.latency
+        if self.jitter:
+            delay += self._random.expovariate(1.0 / self.jitter)
+        if delay:
+            time.sleep(delay)
+
+        if self.error_rate and self._random.random() < self.error_rate:
+            self.count('errors')
+            handler.send_json(503, {'status_code': 11, 'status_message':
+                                    "Internal error"})
+            return False
+        return True
+
+    def process_request(self, request, client_address):
+        self.count('connections')
+        with self._lock:
+            self._connections.add(request)
+        SocketServer.ThreadingMixIn.process_request(self, request,
+                                                    client_address)
+
+    def shutdown_request(self, request):
+        with self._lock:
+            self._connections.discard(request)
+        BaseHTTPServer.HTTPServer.shutdown_request(self, request)
+
+    def handle_error(self, request, client_address):
+        log.debug("Error handling request from %s" % (client_address, ),
+                  exc_info=True)
+
+    def start(self):
+        """Serves requests on a background thread
+        """
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        name="fakeserver")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        with self._lock:
+            connections, self._connections = self._connections, set()
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+
+def main():
+    parser = OptionParser(usage="%prog [options] dump [dump ...]")
+    parser.add_option("--host", default="127.0.0.1",
+                      help="address to listen on (default %default)")
+    parser.add_option("-p", "--port", type="int", default=8080,
+                      help="port to listen on (default %default)")
+    parser.add_option("--latency", type="float", default=0,
+                      help="seconds to delay every response")
+    parser.add_option("--jitter", type="float", default=0,
+                      help="mean of an extra, exponentially distributed,"
+                           " delay in seconds")
+    parser.add_option("--error-rate", type="float", default=0,
+                      help="fraction of requests answered with a 503")
+    parser.add_option("--rate-limit", type="float", default=0,
+                      help="requests per second before answering 429")
+    parser.add_option("--idle-timeout", type="float", default=5,
+                      help="seconds before idle connections are closed"
+                           " (default %default)")
+    parser.add_option("--seed", type="int",
+                      help="random seed, for reproducible runs")
+    parser.add_option("-v", "--verbose", action="store_true")
+    opts, args = parser.parse_args()
+
+    if not args:
+        parser.error("No data dumps given")
+
+    logging.basicConfig(level=logging.DEBUG if opts.verbose
+                        else logging.INFO)
+    records = load_records(args)
+    server = FakeProviderServer(records, (opts.host, opts.port),
+                                latency=opts.latency, jitter=opts.jitter,
+                                error_rate=opts.error_rate,
+                                rate_limit=opts.rate_limit,
+                                idle_timeout=opts.idle_timeout,
+                                seed=opts.seed)
+
+    print "Serving %d records on %s" % (len(records), server.base_url)
+    print "Config:"
+    print '    "tvdb_base_url": "%s",' % server.tvdb_base_url
+    print '    "tmdb_base_url": "%s"' % server.tmdb_base_url
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    print "Stats: %s" % json.dumps(server.get_stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+
+"""Persistent HTTP connections for requests to thetvdb.com/themoviedb.org
+
+urllib2 opens a new connection for every request. The handlers here keep
+connections to each host open between requests, so batches of lookups
+don't pay for a TCP (and TLS) handshake per request. They also give the
+requests a timeout, without changing the default of every other socket.
+"""
+__all__ = ('ConnectionPool', 'KeepAliveHandler', 'KeepAliveHTTPSHandler',
+           'TimeoutHandler', 'install', 'add_to_opener', 'get_pool')
+
+import socket
+import httplib
+import logging
+import urllib2
+import threading
+from urllib import addinfourl
+from cStringIO import StringIO
+
+log = logging.getLogger(__name__)
+
+
+class ConnectionPool(object):
+    """Idle connections by (scheme, host). At most max_per_host connections
+    to a host are in use at a time; further requests wait for one to be
+    returned.
+    """
+
+    def __init__(self, max_per_host):
+        self.max_per_host = max_per_host
+        self._idle = {}
+        self._slots = {}
+        self._lock = threading.Lock()
+        self._stats = dict.fromkeys(('requests', 'opened', 'reused',
+                                     'retried', 'discarded'), 0)
+
+    def acquire(self, key, factory):
+        """Returns an idle connection to the host, or a new one from
+        factory(), waiting while max_per_host connections are in use
+        """
+        with self._lock:
+            try:
+                slots = self._slots[key]
+            except KeyError:
+                slots = threading.BoundedSemaphore(self.max_per_host)
+                self._slots[key] = slots
+        slots.acquire()
+
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                return idle.pop()
+        try:
+            return factory()
+        except:
+            slots.release()
+            raise
+
+    def release(self, key, conn, reusable=True):
+        """Returns a connection to the pool, or closes it
+        """
+        with self._lock:
+            if reusable and conn.sock is not None:
+                self._idle.setdefault(key, []).append(conn)
+            else:
+                conn.close()
+                self._stats['discarded'] += 1
+        self._slots[key].release()
+
+    def count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def close(self):
+        """Closes all idle connections
+        """
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle = {}
+
+
+class _PooledOpener(object):
+    """Sends requests over pooled connections.
+
+    Response bodies are read in full before the response is returned, so
+    the connection is back in the pool even if the caller never reads or
+    closes the response (as happens with HTTP errors). Provider responses
+    are small enough for this not to matter.
+    """
+    scheme = None
+    connection_class = None
+
+    def __init__(self, pool):
+        self.pool = pool
+
+    def _connection(self, host, req):
+        return self.connection_class(host, timeout=req.timeout)
+
+    def pooled_open(self, req):
+        host = req.get_host()
+        if not host:
+            raise urllib2.URLError('no host given')
+
+        headers = dict(req.unredirected_hdrs)
+        headers.update(req.headers)
+        headers = dict((name.title(), val) for name, val in headers.items())
+
+        key = (self.scheme, host)
+        conn = self.pool.acquire(key, lambda: self._connection(host, req))
+        self.pool.count('requests')
+        retried = False
+        while True:
+            reused = conn.sock is not None
+            try:
+                conn.request(req.get_method(), req.get_selector(),
+                             req.get_data(), headers)
+                response = conn.getresponse(buffering=True)
+                body = response.read()
+            except (socket.error, httplib.HTTPException), e:
+                conn.close()
+                if reused and not retried:
+                    # The server closed the idle connection, try a new one
+                    log.debug("Connection to %s was closed, reconnecting"
+                              % host)
+                    self.pool.count('retried')
+                    retried = True
+                    continue
+                self.pool.release(key, conn, reusable=False)
+                raise urllib2.URLError(e)
+            except:
+                # Anything else (even KeyboardInterrupt) leaves the
+                # connection in an unknown state, but gives its slot back
+                self.pool.release(key, conn, reusable=False)
+                raise
+            break
+
+        self.pool.count('reused' if reused else 'opened')
+        self.pool.release(key, conn, reusable=not response.will_close)
+
+        resp = addinfourl(StringIO(body), response.msg, req.get_full_url())
+        resp.code = response.status
+        resp.msg = response.reason
+        return resp
+
+
+class KeepAliveHandler(_PooledOpener, urllib2.HTTPHandler):
+    """urllib2 handler sending http requests over pooled connections
+    """
+    # Run before the default handler, when both are in one opener
+    handler_order = urllib2.HTTPHandler.handler_order - 1
+    scheme = 'http'
+    connection_class = httplib.HTTPConnection
+
+    def __init__(self, pool):
+        urllib2.HTTPHandler.__init__(self)
+        _PooledOpener.__init__(self, pool)
+
+    def http_open(self, req):
+        return self.pooled_open(req)
+
+
+class KeepAliveHTTPSHandler(_PooledOpener, urllib2.HTTPSHandler):
+    """urllib2 handler sending https requests over pooled connections.
+    Requests tunnelled through a proxy are left to urllib2.
+    """
+    handler_order = urllib2.HTTPSHandler.handler_order - 1
+    scheme = 'https'
+    connection_class = httplib.HTTPSConnection
+
+    def __init__(self, pool):
+        urllib2.HTTPSHandler.__init__(self)
+        _PooledOpener.__init__(self, pool)
+
+    def https_open(self, req):
+        if getattr(req, '_tunnel_host', None):
+            return urllib2.HTTPSHandler.https_open(self, req)
+        return self.pooled_open(req)
+
+
+class TimeoutHandler(urllib2.BaseHandler):
+    """Sets the timeout of requests opened without one
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+
+    def http_request(self, req):
+        if req.timeout is socket._GLOBAL_DEFAULT_TIMEOUT:
+            req.timeout = self.timeout
+        return req
+
+    https_request = http_request
+
+
+_pool = None
+_timeout = None
+
+
+def get_pool():
+    """Returns the ConnectionPool in use, or None when connections are not
+    being reused
+    """
+    return _pool
+
+
+def _handlers():
+    handlers = []
+    if _pool is not None:
+        handlers.extend([KeepAliveHandler(_pool),
+                         KeepAliveHTTPSHandler(_pool)])
+    if _timeout is not None:
+        handlers.append(TimeoutHandler(_timeout))
+    return handlers
+
+
+def install(max_per_host, timeout=None):
+    """Makes urllib2.urlopen (and so tmdb3) reuse connections, keeping up to
+    max_per_host connections to each host, and time out after timeout
+    seconds. 0 and None restore the default opener.
+    """
+    global _pool, _timeout
+
+    if _pool is not None:
+        _pool.close()
+    _pool = ConnectionPool(max_per_host) if max_per_host else None
+    _timeout = timeout
+
+    handlers = _handlers()
+    if not handlers:
+        urllib2.install_opener(None)
+        return
+    urllib2.install_opener(urllib2.build_opener(*handlers))
+
+
+def add_to_opener(opener):
+    """Adds the pooling and timeout handlers to an existing urllib2 opener
+    (such as the caching opener of a Tvdb instance), if installed
+    """
+    for handler in _handlers():
+        opener.add_handler(handler)
+    return opener
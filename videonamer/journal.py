@@ -0,0 +1,213 @@
+#!/usr/bin/env python
+
+"""Journal of the renames and moves of a run, and undoing them
+
+Each file operation is appended to a JSON Lines file in
+cache_dir/journals as it is done. Records are written in batches, and
+forced to disk according to the journal_fsync config value, so
+journaling costs little next to the renames themselves. undo() reverses
+the operations of a journal, most recent first.
+"""
+__all__ = ('Journal', 'new_journal', 'read_journal', 'undo')
+
+import os
+import time
+import errno
+import logging
+import threading
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from config import Config
+from lookup import LookupPool
+from planner import connected_groups
+import renamer
+from state import state_path
+from tvnamer_exceptions import ConfigValueError
+
+log = logging.getLogger(__name__)
+
+FSYNC_POLICIES = ('always', 'batch', 'never')
+
+UNDONE_SUFFIX = ".undone"
+
+
+def _dump_path(path):
+    # Byte string paths are stored as latin-1, which maps every byte to a
+    # character, so names which are not valid UTF-8 come back unchanged
+    if isinstance(path, str):
+        return path.decode('latin-1'), True
+    return path, False
+
+
+def _load_path(path, raw):
+    return path.encode('latin-1') if raw else path
+
+
+class Journal(object):
+    """An append-only JSON Lines file of file operations. The file is
+    created when the first record is written.
+    """
+
+    def __init__(self, path, fsync='batch', batch_size=100):
+        if fsync not in FSYNC_POLICIES:
+            raise ConfigValueError("Unknown journal_fsync %r, expected one"
+                                   " of %s" % (fsync,
+                                               ", ".join(FSYNC_POLICIES)))
+        self.path = path
+        self.fsync = fsync
+        self.batch_size = max(1, batch_size)
+        self.count = 0
+        self._file = None
+        self._unsynced = 0
+        self._lock = threading.Lock()
+
+    def record(self, operation, source, destination):
+        """Appends an operation ('rename', 'move' or 'copy') of source to
+        destination
+        """
+        source, raw = _dump_path(source)
+        destination, raw_destination = _dump_path(destination)
+        entry = {'op': operation, 'source': source,
+                 'destination': destination, 'time': time.time()}
+        if raw or raw_destination:
+            entry['raw'] = True
+        line = json.dumps(entry) + "\n"
+
+        with self._lock:
+            if self._file is None:
+                dirname = os.path.dirname(self.path)
+                if dirname and not os.path.isdir(dirname):
+                    os.makedirs(dirname)
+                self._file = open(self.path, "a")
+            self._file.write(line)
+            self.count += 1
+            self._unsynced += 1
+            if self.fsync == 'always' or (self.fsync == 'batch' and
+                                          self._unsynced >= self.batch_size):
+                self._sync()
+
+    def _sync(self):
+        self._file.flush()
+        if self.fsync != 'never':
+            os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def close(self):
+        """Writes out any records not on disk yet and closes the file
+        """
+        with self._lock:
+            if self._file is None:
+                return
+            self._sync()
+            self._file.close()
+            self._file = None
+
+
+def new_journal():
+    """Returns a Journal for a run, in cache_dir/journals, or None when
+    journaling is disabled
+    """
+    if not Config['journal']:
+        return None
+    name = "%s-%d.jsonl" % (time.strftime("%Y%m%d-%H%M%S"), os.getpid())
+    return Journal(state_path(os.path.join("journals", name)),
+                   fsync=Config['journal_fsync'],
+                   batch_size=Config['journal_batch_size'])
+
+
+def read_journal(path):
+    """Returns the (operation, source, destination) records of a journal.
+    A truncated last line (from a run which was killed) is ignored.
+    """
+    records = []
+    for number, line in enumerate(open(path)):
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            log.warn("Ignoring unreadable line %d of %s" % (number + 1, path))
+            continue
+        raw = entry.get('raw', False)
+        records.append((entry['op'], _load_path(entry['source'], raw),
+                        _load_path(entry['destination'], raw)))
+    return records
+
+
+def _undo_one(operation, source, destination):
+    if not os.path.lexists(destination):
+        raise OSError(errno.ENOENT, "%s is gone, can't restore %s"
+                                    % (destination, source))
+    if operation == 'copy':
+        if not os.path.lexists(source):
+            raise OSError(errno.ENOENT, "Original %s of %s is gone, not"
+                                        " deleting the copy"
+                                        % (source, destination))
+        log.info("Deleting copy %s" % destination)
+        os.remove(destination)
+        return
+
+    if os.path.lexists(source):
+        raise OSError(errno.EEXIST, "%s exists, not moving %s back"
+                                    % (source, destination))
+    log.info("Restoring %s\n   => %s" % (destination, source))
+    try:
+        os.rename(destination, source)
+    except OSError, e:
+        if e.errno != errno.EXDEV:
+            raise
+        # Moved between filesystems
+        renamer.move_file(destination, source, always_move=True,
+                          mode='move')
+
+
+def _undo_group(records):
+    failed = 0
+    for operation, source, destination in reversed(records):
+        try:
+            _undo_one(operation, source, destination)
+        except OSError, e:
+            log.error(e)
+            failed += 1
+    return failed
+
+
+def _groups(records):
+    """Splits records into groups sharing no directory with each other.
+    Within a group order matters (a file may have been renamed twice, or
+    into a name another file had), between groups it does not.
+    """
+    return connected_groups(records, lambda record: (
+                                os.path.dirname(record[1]),
+                                os.path.dirname(record[2])))
+
+
+def undo(path, workers=None):
+    """Reverses the operations of the journal at path, most recent first.
+    Directories unrelated to each other are restored concurrently by up to
+    workers (default undo_workers) threads. Returns the number of
+    operations which could not be undone.
+
+    Once every operation is undone the journal is renamed to end with
+    UNDONE_SUFFIX, as undoing it again could swap files back.
+    """
+    if path.endswith(UNDONE_SUFFIX):
+        raise ValueError("%s has been undone already" % path)
+    if workers is None:
+        workers = Config['undo_workers']
+    records = read_journal(path)
+    groups = _groups(records)
+    log.info("Undoing %d operations from %s" % (len(records), path))
+
+    failed = 0
+    for group, result, error in LookupPool(_undo_group,
+                                           workers=workers).imap(groups):
+        if error is not None:
+            raise error[0], error[1], error[2]
+        failed += result
+
+    if not failed:
+        os.rename(path, path + UNDONE_SUFFIX)
+    return failed
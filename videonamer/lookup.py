@@ -0,0 +1,214 @@
+#!/usr/bin/env python
+
+"""Concurrent metadata lookup stage for tvnamer/movienamer
+"""
+__all__ = ('LookupPool', 'BackgroundCall', 'provider_slot', 'keyed_lock')
+
+import sys
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from Queue import Queue
+
+from config import Config
+
+log = logging.getLogger(__name__)
+
+
+class _Slot(object):
+    """Holds the outcome of a single submitted item
+    """
+
+    def __init__(self, item):
+        self.item = item
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class LookupPool(object):
+    """Runs func over a sequence of items on a bounded pool of worker
+    threads. Results are yielded in the order the items were supplied,
+    regardless of which lookup finishes first.
+
+    Items are read from the source only as results are consumed: at most
+    `prefetch` items (or twice the number of workers, if larger) are
+    looked up ahead of the one being consumed. With a single worker and no
+    prefetch, func is called inline and no threads are started.
+    """
+
+    def __init__(self, func, workers=1, prefetch=0):
+        self.func = func
+        self.workers = max(1, int(workers or 1))
+        self.prefetch = max(0, int(prefetch or 0))
+        if self.workers > 1:
+            self.window = max(self.workers * 2, self.prefetch)
+        else:
+            self.window = max(1, self.prefetch)
+
+    def _call(self, slot):
+        try:
+            slot.result = self.func(slot.item)
+        except Exception:
+            slot.error = sys.exc_info()
+        finally:
+            slot.done.set()
+
+    def _worker(self, tasks):
+        while True:
+            slot = tasks.get()
+            if slot is None:
+                return
+            self._call(slot)
+
+    def imap(self, items):
+        """Yields (item, result, exc_info) tuples, in item order. exc_info
+        is None when func returned normally.
+        """
+        if self.workers == 1 and self.prefetch == 0:
+            for item in items:
+                slot = _Slot(item)
+                self._call(slot)
+                yield slot.item, slot.result, slot.error
+            return
+
+        tasks = Queue()
+        threads = []
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, args=(tasks, ),
+                                      name="lookup-%d" % i)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        log.debug("Started %d lookup workers (window %d)"
+                  % (self.workers, self.window))
+
+        pending = deque()
+        items = iter(items)
+
+        def fill():
+            # Keep `window` items queued beyond the one being consumed
+            while len(pending) < self.window:
+                try:
+                    item = items.next()
+                except StopIteration:
+                    return
+                slot = _Slot(item)
+                pending.append(slot)
+                tasks.put(slot)
+
+        finished = False
+        try:
+            fill()
+            while pending:
+                slot = pending.popleft()
+                fill()
+                # wait with a timeout so KeyboardInterrupt is delivered
+                while not slot.done.wait(0.1):
+                    pass
+                yield slot.item, slot.result, slot.error
+            finished = True
+        finally:
+            # Drop queued work and stop the workers
+            while not tasks.empty():
+                try:
+                    tasks.get_nowait()
+                except Exception:
+                    break
+            for thread in threads:
+                tasks.put(None)
+            if finished:
+                # All work is done, so the workers exit straight away (and
+                # are gone before the interpreter shuts down)
+                for thread in threads:
+                    thread.join()
+
+
+class BackgroundCall(object):
+    """Calls func(*args, **kwargs) on a new thread. result() waits for it
+    and returns its result, or raises its exception.
+    """
+
+    def __init__(self, func, *args, **kwargs):
+        self._slot = _Slot(None)
+        self._thread = threading.Thread(target=self._run,
+                                        args=(func, args, kwargs))
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self, func, args, kwargs):
+        try:
+            self._slot.result = func(*args, **kwargs)
+        except Exception:
+            self._slot.error = sys.exc_info()
+        finally:
+            self._slot.done.set()
+
+    def result(self):
+        # wait with a timeout so KeyboardInterrupt is delivered
+        while not self._slot.done.wait(0.1):
+            pass
+        if self._slot.error is not None:
+            raise self._slot.error[0], self._slot.error[1], \
+                  self._slot.error[2]
+        return self._slot.result
+
+
+_provider_semaphores = {}
+_provider_lock = threading.Lock()
+
+
+@contextmanager
+def provider_slot(provider):
+    """Limits the number of concurrent requests made to a provider, using
+    the lookup_provider_limits config value. A limit of 0 (or a provider
+    missing from the config) means no limit.
+    """
+    limit = Config['lookup_provider_limits'].get(provider, 0)
+    if not limit:
+        yield
+        return
+
+    with _provider_lock:
+        try:
+            semaphore = _provider_semaphores[provider]
+        except KeyError:
+            semaphore = threading.BoundedSemaphore(limit)
+            _provider_semaphores[provider] = semaphore
+
+    semaphore.acquire()
+    try:
+        yield
+    finally:
+        semaphore.release()
+
+
+_key_locks = {}
+_key_locks_lock = threading.Lock()
+
+
+@contextmanager
+def keyed_lock(key):
+    """Serialises work on the same key (such as a series name), so that
+    concurrent lookups of one name are done once and the others reuse
+    the result
+    """
+    with _key_locks_lock:
+        try:
+            lock, users = _key_locks[key]
+        except KeyError:
+            lock, users = threading.RLock(), 0
+        _key_locks[key] = (lock, users + 1)
+
+    lock.acquire()
+    try:
+        yield
+    finally:
+        lock.release()
+        with _key_locks_lock:
+            lock, users = _key_locks[key]
+            if users <= 1:
+                del _key_locks[key]
+            else:
+                _key_locks[key] = (lock, users - 1)
@@ -6,6 +6,7 @@ __all__ = ( 'init', 'run', )
 
 import os
 import sys
+from collections import OrderedDict
 
 import logging
 logging.basicConfig(level=logging.INFO,
@@ -26,57 +27,25 @@ from config import Config
 import config_defaults
 from finder import FileFinder
 import renamer
+import catalog
+import httppool
+import selections
+from notfound import get_notfound_cache
+from state import save_state
 from info import BaseInfo
+from lookup import LookupPool
+from planner import RenamePlan
+from journal import new_journal, undo
+from selector import prompt_lock, prompts_deferred, no_prompts
 import tv, movie
 
 from tvnamer_exceptions import (ShowNotFound, SeasonNotFound, EpisodeNotFound,
 EpisodeNameNotFound, UserAbort, InvalidMatch, NoValidFilesFoundError,
-InvalidFilename, DataRetrievalError)
+InvalidFilename, DataRetrievalError, SelectionDeferred)
 
 log = logging.getLogger(__name__)
 #log.setLevel(logging.WARN)
 
-def doRenameFile(path, newName):
-    """Renames the file. path should be the original path,
-    newName should be string containing new filename.
-    """
-    try:
-        renamer.rename_file(path, newName, 
-                            force=Config['overwrite_destination_on_rename'])
-    except OSError, e:
-        log.exception(e)
-
-
-def doMoveFile(path, destDir = None, destFilepath = None):
-    """Moves file to destDir, or to destFilepath
-    """
-
-    if (destDir is None and destFilepath is None) or \
-       (destDir is not None and destFilepath is not None):
-        raise ValueError("Specify only destDir or destFilepath")
-
-    if not Config['move_files_enable']:
-        raise ValueError("move_files feature is disabled but doMoveFile was called")
-
-#    if Config['move_files_destination'] is None:
-#        raise ValueError("Config value for move_files_destination cannot be None"
-#                         "if move_files_enabled is True")
-
-    try:
-        return renamer.rename_path(
-            path,
-            new_path = destDir,
-            new_fullpath = destFilepath,
-            always_move = Config['always_move'],
-            force = Config['overwrite_destination_on_move'])
-
-    except OSError, e:
-        if log.getEffectiveLevel() <= logging.DEBUG:
-            log.exception(e)
-        else:
-            log.error(e)
-
-
 def confirm(question, options, default = "y"):
     """Takes a question (string), list of options and a default value (used
     when user simply hits enter).
@@ -91,30 +60,77 @@ def confirm(question, options, default = "y"):
             options_str.append(x)
     options_str = "/".join(options_str)
 
-    while True:
-        print "%s (%s) " % (question, options_str),
+    with prompt_lock:
+        while True:
+            print "%s (%s) " % (question, options_str),
+            try:
+                ans = raw_input().strip()
+            except KeyboardInterrupt, errormsg:
+                print "\n", errormsg
+                raise UserAbort(errormsg)
+
+            if ans in options:
+                return ans
+            elif ans == '':
+                return default
+
+
+def lookupFile(filepath):
+    """Parses the path with each media type and queries its database,
+    returning the first info which resolves, or None if none did. If none
+    did but a choice of search result was deferred for a media type, that
+    SelectionDeferred is raised.
+    """
+    log.debug("Found Path: %s" % filepath)
+    deferred = None
+    for info_cls in BaseInfo.get_media_classes():
         try:
-            ans = raw_input().strip()
-        except KeyboardInterrupt, errormsg:
-            print "\n", errormsg
-            raise UserAbort(errormsg)
+            info = info_cls(filepath)
+            log.debug("Detected: %s from %s" % (info, info.fullfilename))
+            info.populate_from_db(force_name=Config['force_name'],
+                                  uid=Config['force_id'])
+
+        except (InvalidFilename, InvalidMatch,
+                ShowNotFound, SeasonNotFound,
+                EpisodeNotFound, EpisodeNameNotFound,
+                DataRetrievalError) as e:
+
+            if log.getEffectiveLevel() <= logging.DEBUG:
+                log.debug(e, exc_info=True)
+            else:
+                log.info(e)
+
+        except SelectionDeferred as e:
+            log.debug("Choice of %s for %s deferred"
+                      % (info_cls.__name__, e.name))
+            if deferred is None:
+                deferred = e
+
+        else:
+            return info
 
-        if ans in options:
-            return ans
-        elif ans == '':
-            return default
+    if deferred is not None:
+        raise deferred
+    return None
 
 
-def processFile(info):
-    """Gets info name, prompts user for input
+def lookupFileQuietly(filepath):
+    """lookupFile, raising SelectionDeferred instead of asking the user to
+    choose a search result. Used for lookups ahead of the file being
+    renamed, as a question about a later file would come before those
+    about earlier ones.
+    """
+    with no_prompts():
+        return lookupFile(filepath)
+
+
+def processFile(info, plan):
+    """Gets info name, prompts user for input, and adds the rename or move
+    to plan
     """
-    log.debug ("Detected: %s from %s" % (info, info.fullfilename))
-    
     move_files_only = Config['move_files_only']
     move_files = Config['move_files_enable']
     question = None
-    
-    info.populate_from_db(force_name=Config['force_name'], uid=Config['force_id'])
 
     if move_files_only:
         new_name = info.fullfilename
@@ -162,9 +178,58 @@ def processFile(info):
             return
     
     if move_files:
-        doMoveFile(info.fullpath, destFilepath = new_filepath)
+        plan.add(info.fullpath,
+                 renamer.move_destination(info.fullpath,
+                                          new_fullpath = new_filepath),
+                 move = True,
+                 force = Config['overwrite_destination_on_move'])
     else:
-        doRenameFile(info.fullpath, new_name)
+        plan.add(info.fullpath,
+                 os.path.join(os.path.dirname(info.fullpath), new_name),
+                 force = Config['overwrite_destination_on_rename'])
+
+def processResult(filepath, info, plan):
+    """Processes the info looked up for a file. Returns False when the run
+    should stop, as the lookup failed and skip_file_on_error is not set.
+    """
+    if info is None:
+        if not Config['skip_file_on_error']:
+            return False
+
+        log.warn("Skipping file <%s>" % filepath)
+        return True
+
+    processFile(info, plan)
+    return True
+
+def processDeferred(deferred, plan):
+    """Looks up the files for which prompts were deferred again, asking
+    which search result is meant. deferred maps each name looked up to its
+    files, so a series or movie is asked about once, as the selectors reuse
+    the choice for the same name.
+    """
+    for filepaths in deferred.values():
+        log.info("%d file(s) need a choice of search result: %s"
+                 % (len(filepaths),
+                    ", ".join(os.path.basename(f) for f in filepaths)))
+        for filepath in filepaths:
+            if not processResult(filepath, lookupFile(filepath), plan):
+                return
+
+def confirmPartial(plan):
+    """Asks whether the renames confirmed before the user quit should be
+    applied. Without anyone to ask (always_rename), they are not.
+    """
+    if not len(plan) or Config['always_rename']:
+        return False
+    try:
+        ans = confirm("Rename or move the %d files confirmed so far?"
+                      % len(plan),
+                      options = ['y', 'n'],
+                      default = 'n')
+    except UserAbort:
+        return False
+    return ans == 'y'
 
 def run(paths):
     """Main movienamer function, takes an array of paths, does stuff.
@@ -172,39 +237,80 @@ def run(paths):
 
     log.info("Starting movienamer")
 
-    info_cls = BaseInfo.get_media_cls(Config['media_type'])
     file_finder = FileFinder(paths)
 
-    #print
-    for filepath in file_finder:
-        log.debug("Found Path: %s" % filepath)           
-        for info_cls in BaseInfo.get_media_classes():
-            try:
-                info = info_cls(filepath)
-                processFile(info)
-
-            except (InvalidFilename, InvalidMatch,
-                    ShowNotFound, SeasonNotFound,
-                    EpisodeNotFound, EpisodeNameNotFound,
-                    DataRetrievalError) as e:
-                
-                if log.getEffectiveLevel() <= logging.DEBUG:
-                    log.debug(e, exc_info=True)
-                else:
-                    log.info(e)
+    # Lookups run ahead of the rename stage (possibly concurrently, and
+    # while the user answers prompts), but results are processed in path
+    # order. Those needing a choice of search result are made again when
+    # their file's turn comes, so prompts are also shown in path order.
+    background = (Config['lookup_workers'] > 1
+                  or Config['lookup_prefetch'] > 0)
+    pool = LookupPool(lookupFileQuietly if background else lookupFile,
+                      workers=Config['lookup_workers'],
+                      prefetch=Config['lookup_prefetch'])
+
+    # Renames and moves are applied together once all files are looked up,
+    # and recorded for --undo
+    plan = RenamePlan()
+    journal = new_journal()
+
+    # Files needing a choice of search result, by name looked up, when
+    # prompts are deferred
+    deferred = OrderedDict()
+    if Config['defer_prompts']:
+        prompts_deferred.set()
 
+    try:
+        try:
+            for filepath, info, error in pool.imap(file_finder):
+                if error is not None:
+                    if not isinstance(error[1], SelectionDeferred):
+                        raise error[0], error[1], error[2]
+                    if Config['defer_prompts']:
+                        log.info("Deferring <%s> until the other files are"
+                                 " done" % filepath)
+                        deferred.setdefault(error[1].name.lower(),
+                                            []).append(filepath)
+                        continue
+                    # Looked up in the background, ask now
+                    info = lookupFile(filepath)
+
+                if not processResult(filepath, info, plan):
+                    break
             else:
-                break
- 
-        else:
-            if not Config['skip_file_on_error']:
-                break
-            
-            log.warn("Skipping file <%s>" % info.fullfilename)
-            #if log.getEffectiveLevel() > logging.WARNING:
-            #    continue
-        
-        #print
+                if deferred:
+                    # Rename everything resolved so far before asking
+                    plan.apply(journal)
+                    prompts_deferred.clear()
+                    processDeferred(deferred, plan)
+        except (KeyboardInterrupt, UserAbort):
+            # Renames confirmed before the user quit are only applied if
+            # they still want them
+            prompts_deferred.clear()
+            if confirmPartial(plan):
+                plan.apply(journal)
+            raise
+
+        plan.apply(journal)
+    finally:
+        prompts_deferred.clear()
+        if len(plan):
+            log.warn("Not renaming or moving %d files" % len(plan))
+
+        if journal is not None:
+            journal.close()
+            if journal.count:
+                log.info("Recorded %d operations in %s (undo with"
+                         " --undo)" % (journal.count, journal.path))
+
+        get_notfound_cache().save()
+        save_state()
+
+        connections = httppool.get_pool()
+        if connections is not None:
+            stats = connections.get_stats()
+            log.debug("HTTP: %(requests)d requests, %(opened)d connections"
+                      " opened, %(reused)d reused" % stats)
 
     log.info("Done")
 
@@ -226,6 +332,7 @@ def load_config(verbose=True, default_configuration=None):
         # No arg, nothing at default config location, don't load anything
         configToLoad = None
     
+    loadedConfig = {}
     if configToLoad is not None:
         log.info("Loading config: %s" % (configToLoad))
         try:
@@ -238,6 +345,9 @@ def load_config(verbose=True, default_configuration=None):
 
 def process_config():
     tmdb3.DEBUG = Config['verbose']
+    movie.use_tmdb_server(Config['tmdb_base_url'])
+    httppool.install(Config['http_pool_size'],
+                     Config['provider_timeout'] or None)
     
     # Process values
     if Config['batch']:
@@ -282,6 +392,11 @@ def main():
         del configToSave['saveconfig']
         del configToSave['loadconfig']
         del configToSave['showconfig']
+        del configToSave['import_catalog']
+        del configToSave['purge_notfound_cache']
+        del configToSave['list_selections']
+        del configToSave['forget_selections']
+        del configToSave['undo_journal']
         json.dump(
             configToSave,
             open(opts.saveconfig, "w+"),
@@ -290,6 +405,50 @@ def main():
 
         opter.exit(0)
 
+    # Import catalog argument
+    if opts.import_catalog is not None:
+        if len(args) == 0:
+            opter.error("No data dumps supplied to import")
+        count = catalog.import_dumps(args, opts.import_catalog)
+        log.info("Catalog %s now holds %d series and movies"
+                 % (opts.import_catalog, count))
+        opter.exit(0)
+
+    # Purge not-found cache argument
+    if opts.purge_notfound_cache:
+        Config.update(opts.__dict__)
+        count = get_notfound_cache().purge()
+        log.info("Forgot %d failed lookups" % count)
+        opter.exit(0)
+
+    # Remembered selection arguments
+    if opts.list_selections:
+        Config.update(opts.__dict__)
+        for kind, query, uid, title, added in selections.list_selections():
+            print "%-6s %-40s #%-8s %s" % (kind, query, uid, title)
+        opter.exit(0)
+
+    if opts.forget_selections:
+        Config.update(opts.__dict__)
+        count = 0
+        for query in opts.forget_selections:
+            count += selections.forget(None if query == "all" else query)
+        save_state()
+        log.info("Forgot %d remembered selections" % count)
+        opter.exit(0)
+
+    # Undo argument
+    if opts.undo_journal is not None:
+        Config.update(opts.__dict__)
+        try:
+            failed = undo(opts.undo_journal)
+        except (IOError, ValueError), e:
+            opter.error(e)
+        if failed:
+            log.error("%d operations could not be undone" % failed)
+            sys.exit(1)
+        opter.exit(0)
+
     # Show config argument
     if opts.showconfig:
         for k, v in opts.__dict__.items():
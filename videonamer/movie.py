@@ -6,10 +6,12 @@ __all__ = ('MovieInfo',)
 
 import operator
 import re
+import socket
 import logging
 from urllib2 import URLError
 
 import tmdb3
+import tmdb3.request
 
 from config import Config
 from utils import (replaceOutputName,
@@ -21,13 +23,24 @@ from tvnamer_exceptions import (ShowNotFound,
                                 DataRetrievalError,
                                 ConfigValueError,
                                 InvalidMatch,
-                                MatchingDataNotFound)
+                                MatchingDataNotFound,
+                                NoGoodMatch)
 from info import BaseInfo
-from selector import ConsoleSelector
+from selector import Selector, ConsoleSelector, prompts_answered
+from catalog import get_catalog, CatalogEntry
+from notfound import get_notfound_cache
+from resilience import call_provider
+from selections import recall, remember, forget
+from titleindex import resolve_title, add_title
 
 log = logging.getLogger(__name__)
 #log.setLevel(logging.DEBUG)
 
+TMDB_BASE_URL = tmdb3.request.Request._base_url
+
+# Results per page of a themoviedb.org search
+TMDB_PAGE_SIZE = 20
+
 def release_date(movie):
     try:
         return movie.releasedate.year
@@ -39,10 +52,56 @@ def release_date(movie):
     except (TypeError, ValueError):
         return -1
 
+def index_title(movie):
+    """Adds a movie from themoviedb.org to the title index
+    """
+    year = release_date(movie)
+    add_title('movie', movie.id, movie.title, year if year > 0 else None)
+
 def movie_formatter(movie):
     return "{0} ({1})".format(movie.title.encode("UTF-8", "ignore"),
                               release_date(movie))
 
+def is_transient(error):
+    """Returns True for themoviedb.org errors worth retrying
+    """
+    if isinstance(error, tmdb3.TMDBHTTPError):
+        return error.httperrno >= 500 or error.httperrno == 429
+    return isinstance(error, (URLError, socket.error))
+
+def use_tmdb_server(base_url):
+    """Sends themoviedb.org API requests to another server, or back to
+    themoviedb.org when base_url is None
+    """
+    if not base_url:
+        base_url = TMDB_BASE_URL
+    tmdb3.request.Request._base_url = base_url.rstrip('/') + '/'
+
+def take_results(results, name, year, max_results):
+    """Reads up to max_results movies from paged search results, scoring
+    each against name as it arrives. Once a page contains a movie matching
+    at least movie_search_good_ratio (and released in year, if known), no
+    further pages are requested.
+    """
+    taken = []
+    good = False
+    for i in xrange(min(len(results), max_results)):
+        if good and i % TMDB_PAGE_SIZE == 0:
+            log.debug("Found %s, not fetching more results" % good.title)
+            break
+
+        result = results[i]
+        log.debug("Search-Result: %s" % result)
+        taken.append(result)
+
+        if not good and (not year or release_date(result) == year):
+            _, ratio = Selector.ratio_map(
+                        name, [result],
+                        candidate_name=operator.attrgetter("title")).next()
+            if ratio >= Config['movie_search_good_ratio']:
+                good = result
+    return taken
+
 def format_genres( genres):
     """Format episode genre(s) into string, using configured values
     """
@@ -86,6 +145,35 @@ class MovieInfo(BaseInfo):
             config_key += '_part'
         return config_key
 
+    def _catalog_movie(self, name, uid=None):
+        """Looks the movie up in the local catalog. Returns None when there
+        is no catalog, or when the movie is not in it and online lookups
+        are allowed.
+        """
+        catalog = get_catalog()
+        if catalog is None:
+            return None
+
+        if uid is None:
+            results = [CatalogEntry(r) for r in catalog.search('movie', name)]
+            same_year = [r for r in results if r.year == self.releasedate]
+            try:
+                return self.__selector.select(
+                            name, same_year or results,
+                            candidate_name=operator.attrgetter("title"),
+                            year=self.releasedate)
+            except MatchingDataNotFound:
+                pass
+        else:
+            record = catalog.get('movie', uid)
+            if record is not None:
+                return CatalogEntry(record)
+
+        if Config['catalog_only']:
+            raise ShowNotFound("Movie '%s' not found in catalog %s"
+                               % (name, catalog.path))
+        return None
+
     def populate_from_db(self, force_name=None, uid=None, adult=False):
         """Queries the moviedb_api
         If series cannot be found, it will warn the user. If the episode is not
@@ -106,23 +194,27 @@ class MovieInfo(BaseInfo):
         def searchMovie(query):
 
             max_results = Config['max_results']
+            if notfound.known('movie', query):
+                raise ShowNotFound("Movie '%s' not found (cached)"
+                                   % ' '.join(query.split('+')))
+
             log.debug("Searching: %s on themoviedb.com" % query)
-            try:
+
+            def fetch():
                 search_results = tmdb3.searchMovie(query,
                                           language=Config['language'],
                                           adult=adult)
-                
-                # paged results, so retrieve them all (max_results)
-                results = []
-                for i, result in enumerate(search_results):
-                    log.debug("Search-Result: %s" % result)
-                    results.append(result)
-                    if i >= max_results:
-                        break
-                
-            except URLError as e:
+                return take_results(search_results,
+                                    force_name or self.movietitle,
+                                    self.releasedate, max_results)
+
+            try:
+                results = call_provider('tmdb', fetch, is_transient)
+            except (URLError, socket.error, tmdb3.TMDBHTTPError) as e:
                 raise DataRetrievalError(
                         "Error connecting to themoviedb.com: %s" % e)
+            for result in results:
+                index_title(result)
 
 #            if len(results) == 0:
 #                raise ShowNotFound(
@@ -132,30 +224,82 @@ class MovieInfo(BaseInfo):
             try:
                 return self.__selector.select(force_name or self.movietitle,
                                           results,
-                                          candidate_name=operator.attrgetter("title"))
+                                          candidate_name=operator.attrgetter("title"),
+                                          year=self.releasedate)
             except MatchingDataNotFound:
+                if results:
+                    raise NoGoodMatch(
+                            "No good match for movie '%s' on themoviedb.com"
+                                % ' '.join(query.split('+')))
+                notfound.add('movie', query)
                 raise ShowNotFound(
                         "Movie '%s' not found on themoviedb.com"
                             % ' '.join(query.split('+')))
 
-        if uid is not None:
-            # Search By UID
-            try:
-                req = tmdb3.utils.Request("movie/{0}".format(int(uid)),
-                                          include_adult=adult)
-                movie = tmdb3.utils.MovieSearchResult(req,
-                               language=Config['language'])[0]
-            except URLError as e:
-                raise DataRetrievalError(
-                            "Error connecting to themoviedb.com: %s" % e)
-            except IndexError:
-                raise ShowNotFound("Movie #%d not found on themoviedb.com" % uid)
+        def findMovie(uid):
+            movie = self._catalog_movie(force_name or self.movietitle, uid=uid)
 
-        else:
-            queryend = "+%d" % self.releasedate if self.releasedate else ""
+            if movie is not None:
+                log.debug("Found %s in catalog" % movie.title)
+
+            elif uid is not None:
+                # Search By UID
+                if notfound.known('movie', u"#%s" % uid):
+                    raise ShowNotFound("Movie #%s not found (cached)" % uid)
+
+                def fetch():
+                    req = tmdb3.utils.Request("movie/{0}".format(int(uid)),
+                                              include_adult=adult)
+                    return tmdb3.utils.MovieSearchResult(req,
+                                   language=Config['language'])[0]
 
-            query = "%s%s" % (force_name or self.movietitle, queryend)
-            movie = searchMovie(query)
+                try:
+                    movie = call_provider('tmdb', fetch, is_transient)
+                except (URLError, socket.error, tmdb3.TMDBHTTPError) as e:
+                    raise DataRetrievalError(
+                                "Error connecting to themoviedb.com: %s" % e)
+                except IndexError:
+                    notfound.add('movie', u"#%s" % uid)
+                    raise ShowNotFound("Movie #%d not found on themoviedb.com" % uid)
+                index_title(movie)
+
+            else:
+                movie = searchMovie(query)
+            return movie
+
+        notfound = get_notfound_cache()
+
+        queryend = "+%d" % self.releasedate if self.releasedate else ""
+        query = "%s%s" % (force_name or self.movietitle, queryend)
+
+        # A movie picked for this name before is fetched by its id
+        movie = None
+        remembered = recall('movie', query) if uid is None else None
+        if remembered is not None:
+            try:
+                movie = findMovie(remembered)
+            except ShowNotFound:
+                log.info("Remembered movie #%s for %s not found, searching"
+                         " again" % (remembered, query))
+                forget(query, kind='movie')
+
+        # Titles seen before are resolved without a search
+        if movie is None and uid is None:
+            local = resolve_title('movie', [force_name or self.movietitle],
+                                  year=self.releasedate or None)
+            if local is not None:
+                try:
+                    movie = findMovie(local)
+                except ShowNotFound:
+                    log.debug("Movie #%s from the title index not found"
+                              % local)
+
+        if movie is None:
+            answered = prompts_answered()
+            movie = findMovie(uid)
+            # Only choices the user made are remembered
+            if uid is None and prompts_answered() > answered:
+                remember('movie', query, movie.id, movie.title)
 
         #log.debug("Found Series\n\t" + '\n\t'.join((
         #        "%s: %s" % (attr, getattr(movie, attr))
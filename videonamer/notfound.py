@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+"""Negative-result cache for tvnamer/movienamer
+
+Remembers queries the online databases could not answer, so files which
+failed recently fail again instantly instead of repeating the searches.
+Searches whose results only scored too low are not remembered, as they
+depend on the matching thresholds rather than on the databases.
+"""
+__all__ = ('NotFoundCache', 'get_notfound_cache')
+
+import os
+import time
+import logging
+import threading
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from config import Config
+from state import state_path, write_json
+
+log = logging.getLogger(__name__)
+
+
+class NotFoundCache(object):
+    """Failed lookups, each remembered for ttl seconds. Entries are keyed on
+    the media type, the exact query and any extra detail of how the lookup
+    was done (such as whether the search was retried without the year).
+    kind_ttls gives other ttls for some media types.
+    """
+
+    def __init__(self, path, ttl, kind_ttls=None):
+        self.path = path
+        self.ttl = ttl
+        self.kind_ttls = kind_ttls or {}
+        self._entries = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            entries = json.load(open(self.path))
+        except IOError:
+            return
+        except ValueError, e:
+            log.warn("Ignoring corrupt not-found cache %s: %s"
+                     % (self.path, e))
+            return
+
+        now = time.time()
+        self._entries = dict((k, t) for k, t in entries.items()
+                             if now - t < self._ttl(k))
+        self._dirty = len(self._entries) != len(entries)
+
+    @staticmethod
+    def _key(kind, query, *detail):
+        return u"\t".join([kind, query.lower()] + [unicode(d) for d in detail])
+
+    def _ttl(self, key):
+        return self.kind_ttls.get(key.split(u"\t", 1)[0], self.ttl)
+
+    def known(self, kind, query, *detail):
+        """Returns True if the query failed less than ttl seconds ago
+        """
+        key = self._key(kind, query, *detail)
+        with self._lock:
+            added = self._entries.get(key)
+            if added is None:
+                return False
+            if time.time() - added >= self._ttl(key):
+                del self._entries[key]
+                self._dirty = True
+                return False
+            return True
+
+    def add(self, kind, query, *detail):
+        """Remembers that the query failed
+        """
+        key = self._key(kind, query, *detail)
+        if self._ttl(key) <= 0:
+            return
+        with self._lock:
+            self._entries[key] = time.time()
+            self._dirty = True
+
+    def purge(self):
+        """Forgets all failed lookups, returning how many there were
+        """
+        with self._lock:
+            count = len(self._entries)
+            self._entries = {}
+            self._dirty = False
+            if os.path.isfile(self.path):
+                os.remove(self.path)
+        return count
+
+    def __len__(self):
+        return len(self._entries)
+
+    def save(self):
+        """Writes the cache to disk, if it has changed
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            write_json(self.path, self._entries)
+            self._dirty = False
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_notfound_cache():
+    """Returns the NotFoundCache configured by cache_dir,
+    notfound_cache_ttl and notfound_episode_cache_ttl
+    """
+    global _cache
+
+    path = state_path("notfound.json")
+    with _cache_lock:
+        if _cache is None or _cache.path != path:
+            _cache = NotFoundCache(path, Config['notfound_cache_ttl'])
+        _cache.ttl = Config['notfound_cache_ttl']
+        _cache.kind_ttls = {
+            'tv-episode': min(Config['notfound_episode_cache_ttl'],
+                              Config['notfound_cache_ttl'])}
+        return _cache
@@ -6,6 +6,7 @@
 import os
 import re
 import logging
+import threading
 
 from config import Config
 from utils import applyCustomInputReplacements
@@ -20,27 +21,29 @@ class FileParser(object):
     """Deals with parsing of filenames
     """
     __unique_objects = {}
+    __lock = threading.Lock()
     
-    def __new__(cls, config_key=''):
-        try:
-            return cls.__unique_objects['config_key']
-        except KeyError:
-            pass
-        
-        log.debug("FileParser.__new__( %s )" % config_key)
-        self = super(FileParser, cls).__new__(cls, config_key=config_key)
-        cls.__unique_objects['config_key'] = self
-        return self
+    def __new__(cls, config_key='filename_patterns'):
+        with cls.__lock:
+            try:
+                self = cls.__unique_objects[config_key]
+            except KeyError:
+                log.debug("FileParser.__new__( %s )" % config_key)
+                self = super(FileParser, cls).__new__(cls)
+                self.patterns = None
+                cls.__unique_objects[config_key] = self
 
-    def __init__(self, config_key='filename_patterns'):
-        self._compileRegexs(config_key)
+            if self.patterns != Config[config_key]:
+                # First use, or the configured patterns have changed
+                self._compileRegexs(config_key)
+            return self
 
     def _compileRegexs(self, config_key):
         """Takes episode_patterns from config, compiles them all
         into self.compiled_regexs
         """
         substitutions = Config["common_patterns"]
-        self.compiled_regexs = []
+        compiled_regexs = []
         for cpattern in Config[config_key]:
             pattern = cpattern.format(**substitutions)
             #print pattern
@@ -51,7 +54,10 @@ class FileParser(object):
                 log.warn("Invalid episode_pattern (error: %s)\nPattern:\n%s"
                      % (errormsg, cpattern))
             else:
-                self.compiled_regexs.append(cregex)
+                compiled_regexs.append(cregex)
+
+        self.compiled_regexs = compiled_regexs
+        self.patterns = list(Config[config_key])
 
     def parse(self, filename):
         """Runs path via configured regex, extracting data from groups.
@@ -0,0 +1,368 @@
+#!/usr/bin/env python
+
+"""Plans and applies the renames and moves of a run
+
+Files are looked up (and confirmed) one at a time, but nothing is renamed
+until every operation of the run is known. Two files given the same new
+name, and destinations which exist already, are found before anything is
+touched. Operations are ordered so a file is renamed out of the way before
+another takes its name, and cycles (such as two files swapping names) are
+broken by moving one file to a temporary name first.
+"""
+__all__ = ('Operation', 'RenamePlan', 'connected_groups')
+
+import os
+import logging
+from collections import OrderedDict, deque
+
+from config import Config
+from dircache import DirectoryCache
+from lookup import LookupPool
+import renamer
+
+log = logging.getLogger(__name__)
+
+
+class Operation(object):
+    """Renaming (or with move set, moving) source to destination. Both are
+    absolute paths.
+    """
+
+    def __init__(self, source, destination, move=False, force=False,
+                 mode=None):
+        self.source = self.original = source
+        self.destination = destination
+        self.move = move
+        self.force = force
+        # The renamer placement mode of a move, None for the configured one
+        self.mode = mode
+
+    def apply(self, directories=None):
+        if self.move:
+            return renamer.move_file(self.source, self.destination,
+                                     force=self.force,
+                                     always_move=Config['always_move'],
+                                     mode=self.mode,
+                                     directories=directories)
+        if os.path.dirname(self.source) != os.path.dirname(self.destination):
+            raise ValueError("Can't rename %s to another directory"
+                             % self.source)
+        return renamer.rename_file(self.source,
+                                   os.path.basename(self.destination),
+                                   force=self.force,
+                                   directories=directories)
+
+    def __repr__(self):
+        return "<Operation %s %s -> %s>" % ("move" if self.move else "rename",
+                                            self.source, self.destination)
+
+
+def _temporary_name(path, taken):
+    dirname, filename = os.path.split(path)
+    for i in xrange(1000):
+        candidate = os.path.join(dirname, ".%s.videonamer-%d" % (filename, i))
+        if candidate not in taken and not os.path.lexists(candidate):
+            return candidate
+    raise OSError("No temporary name available for %s" % path)
+
+
+class RenamePlan(object):
+    """The operations of a run, applied together by apply(). The
+    directories the files are renamed in are listed once, and kept in
+    self.directories (a dircache.DirectoryCache) for the rest of the run.
+    """
+
+    def __init__(self):
+        self.operations = []
+        self.directories = DirectoryCache()
+        self.results = []
+
+    def __len__(self):
+        return len(self.operations)
+
+    def add(self, source, destination, move=False, force=False):
+        """Adds an operation, unless the file is already at destination
+        """
+        source = os.path.abspath(source)
+        destination = os.path.abspath(destination)
+        if source == destination:
+            log.debug("Existing filepath is correct: %s" % source)
+            return None
+        operation = Operation(source, destination, move=move, force=force)
+        self.operations.append(operation)
+        return operation
+
+    def conflicts(self):
+        """Returns (operation, reason) pairs for the operations which can't
+        be applied: those with a destination already used by an earlier
+        operation, or which exists and is not renamed away by the plan
+        (unless force is set)
+        """
+        skipped = {}
+        changed = True
+        while changed:
+            # A skipped operation leaves its file in place, which can block
+            # the operations renaming another file to its name
+            changed = False
+            sources = set(op.source for op in self.operations
+                          if op not in skipped)
+            destinations = {}
+            for op in self.operations:
+                if op in skipped:
+                    continue
+                if op.destination in destinations:
+                    skipped[op] = ("%s is also the destination of %s"
+                                   % (op.destination,
+                                      destinations[op.destination]))
+                elif (not op.force and op.destination not in sources
+                      and self.directories.exists(op.destination)):
+                    skipped[op] = "File %s already exists" % op.destination
+                else:
+                    destinations[op.destination] = op.source
+                    continue
+                changed = True
+        return [(op, skipped[op]) for op in self.operations if op in skipped]
+
+    def steps(self):
+        """Returns the operations which can be applied, in an order in
+        which no destination is still in use by a file yet to be renamed.
+        Cycles are broken by renaming a file to a temporary name first.
+        """
+        skipped = set(op for op, reason in self.conflicts())
+        operations = [op for op in self.operations if op not in skipped]
+
+        # Files not renamed yet, and operations waiting for one of them
+        pending = OrderedDict((op.source, op) for op in operations)
+        waiting = dict((op.destination, op) for op in operations
+                       if op.destination in pending)
+        ready = deque(op for op in operations
+                      if op.destination not in pending)
+
+        steps = []
+        taken = set(op.destination for op in operations)
+
+        def done(source):
+            pending.pop(source, None)
+            blocked = waiting.pop(source, None)
+            if blocked is not None:
+                ready.append(blocked)
+
+        while pending or ready:
+            if not ready:
+                # Everything left is in a cycle: move one file out of the
+                # way, and rename it from there when its turn comes
+                op = pending.values()[0]
+                temporary = _temporary_name(op.source, taken)
+                taken.add(temporary)
+                steps.append(Operation(op.source, temporary))
+                # The original name is taken by then, so the file has to
+                # be moved on rather than linked or copied
+                parked = Operation(temporary, op.destination, move=op.move,
+                                   force=op.force, mode='move')
+                parked.original = op.source
+                waiting[op.destination] = parked
+                done(op.source)
+                continue
+
+            op = ready.popleft()
+            steps.append(op)
+            done(op.source)
+        return steps
+
+    def _apply_one(self, op, journal):
+        # Returns the OSError the operation failed with, or None
+        try:
+            op.apply(self.directories)
+        except OSError, e:
+            if log.getEffectiveLevel() <= logging.DEBUG:
+                log.exception(e)
+            else:
+                log.error(e)
+            if op.source != op.original:
+                log.error("%s was left at %s" % (op.original, op.source))
+            return e
+
+        if journal is not None and not Config['test_mode']:
+            if not op.move:
+                kind = 'rename'
+            elif self.directories.exists(op.source):
+                kind = 'copy'
+            else:
+                kind = 'move'
+            journal.record(kind, op.source, op.destination)
+        return None
+
+    def space_needed(self):
+        """Returns {directory: [bytes, inodes]} for the files which will be
+        copied (rather than renamed or linked), and the directories which
+        will be created, by the operations that can be applied. Each
+        directory is the first existing directory of a destination, one
+        per filesystem. Reflinks are counted as copies, as they are copies
+        on filesystems which can't clone files.
+        """
+        created = set()
+        needed = {}
+        roots = {}
+        skipped = set(op for op, reason in self.conflicts())
+        for op in self.operations:
+            if op in skipped or not op.move:
+                continue
+            existing = _existing_directory(op.destination, created)
+            device = self.directories.device(existing)
+            root = roots.setdefault(device, existing)
+            counts = needed.setdefault(root, [0, 0])
+
+            mode = op.mode or renamer.placement_mode(op.destination)
+            same_device = (self.directories.device(
+                                os.path.dirname(op.source)) == device)
+            if same_device and mode in ('move', 'hardlink', 'link'):
+                continue
+            stat = os.stat(op.source)
+            # Sparse files only need their data copied
+            counts[0] += min(stat.st_size, getattr(stat, 'st_blocks',
+                                                   stat.st_size) * 512)
+            counts[1] += 1
+
+        for directory in created:
+            existing = _existing_directory(directory, set())
+            root = roots.setdefault(self.directories.device(existing),
+                                    existing)
+            needed.setdefault(root, [0, 0])[1] += 1
+        return needed
+
+    def preflight(self):
+        """Returns a list of messages for the filesystems which don't have
+        enough free space or inodes for the files copied to them, less
+        preflight_margin of their size
+        """
+        if not hasattr(os, 'statvfs'):
+            return []
+        margin = Config['preflight_margin']
+        shortfalls = []
+        for directory, (size, inodes) in sorted(self.space_needed().items()):
+            vfs = os.statvfs(directory)
+            free = (vfs.f_bavail - vfs.f_blocks * margin) * vfs.f_frsize
+            if size > free:
+                shortfalls.append(
+                    "%s needs %.1fMB free for the files copied to it, but"
+                    " has %.1fMB (after keeping %d%% free)"
+                    % (directory, size / 1048576.0,
+                       max(0, free) / 1048576.0, margin * 100))
+            # Filesystems without a fixed number of inodes report none
+            free_inodes = vfs.f_favail - vfs.f_files * margin
+            if vfs.f_files and inodes > free_inodes:
+                shortfalls.append(
+                    "%s needs %d free inodes for the files and directories"
+                    " created on it, but has %d (after keeping %d%% free)"
+                    % (directory, inodes, max(0, free_inodes),
+                       margin * 100))
+        return shortfalls
+
+    def apply(self, journal=None, workers=None):
+        """Applies the operations, skipping (and logging) conflicting ones,
+        and records those done in journal (a journal.Journal), if given.
+        Returns the number of operations which failed or were skipped, and
+        sets self.results to (operation, error) pairs for every operation
+        applied, in order, where error is the OSError it failed with or
+        None.
+
+        Operations sharing no file with each other (see connected_groups)
+        are applied by up to workers (default rename_workers) threads at
+        once, as each rename takes a round trip on network filesystems.
+        Those which do (such as the steps of a swap) are applied in order.
+
+        If preflight is set, nothing is applied when a filesystem files are
+        copied to is too full for them (see preflight()).
+        """
+        if workers is None:
+            workers = Config['rename_workers']
+        self.results = []
+        if Config['preflight'] and not Config['test_mode']:
+            shortfalls = self.preflight()
+            if shortfalls:
+                for message in shortfalls:
+                    log.error(message)
+                log.error("Not renaming or moving any of %d files"
+                          % len(self.operations))
+                failed = len(self.operations)
+                self.operations = []
+                return failed
+
+        failed = 0
+        for op, reason in self.conflicts():
+            log.error("Not renaming %s: %s" % (op.source, reason))
+            failed += 1
+
+        steps = self.steps()
+        groups = connected_groups(steps, lambda op: (op.source,
+                                                     op.destination))
+        # Moves may be long copies, which can wait for their disks, so the
+        # renames are not held up behind them
+        groups.sort(key=lambda group: any(op.move for op in group))
+        if steps:
+            log.debug("Applying %d renames in %d independent groups"
+                      % (len(steps), len(groups)))
+
+        def apply_group(group):
+            return [(op, self._apply_one(op, journal)) for op in group]
+
+        results = {}
+        pool = LookupPool(apply_group, workers=min(workers, len(groups)))
+        for group, group_results, error in pool.imap(groups):
+            if error is not None:
+                raise error[0], error[1], error[2]
+            results.update(group_results)
+
+        self.results = [(op, results[op]) for op in steps]
+        failed += sum(1 for op, error in self.results if error is not None)
+        if steps:
+            log.debug("Saved %d directory lookups"
+                      % self.directories.hits)
+        self.operations = []
+        return failed
+
+
+def _existing_directory(path, created):
+    """Returns the nearest directory containing path which exists, adding
+    those which don't (and will be created) to the set created
+    """
+    directory = os.path.dirname(path)
+    while not os.path.isdir(directory):
+        created.add(directory)
+        parent = os.path.dirname(directory)
+        if parent == directory:
+            break
+        directory = parent
+    return directory
+
+
+def connected_groups(items, paths):
+    """Splits items into groups which have no path (of those paths(item)
+    returns for each item) in common with another group. Items keep their
+    order within each group, and the groups are in the order of their
+    first items.
+    """
+    parent = {}
+
+    def find(path):
+        parent.setdefault(path, path)
+        while parent[path] != path:
+            parent[path] = parent[parent[path]]
+            path = parent[path]
+        return path
+
+    for item in items:
+        first = None
+        for path in paths(item):
+            path = os.path.normcase(path)
+            if first is None:
+                first = find(path)
+            else:
+                parent[find(path)] = first
+                first = find(first)
+
+    groups = OrderedDict()
+    for item in items:
+        root = find(os.path.normcase(paths(item)[0]))
+        groups.setdefault(root, []).append(item)
+    return groups.values()
@@ -4,20 +4,37 @@
 """
 
 import os
+import errno
 import shutil
+import hashlib
 import logging
 
 from config import Config
+from copier import copy_file, clone_file, progress_path, CLONE_UNSUPPORTED
+from transfers import get_scheduler
+from tvnamer_exceptions import ConfigValueError
 from utils import (applyCustomFullpathReplacements,
                    same_partition,
                    delete_file)
 
-__all__ = ('rename_file', 'rename_path')
+__all__ = ('rename_file', 'rename_path', 'move_destination', 'move_file',
+           'copy_into_place', 'link_into_place', 'clone_into_place',
+           'partial_path', 'placement_mode', 'PLACEMENT_MODES')
 
 log = logging.getLogger(__name__)
 
-def rename_file(old_path, new_name, force=False):
+PLACEMENT_MODES = ('move', 'copy', 'hardlink', 'reflink', 'link')
+
+# Errors meaning a file can't be hardlinked there, rather than that linking
+# failed: another filesystem, or one without links (such as FAT)
+LINK_UNSUPPORTED = set([errno.EXDEV, errno.EPERM, errno.EMLINK,
+                        errno.EOPNOTSUPP, errno.ENOSYS])
+
+def rename_file(old_path, new_name, force=False, directories=None):
     """Renames a file, keeping the path the same.
+
+    directories is the run's dircache.DirectoryCache, if there is one,
+    which is then used to check the new name is free.
     """
     test_mode = Config['test_mode']
     
@@ -25,7 +42,8 @@ def rename_file(old_path, new_name, force=False):
     filepath, filename = os.path.split(oldpath)
     newpath = os.path.join(filepath, new_name)
 
-    if os.path.isfile(newpath):
+    if (os.path.isfile(newpath) if directories is None
+        else directories.exists(newpath)):
         # If the destination exists, raise exception unless force is True
         if not force:
             raise OSError("File %s already exists, "
@@ -36,35 +54,25 @@ def rename_file(old_path, new_name, force=False):
              "Renaming:\n   ** %s\n   => %s" % (old_path, newpath))
     if not test_mode:
         os.rename(old_path, newpath)
+        if directories is not None:
+            directories.removed(oldpath)
+            directories.added(newpath)
     
     return newpath
 
-def rename_path(old_path, new_path=None, new_fullpath=None, force=False,
-                  always_copy=False, always_move=False, create_dirs=True):
-    """Moves the file to a new path.
-
-    If it is on the same partition,
-        it will be moved (unless always_copy is True)
-    If it is on a different partition,
-        it will be copied.
-    If the target file already exists,
-        it will raise OSError unless force is True.
+def move_destination(old_path, new_path=None, new_fullpath=None):
+    """Returns the absolute path a file is moved to by rename_path, given
+    either the new directory or the new path (relative paths are relative
+    to the file's directory), after the custom full path replacements.
     """
-    test_mode = Config['test_mode']
-    
-    old_path = os.path.abspath(old_path)
-
-    if always_copy and always_move:
-        raise ValueError("Both always_copy and always_move "
-                         "cannot be specified")
-
     if (new_path is None and new_fullpath is None) or \
        (new_path is not None and new_fullpath is not None):
         raise ValueError("Specify only new_dir or new_fullpath")
 
-    if new_path is not None:
-        old_dir, old_filename = os.path.split(old_path)
+    old_path = os.path.abspath(old_path)
+    old_dir, old_filename = os.path.split(old_path)
 
+    if new_path is not None:
         # Join new filepath to old one (to handle realtive dirs)
         new_dir = os.path.abspath(os.path.join(old_dir, new_path))
 
@@ -72,54 +80,293 @@ def rename_path(old_path, new_path=None, new_fullpath=None, force=False,
         new_fullpath = os.path.join(new_dir, old_filename)
 
     else:
-        old_dir, old_filename = os.path.split(old_path)
-
         # Join new filepath to old one (to handle realtive dirs)
         new_fullpath = os.path.abspath(os.path.join(old_dir, new_fullpath))
 
-        new_dir = os.path.dirname(new_fullpath)
-
     if len(Config['move_files_fullpath_replacements']) > 0:
         log.debug("Before custom full path replacements: %s" % (new_fullpath))
         new_fullpath = applyCustomFullpathReplacements(new_fullpath)
-        new_dir = os.path.dirname(new_fullpath)
+
+    return new_fullpath
+
+def rename_path(old_path, new_path=None, new_fullpath=None, force=False,
+                  always_copy=False, always_move=False, create_dirs=True,
+                  mode=None, directories=None):
+    """Moves the file to a new path.
+
+    If it is on the same partition,
+        it will be moved (unless always_copy is True)
+    If it is on a different partition,
+        it will be copied.
+    If the target file already exists,
+        it will raise OSError unless force is True.
+    Other placement modes (see move_file) link or copy the file instead.
+    """
+    new_fullpath = move_destination(old_path, new_path, new_fullpath)
+    return move_file(old_path, new_fullpath, force=force,
+                     always_copy=always_copy, always_move=always_move,
+                     create_dirs=create_dirs, mode=mode,
+                     directories=directories)
+
+def move_file(old_path, new_fullpath, force=False,
+              always_copy=False, always_move=False, create_dirs=True,
+              mode=None, directories=None):
+    """Moves the file to new_fullpath, an absolute path from
+    move_destination. See rename_path.
+
+    mode is one of PLACEMENT_MODES, by default that of new_fullpath (see
+    placement_mode), or 'copy' with always_copy. Other than 'move', the
+    modes leave the original in place: 'hardlink' links the file to
+    new_fullpath if the filesystem allows, 'reflink' clones it, and
+    'link' tries both. Files which can't be linked are copied.
+
+    directories is the run's dircache.DirectoryCache, if there is one,
+    which then creates the directory, checks the new name is free and
+    finds the partitions, each once per directory.
+    """
+    test_mode = Config['test_mode']
+
+    old_path = os.path.abspath(old_path)
+    new_dir = os.path.dirname(new_fullpath)
+
+    if always_copy and always_move:
+        raise ValueError("Both always_copy and always_move "
+                         "cannot be specified")
 
     getattr(log, "info" if test_mode or Config['select_first'] else "debug")(
              "Moving:\n   ** %s\n   => %s" % (old_path, new_fullpath))
     if test_mode:
         return new_fullpath
 
-    if create_dirs:
-        log.debug("Creating directory %s" % new_dir)
-        try:
-            os.makedirs(new_dir)
-        except OSError, e:
-            if e.errno != 17:
-                raise
+    if directories is None:
+        if create_dirs:
+            log.debug("Creating directory %s" % new_dir)
+            try:
+                os.makedirs(new_dir)
+            except OSError, e:
+                if e.errno != 17:
+                    raise
+        exists = os.path.isfile(new_fullpath)
+    else:
+        if create_dirs:
+            directories.makedirs(new_dir)
+        exists = directories.exists(new_fullpath)
 
-    if os.path.isfile(new_fullpath):
+    if exists:
         # If the destination exists, raise exception unless force is True
         if not force:
             raise OSError("File %s already exists, "
                           "not forcefully moving %s"
                           % (new_fullpath, old_path))
 
-    if same_partition(old_path, new_dir):
+    if mode is None:
+        mode = 'copy' if always_copy else placement_mode(new_fullpath)
+    if mode != 'move':
+        if not _place_link(old_path, new_fullpath, mode):
+            log.debug("copy %s to %s" % (old_path, new_fullpath))
+            copy_into_place(old_path, new_fullpath)
+        if directories is not None:
+            directories.added(new_fullpath)
+        return new_fullpath
+
+    if directories is None:
+        on_partition = same_partition(old_path, new_dir)
+    else:
+        on_partition = directories.same_partition(old_path, new_dir)
+    moved = False
+    if on_partition:
         if always_copy:
             # Same partition, but forced to copy
             log.debug("copy %s to %s" % (old_path, new_fullpath))
-            shutil.copyfile(old_path, new_fullpath)
+            copy_into_place(old_path, new_fullpath)
         else:
             # Same partition, just rename the file to move it
             log.debug("move %s to %s" % (old_path, new_fullpath))
             os.rename(old_path, new_fullpath)
+            moved = True
     else:
         # File is on different partition (different disc), copy it
         log.debug("copy %s to %s" % (old_path, new_fullpath))
-        shutil.copyfile(old_path, new_fullpath)
+        copy_into_place(old_path, new_fullpath, keep_times=always_move)
         if always_move:
-            # Forced to move file, we just trash old file
+            # Forced to move file, the copy is safely on disk so we just
+            # trash old file
             log.debug("Deleting %s" % (old_path))
             delete_file(old_path)
+            moved = True
+
+    if directories is not None:
+        directories.added(new_fullpath)
+        if moved:
+            directories.removed(old_path)
+    return new_fullpath
+
+def partial_path(new_fullpath):
+    """Returns the temporary name a file is copied to before it is renamed
+    to new_fullpath
+    """
+    new_dir, new_filename = os.path.split(new_fullpath)
+    return os.path.join(new_dir, ".%s.videonamer-partial" % new_filename)
+
+def _fsync(path):
+    """Forces the file or directory at path to disk. Directories can't be
+    opened on every system, in which case they are left alone.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        if os.path.isdir(path):
+            return
+        raise
+    try:
+        os.fsync(fd)
+    except OSError, e:
+        # Some filesystems can't sync directories
+        if e.errno not in (errno.EINVAL, errno.EBADF):
+            raise
+    finally:
+        os.close(fd)
+
+def _checksum(path, block_size=1024 * 1024):
+    digest = hashlib.sha1()
+    f = open(path, "rb")
+    try:
+        while True:
+            block = f.read(block_size)
+            if not block:
+                break
+            digest.update(block)
+    finally:
+        f.close()
+    return digest.hexdigest()
 
+def verify_copy(old_path, copy_path):
+    """Raises OSError if copy_path does not match old_path, as checked
+    according to move_verify
+    """
+    verify = Config['move_verify']
+    if verify not in ('none', 'size', 'checksum'):
+        raise ConfigValueError("Unknown move_verify %r, expected 'none',"
+                               " 'size' or 'checksum'" % (verify, ))
+    if verify == 'none':
+        return
+    if os.path.getsize(old_path) != os.path.getsize(copy_path):
+        raise OSError(errno.EIO, "Copy %s of %s has the wrong size"
+                                 % (copy_path, old_path))
+    if verify == 'checksum' and _checksum(old_path) != _checksum(copy_path):
+        raise OSError(errno.EIO, "Copy %s of %s has the wrong contents"
+                                 % (copy_path, old_path))
+
+def _into_place(new_fullpath, write):
+    # Calls write with a temporary name in the directory of new_fullpath,
+    # which is renamed to new_fullpath once it is on disk (or removed if
+    # anything fails, unless it is a resumable copy which can be carried
+    # on), so a partly written file is never at new_fullpath
+    partial = partial_path(new_fullpath)
+    try:
+        write(partial)
+        _fsync(partial)
+        os.rename(partial, new_fullpath)
+    except:
+        if os.path.exists(progress_path(partial)):
+            log.info("Keeping %s to carry on copying it next time"
+                     % partial)
+        elif os.path.lexists(partial):
+            os.remove(partial)
+        raise
+    # The new name is only durable once the directory is on disk too
+    _fsync(os.path.dirname(new_fullpath))
     return new_fullpath
+
+def copy_into_place(old_path, new_fullpath, keep_times=False):
+    """Copies old_path to new_fullpath without a partly written file ever
+    being at new_fullpath: the file is copied to a temporary name in the
+    same directory, verified (see verify_copy), forced to disk, and then
+    renamed.
+
+    With keep_times, the permissions and times of old_path are kept, as
+    they would be if the file was moved.
+
+    If anything fails the temporary file is removed, unless the copy was
+    resumable: large files are copied resumably (see copier.copy_file)
+    when copy_resume is set, and an interrupted copy of one is kept at the
+    temporary name, to be carried on by the next copy_into_place of the
+    same file.
+
+    The copy (and its verification) waits for a stream slot on the
+    devices of both files, and keeps to their rate limits (see
+    transfers.DeviceScheduler).
+    """
+
+    def write(partial):
+        with get_scheduler().transfer(old_path,
+                                      os.path.dirname(partial)) as throttle:
+            copy_file(old_path, partial, throttle=throttle,
+                      resumable=Config['copy_resume'])
+            if keep_times:
+                shutil.copystat(old_path, partial)
+            verify_copy(old_path, partial)
+    return _into_place(new_fullpath, write)
+
+def link_into_place(old_path, new_fullpath):
+    """Hardlinks old_path to new_fullpath (replacing any file there).
+    Raises OSError if the filesystem can't.
+    """
+    if os.path.exists(new_fullpath) and os.path.samefile(old_path,
+                                                         new_fullpath):
+        # Linked already (renaming a link onto itself does nothing)
+        return new_fullpath
+
+    def write(partial):
+        if os.path.lexists(partial):
+            # Left by an interrupted copy
+            os.remove(partial)
+        os.link(old_path, partial)
+    return _into_place(new_fullpath, write)
+
+def clone_into_place(old_path, new_fullpath):
+    """Makes new_fullpath a reflink of old_path (see copier.clone_file).
+    Raises OSError if the filesystem can't.
+    """
+    return _into_place(new_fullpath, lambda partial: clone_file(old_path,
+                                                                partial))
+
+def placement_mode(new_fullpath):
+    """Returns the placement mode of a file moved to new_fullpath: that of
+    the longest directory in placement_modes containing new_fullpath, or
+    placement_mode
+    """
+    mode = Config['placement_mode']
+    longest = None
+    for directory, directory_mode in Config['placement_modes'].items():
+        directory = os.path.join(os.path.abspath(
+                                 os.path.expanduser(directory)), "")
+        if (new_fullpath.startswith(directory) and
+            (longest is None or len(directory) > len(longest))):
+            longest, mode = directory, directory_mode
+    if mode not in PLACEMENT_MODES:
+        raise ConfigValueError("Unknown placement mode %r, expected one of"
+                               " %s" % (mode, ", ".join(PLACEMENT_MODES)))
+    return mode
+
+def _place_link(old_path, new_fullpath, mode):
+    """Hardlinks or clones old_path to new_fullpath as mode allows, and
+    returns True, or returns False if the filesystem can't
+    """
+    attempts = []
+    if mode in ('hardlink', 'link'):
+        attempts.append(('hardlink', link_into_place, LINK_UNSUPPORTED))
+    if mode in ('reflink', 'link'):
+        attempts.append(('reflink', clone_into_place, CLONE_UNSUPPORTED))
+    for name, place, unsupported in attempts:
+        try:
+            place(old_path, new_fullpath)
+        except OSError, e:
+            if e.errno not in unsupported:
+                raise
+            log.debug("Can't %s %s to %s (%s)" % (name, old_path,
+                                                  new_fullpath, e))
+            continue
+        log.debug("%s %s to %s" % (name, old_path, new_fullpath))
+        return True
+    return False
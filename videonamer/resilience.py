@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+"""Retries and circuit breakers for requests to thetvdb.com/themoviedb.org
+"""
+__all__ = ('CircuitBreaker', 'call_provider', 'get_breaker')
+
+import time
+import random
+import logging
+import threading
+
+from config import Config
+from lookup import provider_slot
+from tvnamer_exceptions import ProviderUnavailable
+
+log = logging.getLogger(__name__)
+
+
+class CircuitBreaker(object):
+    """Tracks consecutive failures of a provider. Once `threshold` requests
+    in a row have failed the breaker opens, and requests are refused until
+    `cooldown` seconds have passed. A single trial request is then let
+    through: if it succeeds the breaker closes, otherwise it opens again.
+    """
+
+    def __init__(self, name, threshold, cooldown):
+        self.name = name
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.opened_at is not None
+
+    def allow(self):
+        """Returns True if a request may be made now
+        """
+        with self._lock:
+            if self.opened_at is None:
+                return True
+            if self._trial:
+                return False
+            if time.time() - self.opened_at >= self.cooldown:
+                log.debug("Trying %s again after %ds"
+                          % (self.name, self.cooldown))
+                self._trial = True
+                return True
+            return False
+
+    def retry_in(self):
+        """Seconds until the next trial request is allowed
+        """
+        if self.opened_at is None:
+            return 0
+        return max(0, self.cooldown - (time.time() - self.opened_at))
+
+    def success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                log.info("%s is reachable again" % self.name)
+            self.failures = 0
+            self.opened_at = None
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._trial or (self.opened_at is None
+                               and self.failures >= self.threshold):
+                if self.opened_at is None:
+                    log.warn("%d consecutive errors from %s, not contacting"
+                             " it for %ds" % (self.failures, self.name,
+                                              self.cooldown))
+                self.opened_at = time.time()
+                self._trial = False
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider):
+    """Returns the CircuitBreaker for a provider, configured by
+    provider_breaker_threshold and provider_breaker_cooldown
+    """
+    with _breakers_lock:
+        try:
+            return _breakers[provider]
+        except KeyError:
+            breaker = CircuitBreaker(provider,
+                                     Config['provider_breaker_threshold'],
+                                     Config['provider_breaker_cooldown'])
+            _breakers[provider] = breaker
+            return breaker
+
+
+def _backoff(attempt):
+    """Exponential backoff with full jitter: a random delay up to
+    provider_retry_delay * 2**attempt, capped at provider_retry_max_delay
+    """
+    ceiling = min(Config['provider_retry_max_delay'],
+                  Config['provider_retry_delay'] * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+
+def call_provider(provider, func, is_transient, *args, **kwargs):
+    """Calls func(*args, **kwargs), retrying up to provider_retries times
+    when it raises an error for which is_transient(error) is True.
+
+    Other errors are raised straight away, and count as the provider having
+    answered. When the provider's circuit breaker is open, no request is
+    made and ProviderUnavailable is raised.
+
+    Each attempt is made holding one of the provider's slots (see
+    lookup.provider_slot), which is given up while waiting to retry.
+    """
+    breaker = get_breaker(provider)
+    retries = Config['provider_retries']
+
+    attempt = 0
+    while True:
+        if not breaker.allow():
+            raise ProviderUnavailable(
+                "Not contacting %s after %d consecutive errors (retrying in"
+                " %ds)" % (provider, breaker.failures, breaker.retry_in()))
+        try:
+            with provider_slot(provider):
+                result = func(*args, **kwargs)
+        except Exception, e:
+            if not is_transient(e):
+                breaker.success()
+                raise
+            breaker.failure()
+            if attempt >= retries or breaker.is_open:
+                raise
+            delay = _backoff(attempt)
+            log.debug("Error from %s (%s), retrying in %.1fs"
+                      % (provider, e, delay))
+            time.sleep(delay)
+            attempt += 1
+        else:
+            breaker.success()
+            return result
@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+
+"""Similarity scoring of search results against the name being looked up
+"""
+__all__ = ('Scorer', 'NgramScorer', 'DifflibScorer', 'get_scorer',
+           'candidate_year', 'query_year', 'without_year', 'ngrams')
+
+import re
+import difflib
+import logging
+import threading
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from config import Config
+from catalog import normalize_title
+from tvnamer_exceptions import ConfigValueError
+
+log = logging.getLogger(__name__)
+
+# Below this many names, scoring in Python is faster than with numpy
+NUMPY_MIN_BATCH = 64
+
+_year_re = re.compile(r"[\s(\[]((?:19|20)\d\d)[)\]]?\s*$")
+
+
+def query_year(name):
+    """Returns the year at the end of a name such as "Show (2005)"
+    """
+    match = _year_re.search(name)
+    if match:
+        return int(match.group(1))
+    return None
+
+
+def without_year(name):
+    """Returns name without the year at its end, if it has one
+    """
+    return _year_re.sub(u"", name)
+
+
+def candidate_year(candidate):
+    """Returns the year of a search result, if it has one
+    """
+    year = getattr(candidate, 'year', None)
+    if year is None:
+        releasedate = getattr(candidate, 'releasedate', None)
+        year = getattr(releasedate, 'year', releasedate)
+    try:
+        return int(year)
+    except (TypeError, ValueError):
+        return None
+
+
+def ngrams(name, n=3):
+    """Returns the character n-grams of the normalised name (see
+    catalog.normalize_title), padded with a space at either end
+    """
+    text = u" %s " % normalize_title(name or u"")
+    return [text[i:i + n] for i in xrange(max(1, len(text) - n + 1))]
+
+
+class Scorer(object):
+    """Scores candidate names against a query, from 0 (nothing in common)
+    to 1 (same name). Subclasses implement scores().
+    """
+
+    def scores(self, query, names):
+        """Returns the score of each of names against query
+        """
+        raise NotImplementedError
+
+    def ratio_map(self, query, candidates, candidate_name):
+        """Yields (candidate, score) pairs. A candidate's score is the best
+        of its name and its aliases.
+        """
+        for candidate, score, alias in self._scored(query, candidates,
+                                                    candidate_name):
+            yield candidate, score
+
+    def rank(self, query, candidates, candidate_name, year=None):
+        """Returns (candidate, score) pairs, best first. Equal scores are
+        ordered by whether the candidate is from the year (given, or at the
+        end of the query), then by whether its name rather than an alias
+        matched, then by their original order.
+        """
+        if year is None:
+            year = query_year(query)
+
+        def key(item):
+            i, (candidate, score, alias) = item
+            return (-score,
+                    year is not None and candidate_year(candidate) != year,
+                    alias,
+                    i)
+
+        scored = sorted(enumerate(self._scored(query, candidates,
+                                               candidate_name)),
+                        key=key)
+        return [(candidate, score) for i, (candidate, score, _) in scored]
+
+    def _scored(self, query, candidates, candidate_name):
+        candidates = list(candidates)
+        names, owners = [], []
+        for i, candidate in enumerate(candidates):
+            names.append(candidate_name(candidate))
+            owners.append((i, False))
+            for alias in getattr(candidate, 'aliases', None) or ():
+                names.append(alias)
+                owners.append((i, True))
+
+        best = [(-1, False)] * len(candidates)
+        for (i, alias), score in zip(owners, self.scores(query, names)):
+            if score > best[i][0]:
+                best[i] = (score, alias)
+        return [(c, score, alias) for c, (score, alias)
+                in zip(candidates, best)]
+
+
+class DifflibScorer(Scorer):
+    """difflib's quick_ratio, as used by earlier versions. Fast, but only an
+    upper bound on the similarity, so unrelated names can score highly.
+    """
+    junk_chars = " \t:-=_\\/,.'\"?"
+
+    def scores(self, query, names):
+        matcher = difflib.SequenceMatcher(lambda x: x in self.junk_chars,
+                                          query.lower(), "")
+        results = []
+        for name in names:
+            matcher.set_seq2(name.lower())
+            results.append(matcher.quick_ratio())
+        return results
+
+
+class NgramScorer(Scorer):
+    """Dice coefficient of the character n-grams of the normalised names
+    (see catalog.normalize_title): twice the n-grams in common, over the
+    n-grams in both names. Profiles of candidate names are cached, as the
+    same results come back for many files.
+    """
+    cache_size = 20000
+
+    def __init__(self, n=3):
+        self.n = n
+        self._profiles = {}
+
+    def profile(self, name):
+        """Returns the n-gram counts of name, and their total
+        """
+        try:
+            return self._profiles[name]
+        except KeyError:
+            pass
+
+        grams = {}
+        all_grams = ngrams(name, self.n)
+        for gram in all_grams:
+            grams[gram] = grams.get(gram, 0) + 1
+        profile = (grams, len(all_grams))
+
+        if len(self._profiles) >= self.cache_size:
+            self._profiles.clear()
+        self._profiles[name] = profile
+        return profile
+
+    def scores(self, query, names):
+        query_grams, query_total = self.profile(query)
+        if numpy is not None and len(names) >= NUMPY_MIN_BATCH:
+            return self._scores_numpy(query_grams, query_total, names)
+
+        results = []
+        for name in names:
+            grams, total = self.profile(name)
+            common = 0
+            for gram, count in grams.iteritems():
+                other = query_grams.get(gram)
+                if other:
+                    common += count if count < other else other
+            results.append(2.0 * common / (query_total + total))
+        return results
+
+    def _scores_numpy(self, query_grams, query_total, names):
+        # Only n-grams of the query can be in common, so candidates are
+        # counted over the query's n-grams and intersected in one go
+        columns = dict((gram, i) for i, gram in enumerate(query_grams))
+        counts = numpy.zeros((len(names), len(columns)), dtype=numpy.int32)
+        totals = numpy.empty(len(names), dtype=numpy.float64)
+        for row, name in enumerate(names):
+            grams, totals[row] = self.profile(name)
+            for gram, count in grams.iteritems():
+                column = columns.get(gram)
+                if column is not None:
+                    counts[row, column] = count
+
+        query_counts = numpy.zeros(len(columns), dtype=numpy.int32)
+        for gram, column in columns.iteritems():
+            query_counts[column] = query_grams[gram]
+        common = numpy.minimum(counts, query_counts).sum(axis=1)
+        return (2.0 * common / (query_total + totals)).tolist()
+
+
+SCORERS = {
+    'ngram': NgramScorer,
+    'difflib': DifflibScorer,
+}
+
+_scorer = None
+_scorer_lock = threading.Lock()
+
+
+def get_scorer():
+    """Returns the Scorer selected by the scorer config value
+    """
+    global _scorer
+
+    name = Config['scorer']
+    with _scorer_lock:
+        if _scorer is None or _scorer[0] != name:
+            try:
+                _scorer = (name, SCORERS[name]())
+            except KeyError:
+                raise ConfigValueError("Unknown scorer %r, expected one of %s"
+                                       % (name, ", ".join(sorted(SCORERS))))
+        return _scorer[1]
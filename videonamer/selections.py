@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+"""Remembered search selections for tvnamer/movienamer
+
+When the user picks a series or movie from the search results, the
+choice is stored by media type and normalised query, so later runs fetch
+that series or movie by id without searching or prompting again.
+"""
+__all__ = ('recall', 'remember', 'forget', 'list_selections')
+
+import time
+import logging
+
+from config import Config
+from catalog import normalize_title
+from state import get_state
+
+log = logging.getLogger(__name__)
+
+STATE_FILE = "selections.json"
+
+
+def _key(kind, query):
+    return u"%s\t%s" % (kind, normalize_title(query))
+
+
+def recall(kind, query):
+    """Returns the id previously selected for the query, or None
+    """
+    if not Config['remember_selections']:
+        return None
+    entry = get_state(STATE_FILE).get(_key(kind, query))
+    if entry is None:
+        return None
+    log.debug("Using remembered selection #%s (%s) for %s"
+              % (entry['id'], entry['title'], query))
+    return entry['id']
+
+
+def remember(kind, query, uid, title):
+    """Stores the id selected for the query
+    """
+    if not Config['remember_selections']:
+        return
+    get_state(STATE_FILE).set(_key(kind, query),
+                              {'id': int(uid), 'title': title,
+                               'time': int(time.time())})
+
+
+def forget(query, kind=None):
+    """Removes the selections for query (of any media type, unless kind is
+    given), returning how many were removed. A query of None removes all.
+    """
+    state = get_state(STATE_FILE)
+    count = 0
+    for key, entry in state.items():
+        entry_kind, entry_query = key.split(u"\t", 1)
+        if kind is not None and entry_kind != kind:
+            continue
+        if query is None or entry_query == normalize_title(query):
+            state.delete(key)
+            count += 1
+    return count
+
+
+def list_selections():
+    """Returns the remembered selections as (kind, query, id, title, time)
+    tuples, sorted by media type and query
+    """
+    selections = []
+    for key, entry in get_state(STATE_FILE).items():
+        kind, query = key.split(u"\t", 1)
+        selections.append((kind, query, entry['id'], entry['title'],
+                           entry.get('time')))
+    return sorted(selections)
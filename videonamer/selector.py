@@ -2,46 +2,103 @@
 
 """Utilities for tvnamer, including filename parsing
 """
-__all__ = ('Selector', 'ConsoleSelector', )
+__all__ = ('Selector', 'ConsoleSelector', 'prompt_lock', 'prompts_deferred',
+           'no_prompts', 'prompts_answered')
 
 import logging
-import operator
-import difflib
+import threading
+from contextlib import contextmanager
 
 from config import Config
-from tvnamer_exceptions import UserAbort, MatchingDataNotFound
+from tvnamer_exceptions import (UserAbort, MatchingDataNotFound,
+                                SelectionDeferred)
+from scoring import get_scorer
+from disambiguation import disambiguate
 
 log = logging.getLogger(__name__)
 #log.setLevel(logging.DEBUG)
 
+# Held while a question is shown to the user, so prompts coming from
+# concurrent lookups are displayed one at a time
+prompt_lock = threading.RLock()
+
+# While set, select() raises SelectionDeferred instead of asking, so the
+# file can be looked up again once everything else is done
+prompts_deferred = threading.Event()
+
+# Set on threads making lookups whose result may never be used, which must
+# not ask the user anything
+_no_prompts = threading.local()
+
+
+@contextmanager
+def no_prompts():
+    """Within this block, select() on the current thread raises
+    SelectionDeferred instead of asking the user
+    """
+    previous = getattr(_no_prompts, 'active', False)
+    _no_prompts.active = True
+    try:
+        yield
+    finally:
+        _no_prompts.active = previous
+
+# Number of selections the user made on each thread, counting choices
+# reused for a name the user was asked about
+_answered = threading.local()
+
+
+def prompts_answered():
+    """Returns the number of selections the user has made on the current
+    thread, so callers can tell whether a lookup's result was chosen by the
+    user or picked automatically
+    """
+    return getattr(_answered, 'count', 0)
+
+
+def _count_answer():
+    _answered.count = prompts_answered() + 1
+
+
 class Selector(object):
 
     def __init__(self):
         self.__history = {}
+        self.__asked = set()
+        self.__lock = threading.RLock()
+
+    def _previous(self, name, candidates):
+        """Returns the candidate chosen for name before, if it is among
+        candidates
+        """
+        with self.__lock:
+            last_candidate = self.__history.get(name, None)
+            asked = name in self.__asked
+        if last_candidate and last_candidate in candidates:
+            if asked:
+                _count_answer()
+            return last_candidate
+        return None
 
     @classmethod
-    def ratio_map(cls, name, candidates, candidate_name=lambda x: str(x),
-                  junk_chars=" \t:-=_\\/,.'\"?"):
-        matcher = difflib.SequenceMatcher(lambda (x): x in junk_chars,
-                                          name.lower(),
-                                          "")
-        for candidate in candidates:
-            matcher.set_seq2(candidate_name(candidate).lower())
-            yield candidate, matcher.quick_ratio()
+    def ratio_map(cls, name, candidates, candidate_name=lambda x: str(x)):
+        """Yields (candidate, ratio) pairs, scored by the configured scorer
+        """
+        return get_scorer().ratio_map(name, candidates, candidate_name)
 
     def select(self, name, candidates, candidate_name=lambda x: str(x),
-                     fuzz_ratio=0.25, min_ratio=0.65):
+                     fuzz_ratio=0.25, min_ratio=0.65, year=None,
+                     episode=None):
         if len(candidates) == 0:
             raise MatchingDataNotFound(name)
 
-        last_candidate = self.__history.get(name, None)
-        if last_candidate and last_candidate in candidates:
+        last_candidate = self._previous(name, candidates)
+        if last_candidate is not None:
             # Previous choice for this name is valid, return it!
             return last_candidate
 
-        ratiomap = sorted(self.ratio_map(name, candidates, candidate_name),
-                      key=operator.itemgetter(1),
-                      reverse=True)
+        ratiomap = get_scorer().rank(name, candidates, candidate_name,
+                                     year=year)
 
         minratio = max(ratiomap[0][1] - fuzz_ratio, min_ratio)
         log.debug("Minimum-Ratio: %d" % (minratio * 100))
@@ -57,10 +114,30 @@ class Selector(object):
                      ratiomap_mini[0][1]))
             candidate = ratiomap_mini[0][0]
         else:
+            candidate = disambiguate(name, ratiomap_mini, candidate_name,
+                                     year=year, episode=episode)
+
+        if candidate is None:
+            if (prompts_deferred.is_set()
+                or getattr(_no_prompts, 'active', False)):
+                raise SelectionDeferred(name)
+
             # Chain down to child class to do real selection        
-            candidate = self.do_select(name, ratiomap_mini, candidate_name)
-        
-        self.__history[name] = candidate
+            with prompt_lock:
+                # A concurrent lookup may have asked about this name while
+                # we were waiting for the prompt
+                last_candidate = self._previous(name, candidates)
+                if last_candidate is not None:
+                    return last_candidate
+
+                candidate = self.do_select(name, ratiomap_mini,
+                                           candidate_name)
+            _count_answer()
+            with self.__lock:
+                self.__asked.add(name)
+
+        with self.__lock:
+            self.__history[name] = candidate
         return candidate
 
     def do_select (self, name, ratiomap, candidate_name):
@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+
+"""Small JSON files kept between runs of tvnamer/movienamer
+"""
+__all__ = ('StateFile', 'get_state', 'save_state', 'state_path',
+           'write_json')
+
+import os
+import logging
+import threading
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+from config import Config
+
+log = logging.getLogger(__name__)
+
+
+def state_path(filename):
+    """Returns the path of a file in the cache_dir config directory
+    """
+    return os.path.join(os.path.expanduser(Config['cache_dir']), filename)
+
+
+def write_json(path, data):
+    """Replaces the file at path with data as JSON, creating its directory
+    if needed. The file is written to a temporary file and forced to disk
+    before taking its place, so a crash leaves either the old file or the
+    new one.
+    """
+    dirname = os.path.dirname(path)
+    if dirname and not os.path.isdir(dirname):
+        os.makedirs(dirname)
+    tmppath = path + ".tmp"
+    with open(tmppath, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.rename(tmppath, path)
+
+
+class StateFile(object):
+    """A dictionary stored as a JSON file. Changes are written by save()
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._data = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        try:
+            self._data = json.load(open(path))
+        except IOError:
+            pass
+        except ValueError, e:
+            log.warn("Ignoring corrupt state file %s: %s" % (path, e))
+
+    def get(self, key, default=None):
+        with self._lock:
+            return self._data.get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            if self._data.get(key) != value:
+                self._data[key] = value
+                self._dirty = True
+
+    def delete(self, key):
+        """Removes key, returning True if it was present
+        """
+        with self._lock:
+            if key not in self._data:
+                return False
+            del self._data[key]
+            self._dirty = True
+            return True
+
+    def items(self):
+        with self._lock:
+            return self._data.items()
+
+    def __len__(self):
+        return len(self._data)
+
+    def save(self):
+        """Writes the file, if it has changed
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            write_json(self.path, self._data)
+            self._dirty = False
+
+
+_files = {}
+_files_lock = threading.Lock()
+
+
+def get_state(filename):
+    """Returns the StateFile for filename in cache_dir
+    """
+    path = state_path(filename)
+    with _files_lock:
+        try:
+            return _files[path]
+        except KeyError:
+            state = _files[path] = StateFile(path)
+            return state
+
+
+def save_state():
+    """Saves all state files which have been changed
+    """
+    with _files_lock:
+        files = _files.values()
+    for state in files:
+        state.save()
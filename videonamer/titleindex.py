@@ -0,0 +1,186 @@
+#!/usr/bin/env python
+
+"""Local fuzzy index of known series and movie titles
+
+The titles of the series and movies fetched from thetvdb.com and
+themoviedb.org (and those of the local catalog, if there is one) are
+indexed by character trigram. A name matching one of them confidently is
+resolved to its id in-process, so the series or movie is fetched by id
+instead of being searched for.
+"""
+__all__ = ('TitleEntry', 'TitleIndex', 'get_title_index', 'resolve_title',
+           'add_title')
+
+import heapq
+import logging
+import operator
+import threading
+from collections import namedtuple
+
+from config import Config
+from catalog import get_catalog, normalize_title
+from scoring import (ngrams, get_scorer, candidate_year, query_year,
+                     without_year)
+from state import get_state, state_path
+
+log = logging.getLogger(__name__)
+
+STATE_FILE = "titles.json"
+
+# Index matches re-scored with the configured scorer for each query
+SHORTLIST_SIZE = 20
+
+# A confident match must score at least this much better than any title
+# of another series or movie, unless only it has the year being looked for
+AMBIGUITY_MARGIN = 0.1
+
+TitleEntry = namedtuple('TitleEntry', 'kind id title year')
+
+
+class TitleIndex(object):
+    """Trigram inverted index of titles by media type. A series or movie
+    can have several titles (such as aliases), each indexed separately.
+    """
+
+    def __init__(self):
+        self._entries = []
+        self._sizes = []
+        self._keys = set()
+        self._postings = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, kind, uid, title, year=None):
+        """Indexes a title, returning False if it was indexed already
+        """
+        if not title:
+            return False
+        key = (kind, int(uid), normalize_title(title))
+        with self._lock:
+            if key in self._keys:
+                return False
+            self._keys.add(key)
+            position = len(self._entries)
+            self._entries.append(TitleEntry(kind, int(uid), title, year))
+            grams = set(ngrams(title))
+            self._sizes.append(len(grams))
+            for gram in grams:
+                self._postings.setdefault((kind, gram), []).append(position)
+        return True
+
+    def search(self, kind, query, limit=5, year=None):
+        """Returns up to limit (entry, score) pairs for the titles most like
+        query, best first, scored by the configured scorer
+        """
+        grams = set(ngrams(query))
+        common = {}
+        with self._lock:
+            for gram in grams:
+                for position in self._postings.get((kind, gram), ()):
+                    common[position] = common.get(position, 0) + 1
+            sizes = self._sizes
+            shortlist = heapq.nlargest(
+                SHORTLIST_SIZE, common,
+                key=lambda p: float(common[p]) / (len(grams) + sizes[p]))
+            entries = [self._entries[p] for p in shortlist]
+
+        ranked = get_scorer().rank(query, entries,
+                                   operator.attrgetter('title'), year=year)
+        return ranked[:limit]
+
+    def resolve(self, kind, query, year=None):
+        """Returns the entry matching query with at least the
+        title_index_confidence score, and clearly better than the titles of
+        any other series or movie. Otherwise (or when it is from another
+        year than the one given or at the end of query) returns None.
+        """
+        if year is None:
+            year = query_year(query)
+        ranked = self.search(kind, query, year=year)
+        if query_year(query) is not None:
+            # "Name (Year)" is often a plain title with the year beside it
+            ranked = sorted(ranked + self.search(kind, without_year(query),
+                                                 year=year),
+                            key=lambda item: -item[1])
+        if not ranked or ranked[0][1] < Config['title_index_confidence']:
+            return None
+
+        best, score = ranked[0]
+        if year is not None and candidate_year(best) not in (None, year):
+            return None
+        for other, other_score in ranked[1:]:
+            if other.id == best.id or score - other_score >= AMBIGUITY_MARGIN:
+                continue
+            if (year is not None and candidate_year(best) == year
+                and candidate_year(other) != year):
+                continue
+            log.debug("%s matches both %s and %s, not using the title index"
+                      % (query, best.title, other.title))
+            return None
+        return best
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def _load(index):
+    for key, entry in get_state(STATE_FILE).items():
+        kind, uid = key.split(u"\t", 1)
+        index.add(kind, uid, entry['title'], entry.get('year'))
+
+    catalog = get_catalog()
+    if catalog is not None:
+        for record in catalog.records():
+            for title in [record['title']] + record.get('aliases', []):
+                index.add(record['kind'], record['id'], title,
+                          record.get('year'))
+    log.debug("Loaded %d titles into the title index" % len(index))
+
+
+def get_title_index():
+    """Returns the TitleIndex of the titles seen before, loading it on
+    first use (or after cache_dir or catalog_path are changed)
+    """
+    global _index
+
+    source = (state_path(STATE_FILE), Config['catalog_path'])
+    with _index_lock:
+        if _index is None or _index[0] != source:
+            index = TitleIndex()
+            _load(index)
+            _index = (source, index)
+        return _index[1]
+
+
+def resolve_title(kind, names, year=None):
+    """Returns the id of the series or movie confidently matching the first
+    of names possible, or None when they should be searched for
+    """
+    if not Config['title_index']:
+        return None
+    index = get_title_index()
+    for name in names:
+        entry = index.resolve(kind, name, year=year)
+        if entry is not None:
+            log.debug("Resolved %s to %s #%s (%s) from the title index"
+                      % (name, kind, entry.id, entry.title))
+            return entry.id
+    return None
+
+
+def add_title(kind, uid, title, year=None):
+    """Adds the title of a series or movie fetched from a provider to the
+    index, and to the titles kept between runs
+    """
+    if not Config['title_index'] or not title:
+        return
+    try:
+        year = int(year)
+    except (TypeError, ValueError):
+        year = None
+    if get_title_index().add(kind, uid, title, year):
+        get_state(STATE_FILE).set(u"%s\t%s" % (kind, uid),
+                                  {'title': title, 'year': year})
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+"""Schedules file copies by the devices they read and write
+
+Renames and moves are applied by several threads at once, and a copy from
+one disk to another would otherwise compete with every other copy using
+either disk, and with anything else using them (such as a media server
+playing from them). Each copy takes a stream slot on both devices first,
+so each device has at most copy_streams_per_device copies at a time while
+copies between other devices carry on. Copies are also held to the
+per-device rates in copy_rate_limit and copy_rate_limits.
+"""
+__all__ = ('TokenBucket', 'DeviceScheduler', 'get_scheduler')
+
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+from config import Config
+
+log = logging.getLogger(__name__)
+
+# Most bytes copied without waiting, as seconds at the rate limit
+BURST = 0.5
+
+
+class TokenBucket(object):
+    """Limits the rate of bytes passed to take() to rate bytes per second,
+    allowing bursts of up to BURST seconds of it
+    """
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.capacity = self.rate * BURST
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self._lock = threading.Lock()
+
+    def take(self, count):
+        """Waits until count bytes may be copied
+        """
+        with self._lock:
+            now = time.time()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            # Going into debt makes the next caller wait for this one too
+            self.tokens -= count
+            wait = -self.tokens / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class DeviceScheduler(object):
+    """Stream slots and rate limits for each device id
+    """
+
+    def __init__(self, streams=1, rate=0, rates=None):
+        """streams is the number of copies each device takes part in at a
+        time (0 for no limit), rate the bytes per second each device is
+        limited to (0 for no limit), and rates a dict of device id to
+        bytes per second for devices with their own limits
+        """
+        self.streams = streams
+        self.rate = rate
+        self.rates = rates or {}
+        self._slots = {}
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _device(self, device):
+        # Returns the semaphore and bucket of a device, called with the
+        # lock held
+        if device not in self._slots:
+            self._slots[device] = (threading.BoundedSemaphore(self.streams)
+                                   if self.streams else None)
+            rate = self.rates.get(device, self.rate)
+            self._buckets[device] = TokenBucket(rate) if rate else None
+        return self._slots[device], self._buckets[device]
+
+    @contextmanager
+    def slot(self, devices):
+        """Waits for a stream slot on each of devices, and yields a
+        function to call with the number of bytes copied after each part
+        of the copy, which waits as long as the rate limits need (or None
+        when there are no limits)
+        """
+        # Taken in order, so two copies between the same pair of devices
+        # in opposite directions can't each hold one and wait for the other
+        devices = sorted(set(devices))
+        with self._lock:
+            limits = [self._device(device) for device in devices]
+        semaphores = [s for s, bucket in limits if s is not None]
+        buckets = [bucket for s, bucket in limits if bucket is not None]
+
+        taken = []
+        try:
+            for semaphore in semaphores:
+                # wait with a timeout so KeyboardInterrupt is delivered
+                while not semaphore.acquire(False):
+                    time.sleep(0.05)
+                taken.append(semaphore)
+
+            if buckets:
+
+                def throttle(count):
+                    for bucket in buckets:
+                        bucket.take(count)
+                yield throttle
+            else:
+                yield None
+        finally:
+            for semaphore in taken:
+                semaphore.release()
+
+    @contextmanager
+    def transfer(self, source, destination_dir):
+        """slot() for copying the file source into destination_dir
+        """
+        devices = [os.stat(os.path.dirname(source)).st_dev,
+                   os.stat(destination_dir).st_dev]
+        with self.slot(devices) as throttle:
+            yield throttle
+
+
+def _rates():
+    # Config copy_rate_limits maps paths to MB/s, the scheduler device ids
+    # to bytes per second
+    rates = {}
+    for path, rate in Config['copy_rate_limits'].items():
+        try:
+            device = os.stat(os.path.expanduser(path)).st_dev
+        except OSError, e:
+            log.warning("Ignoring copy_rate_limits for %s: %s" % (path, e))
+            continue
+        rates[device] = rate * 1024 * 1024
+    return rates
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Returns the DeviceScheduler configured by copy_streams_per_device,
+    copy_rate_limit and copy_rate_limits
+    """
+    global _scheduler
+
+    key = (Config['copy_streams_per_device'], Config['copy_rate_limit'],
+           tuple(sorted(Config['copy_rate_limits'].items())))
+    with _scheduler_lock:
+        if _scheduler is None or _scheduler[0] != key:
+            _scheduler = (key, DeviceScheduler(
+                                    streams=key[0],
+                                    rate=key[1] * 1024 * 1024,
+                                    rates=_rates()))
+        return _scheduler[1]
@@ -6,14 +6,14 @@ __all__ = ('TvInfo',)
 
 import re
 import logging
+import operator
 import datetime
+import threading
 
 from tvdb_api import (Tvdb, BaseUI,
                       tvdb_error,
                       tvdb_shownotfound,
                       tvdb_userabort,
-                      tvdb_episodenotfound,
-                      tvdb_seasonnotfound,
                       tvdb_attributenotfound)
 
 from config import Config
@@ -27,9 +27,19 @@ from tvnamer_exceptions import (ShowNotFound, EpisodeNotFound,
                                 DataRetrievalError,
                                 ConfigValueError,
                                 UserAbort,
-                                MatchingDataNotFound)
+                                MatchingDataNotFound,
+                                SelectionDeferred,
+                                NoGoodMatch)
 from info import BaseInfo
-from selector import ConsoleSelector
+from selector import ConsoleSelector, no_prompts, prompts_answered
+from lookup import keyed_lock, BackgroundCall
+from catalog import get_catalog, make_show, CatalogEntry
+from notfound import get_notfound_cache
+from state import get_state
+from selections import recall, remember, forget
+from titleindex import resolve_title, add_title
+from resilience import call_provider
+import httppool
 
 log = logging.getLogger(__name__)
 
@@ -37,17 +47,106 @@ def tv_formatter(tv):
     return "{0} ({1})".format(tv.title.encode("UTF-8", "ignore"),
                               tv.releasedate)
 
+class TvdbSearchResult(object):
+    """A thetvdb.com search result, with the attributes the selectors
+    expect from search results
+    """
+
+    def __init__(self, series):
+        self.series = series
+        self.id = series['id']
+        self.title = series.get('seriesname') or u""
+        self.aliases = series.get('aliasnames') or []
+        self.releasedate = series.get('firstaired')
+        try:
+            self.year = int(self.releasedate[:4])
+        except (TypeError, ValueError):
+            self.year = None
+
+    def __eq__(self, other):
+        return isinstance(other, TvdbSearchResult) and other.id == self.id
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(self.id)
+
 class TvdbSelector(BaseUI):
     
     __selector = ConsoleSelector(candidate_formatter=tv_formatter)
     
-    def set_name(self, name):
+    def set_name(self, name, year=None, episode=None):
         self.name = name
+        self.year = year
+        self.episode = episode
     
     def selectSeries(self, candidates):
-        return self.__selector.select(self.name, 
-                                      candidates,
-                                      candidate_name=tv_formatter)
+        return self.__selector.select(
+                    self.name,
+                    [TvdbSearchResult(c) for c in candidates],
+                    candidate_name=operator.attrgetter('title'),
+                    year=self.year,
+                    episode=self.episode).series
+
+
+def use_tvdb_server(tvdb, base_url):
+    """Points a Tvdb instance at another server implementing the
+    thetvdb.com API
+    """
+    default = tvdb.config['base_url']
+    base_url = base_url.rstrip('/')
+    for key, value in tvdb.config.items():
+        if key.startswith('url_') and value.startswith(default):
+            tvdb.config[key] = base_url + value[len(default):]
+    tvdb.config['base_url'] = base_url
+
+
+class EpisodeIndex(object):
+    """Dictionary indexes over the episodes of a show, by (season, episode),
+    absolute episode number and air date. Built once per show, instead of
+    scanning every episode for each file.
+    """
+
+    def __init__(self, show):
+        self.seasons = set()
+        self._by_number = {}
+        self._by_absolute = {}
+        self._by_airdate = {}
+
+        for seasno, season in show.items():
+            self.seasons.add(seasno)
+            for epno, episode in season.items():
+                self._by_number[(seasno, epno)] = episode
+
+                try:
+                    absno = int(float(dict.get(episode, 'absolute_number')))
+                except (TypeError, ValueError):
+                    pass
+                else:
+                    self._by_absolute.setdefault(absno, []).append(episode)
+
+                aired = dict.get(episode, 'firstaired')
+                if aired:
+                    self._by_airdate.setdefault(aired, []).append(episode)
+
+        log.debug("Indexed %d episodes of %s"
+                  % (len(self._by_number), show.data.get('seriesname')))
+
+    def episode(self, seasno, epno):
+        """Returns the episode, or None
+        """
+        return self._by_number.get((seasno, epno))
+
+    def absolute(self, absno):
+        """Returns the episodes with this absolute number
+        """
+        return self._by_absolute.get(absno, [])
+
+    def aired_on(self, date):
+        """Returns the episodes which aired on the date
+        """
+        return self._by_airdate.get(str(date), [])
 
 
 def format_genres( genres):
@@ -67,9 +166,46 @@ class TvInfo(BaseInfo):
     _unique_attrs = ('seriesname', 'seasonnumber', 'episodenumbers')
     _parser_key = 'tv_patterns'
 
-    __tvdb_instance = Tvdb()
-    __selector = TvdbSelector(__tvdb_instance.config)
+    # Tvdb instances are not thread-safe, so each lookup thread gets its
+    # own. Loaded shows are shared between threads through __shows.
+    __local = threading.local()
+    __shows = {}
+    __shows_lock = threading.Lock()
+    __catalog_selector = ConsoleSelector(candidate_formatter=tv_formatter)
 
+    @classmethod
+    def _episode_index(cls, show):
+        """Returns the EpisodeIndex of a show, building it on first use
+        """
+        with cls.__shows_lock:
+            index = getattr(show, 'episode_index', None)
+            if index is None:
+                index = show.episode_index = EpisodeIndex(show)
+            return index
+
+    @classmethod
+    def _tvdb(cls):
+        """Returns the Tvdb instance and selector for the current thread,
+        creating them on first use (or after tvdb_base_url or the search
+        options are changed)
+        """
+        local = cls.__local
+        settings = (Config['tvdb_base_url'], Config['select_first'],
+                    Config['search_all_languages'], Config['language'])
+        if (getattr(local, 'tvdb', None) is None
+            or local.settings != settings):
+            local.settings = settings
+            # tvdb_api creates its UI for each search, from custom_ui
+            local.tvdb = Tvdb(
+                    interactive = not Config['select_first'],
+                    search_all_languages = Config['search_all_languages'],
+                    language = Config['language'],
+                    custom_ui = lambda config: local.selector)
+            httppool.add_to_opener(local.tvdb.urlopener)
+            if Config['tvdb_base_url']:
+                use_tvdb_server(local.tvdb, Config['tvdb_base_url'])
+            local.selector = TvdbSelector(local.tvdb.config)
+        return local.tvdb, local.selector
 
     def set_episodenumbers(self, episodenumbers):
         self.episodenumbers = episodenumbers
@@ -100,6 +236,91 @@ class TvInfo(BaseInfo):
         
         return config_key
 
+    def _tvdb_show(self, name, key, uid=None):
+        """Retrieves the show from thetvdb.com
+
+        The search and the show's data are fetched (and retried) holding a
+        provider slot each, while the search result is chosen without one,
+        as that can mean waiting for the user to answer a prompt.
+        """
+        is_transient = lambda e: isinstance(e, tvdb_error)
+
+        def fetch(sid, language):
+            # Start again from nothing if an earlier attempt failed part
+            # way through
+            tvdb.shows.pop(sid, None)
+            tvdb._getShowData(sid, language)
+            return tvdb.shows[sid]
+
+        tvdb, selector = self._tvdb()
+        try:
+            if uid is None:
+                results = call_provider('tvdb', tvdb.search, is_transient,
+                                        name)
+                if not results:
+                    raise tvdb_shownotfound(
+                        "Show-name search returned zero results")
+                episode = None
+                if not self.date_based:
+                    episode = (self.seasonnumber or 1, self.episodenumbers)
+                selector.set_name(name, year=getattr(self, 'year', None),
+                                  episode=episode)
+                series = selector.selectSeries(results)
+                show = call_provider('tvdb', fetch, is_transient,
+                                     series['id'], series['language'])
+            else:
+                show = call_provider('tvdb', fetch, is_transient, key,
+                                     Config['language'])
+        except tvdb_error, errormsg:
+            raise DataRetrievalError("Error contacting thetvdb.com: %s" %
+                                      errormsg)
+        except tvdb_shownotfound:
+            # No such series found.
+            raise ShowNotFound("Show %s not found on thetvdb.com" % name)
+        except MatchingDataNotFound:
+            raise NoGoodMatch("No good match for show %s on thetvdb.com"
+                              % name)
+        except tvdb_userabort, error:
+            raise UserAbort(unicode(error))
+
+        add_title('tv', show['id'], show['seriesname'],
+                  (show.data.get('firstaired') or '')[:4])
+        return show
+
+    def _catalog_show(self, name, uid=None):
+        """Looks the show up in the local catalog. Returns None when there is
+        no catalog, or when the show is not in it and online lookups are
+        allowed.
+        """
+        catalog = get_catalog()
+        if catalog is None:
+            return None
+
+        if uid is None:
+            candidates = [CatalogEntry(r) for r in catalog.search('tv', name)]
+            episode = None
+            if not self.date_based:
+                episode = (self.seasonnumber or 1, self.episodenumbers)
+            try:
+                record = self.__catalog_selector.select(
+                            name, candidates,
+                            candidate_name=operator.attrgetter('title'),
+                            year=getattr(self, 'year', None),
+                            episode=episode).record
+            except MatchingDataNotFound:
+                record = None
+        else:
+            record = catalog.get('tv', uid)
+
+        if record is None:
+            if Config['catalog_only']:
+                raise ShowNotFound("Show %s not found in catalog %s"
+                                   % (name, catalog.path))
+            return None
+
+        log.debug("Found %s in catalog" % record['title'])
+        return make_show(record)
+
     def populate_from_db(self, force_name=None, uid=None, adult=False):
         """Queries the tvdb_api
         If series cannot be found, it will warn the user. If the episode is not
@@ -108,65 +329,167 @@ class TvInfo(BaseInfo):
         it will catch tvdb_api's user abort error and raise tvnamer's
         """
         def find_show(name, uid=None):
-            self.__selector.set_name(force_name or name)
-            try:
-                if uid is None:
-                    show = self.__tvdb_instance[force_name or name]
-                else:
-                    uid = int(uid)
-                    self.__tvdb_instance._getShowData(uid, Config['language'])
-                    show = self.__tvdb_instance[uid]
-            except tvdb_error, errormsg:
-                raise DataRetrievalError("Error contacting thetvdb.com: %s" %
-                                          errormsg)
-            except (tvdb_shownotfound, MatchingDataNotFound):
-                # No such series found.
-                raise ShowNotFound("Show %s not found on thetvdb.com" % name)
-            except tvdb_userabort, error:
-                raise UserAbort(unicode(error))
+            if uid is None:
+                key = (force_name or name).lower()
             else:
+                key = int(uid)
+
+            with keyed_lock(('tv', key)):
+                with self.__shows_lock:
+                    show = self.__shows.get(key)
+                if show is not None:
+                    return show
+
+                show = self._catalog_show(force_name or name, uid=uid)
+                if show is None:
+                    show = self._tvdb_show(force_name or name, key, uid)
+
+                with self.__shows_lock:
+                    self.__shows[key] = show
                 return show
         
-        if self.__tvdb_instance is None:
-            # cache tvdb instance in class, but wait until 1st call
-            self.__class__.__tvdb_instance = Tvdb(
-                    interactive = not Config['select_first'],
-                    search_all_languages = Config['search_all_languages'],
-                    language = Config['language'])
-        
+        def find_quietly(name):
+            # Speculative lookups never prompt: a name needing the user to
+            # choose is searched again if the result is wanted
+            with no_prompts():
+                try:
+                    return find_show(name, uid=uid)
+                except SelectionDeferred:
+                    return None
+
+        def find_first(names):
+            # Tries each name in turn, returning the first found. In
+            # parallel mode the fallback is searched for at the same time,
+            # unless lookups are local. Its result is only waited for if
+            # the first name is not found.
+            speculative = None
+            if (len(names) > 1 and Config['year_query_mode'] == 'parallel'
+                and get_catalog() is None):
+                speculative = BackgroundCall(find_quietly, names[1])
+
+            # Raised in the end if any name had results, but none good
+            no_good_match = None
+            for i, name in enumerate(names):
+                try:
+                    if i == 1 and speculative is not None:
+                        show = speculative.result()
+                        if show is not None:
+                            return name, show
+                    return name, find_show(name, uid=uid)
+                except ShowNotFound, e:
+                    if isinstance(e, NoGoodMatch):
+                        no_good_match = e
+                    if i == len(names) - 1:
+                        if no_good_match is not None:
+                            raise no_good_match
+                        raise
+
         year_in_query = (uid is None and 
                          not self.date_based and 
                          getattr(self, 'year', None) is not None)
         if year_in_query:
             name = '%s (%s)' % (self.seriesname, self.year)
+            names = [name, self.seriesname]
+            if self._learned_year_form() == 'plain':
+                names.reverse()
         else:
             name = self.seriesname
-        try:
-            show = find_show(name, uid=uid)
-        except ShowNotFound:
-            if year_in_query:
-                name = self.seriesname
-                show = find_show(name, uid=uid)
-            else:
+            names = [name]
+
+        # Queries which failed recently fail again without a search
+        notfound = get_notfound_cache()
+        query = (force_name or name) if uid is None else u"#%s" % uid
+        episode_detail = (self.seasonnumber,
+                          ",".join(unicode(e) for e in self.episodenumbers))
+        if notfound.known('tv', query, year_in_query):
+            raise ShowNotFound("Show %s not found (cached)" % name)
+        if notfound.known('tv-episode', query, *episode_detail):
+            raise EpisodeNotFound("Episode %s of show %s not found (cached)"
+                                  % (episode_detail[1], name))
+
+        # A series picked for this name before is fetched by its id
+        show = None
+        remembered = recall('tv', query) if uid is None else None
+        if remembered is not None:
+            try:
+                show = find_show(name, uid=remembered)
+            except ShowNotFound:
+                log.info("Remembered series #%s for %s not found, searching"
+                         " again" % (remembered, query))
+                forget(query, kind='tv')
+
+        # Names of series seen before are resolved without a search
+        if show is None and uid is None:
+            local = resolve_title('tv', [force_name] if force_name else names,
+                                  year=self.year if year_in_query else None)
+            if local is not None:
+                try:
+                    show = find_show(name, uid=local)
+                except ShowNotFound:
+                    log.debug("Series #%s from the title index not found"
+                              % local)
+
+        if show is None:
+            answered = prompts_answered()
+            try:
+                found_name, show = find_first(names)
+            except NoGoodMatch:
+                raise
+            except ShowNotFound:
+                if not Config['catalog_only']:
+                    notfound.add('tv', query, year_in_query)
                 raise
+
+            if year_in_query:
+                self._learn_year_form('year' if found_name == name
+                                      else 'plain')
+            name = found_name
+            # Only choices the user made are remembered, as automatic
+            # picks are made again (with the current thresholds) anyway
+            if uid is None and prompts_answered() > answered:
+                remember('tv', query, show['id'], show['seriesname'])
+
+        try:
+            self._populate_episodes(show, name)
+        except (SeasonNotFound, EpisodeNotFound):
+            if not Config['catalog_only']:
+                notfound.add('tv-episode', query, *episode_detail)
+            raise
+
+    def _learned_year_form(self):
+        """Returns the form of name ('year' or 'plain') which found this
+        series before, when year_query_mode is 'learn'
+        """
+        if Config['year_query_mode'] != 'learn':
+            return None
+        return get_state("year_queries.json").get(self.seriesname.lower())
+
+    def _learn_year_form(self, form):
+        if Config['year_query_mode'] == 'learn':
+            get_state("year_queries.json").set(self.seriesname.lower(), form)
+
+    def _populate_episodes(self, show, name):
+        """Sets the series and episode names from the show
+        """
         # Series was found, use corrected series name
         self.seriesname = show['seriesname']
 
+        index = self._episode_index(show)
+
         if self.date_based:
             # Date-based episode
             epnames = []
             for cepno in self.episodenumbers:
-                try:
-                    sr = show.airedOn(cepno)
-                    if len(sr) > 1:
-                        raise EpisodeNotFound(
-                            "Ambigious air date %s, there were %s episodes on that day" % (
-                            cepno, len(sr)))
-                    epnames.append(sr[0]['episodename'])
-                except tvdb_episodenotfound:
+                sr = index.aired_on(cepno)
+                if len(sr) == 0:
                     raise EpisodeNotFound(
                         "Episode that aired on %s could not be found" % (
                         cepno))
+                if len(sr) > 1:
+                    raise EpisodeNotFound(
+                        "Ambigious air date %s, there were %s episodes on that day" % (
+                        cepno, len(sr)))
+                epnames.append(self._episodename(sr[0], cepno))
             self.set_episodename(epnames)
             return
 
@@ -176,48 +499,39 @@ class TvInfo(BaseInfo):
         else:
             seasonnumber = self.seasonnumber
 
+        if seasonnumber not in index.seasons:
+            raise SeasonNotFound(
+                "Season %s of show %s could not be found" % (
+                seasonnumber,
+                name))
+
         epnames = []
         for cepno in self.episodenumbers:
-            try:
-                episodeinfo = show[seasonnumber][cepno]
-
-            except tvdb_seasonnotfound:
-                raise SeasonNotFound(
-                    "Season %s of show %s could not be found" % (
-                    seasonnumber,
-                    name))
-
-            except tvdb_episodenotfound:
-                # Try to search by absolute_number
-                sr = show.search(cepno, "absolute_number")
-                if len(sr) > 1:
-                    # For multiple results try and make sure there is a direct match
-                    unsure = True
-                    for e in sr:
-                        if int(e['absolute_number']) == cepno:
-                            epnames.append(e['episodename'])
-                            unsure = False
-                    # If unsure error out            
-                    if unsure:
-                        raise EpisodeNotFound(
-                            "No episode actually matches %s, found %s results instead" % (cepno, len(sr)))
-                elif len(sr) == 1:
-                    epnames.append(sr[0]['episodename'])
-                else:
-                    raise EpisodeNotFound(
-                        "Episode %s of show %s, season %s could not be found (also tried searching by absolute episode number)" % (
-                            cepno,
-                            name,
-                            seasonnumber))
-
-            except tvdb_attributenotfound:
-                raise EpisodeNameNotFound(
-                    "Could not find episode name for %s" % cepno)
-            else:
-                epnames.append(episodeinfo['episodename'])
+            episodeinfo = index.episode(seasonnumber, cepno)
+            if episodeinfo is not None:
+                epnames.append(self._episodename(episodeinfo, cepno))
+                continue
+
+            # Try by absolute_number
+            sr = index.absolute(cepno)
+            if len(sr) == 0:
+                raise EpisodeNotFound(
+                    "Episode %s of show %s, season %s could not be found (also tried searching by absolute episode number)" % (
+                        cepno,
+                        name,
+                        seasonnumber))
+            epnames.extend(self._episodename(e, cepno) for e in sr)
 
         self.set_episodename(epnames)
 
+    @staticmethod
+    def _episodename(episode, cepno):
+        try:
+            return episode['episodename']
+        except tvdb_attributenotfound:
+            raise EpisodeNameNotFound(
+                "Could not find episode name for %s" % cepno)
+
     def _init_from_match(self, match):   
         namedgroups = match.groupdict()
 
@@ -40,6 +40,16 @@ class UserAbort(BaseTvnamerException):
     pass
 
 
+class SelectionDeferred(BaseTvnamerException):
+    """Raised instead of asking which search result is meant while prompts
+    are deferred (see defer_prompts). name is the name being looked up.
+    """
+
+    def __init__(self, name):
+        BaseTvnamerException.__init__(self, "Choice for %s deferred" % name)
+        self.name = name
+
+
 class BaseConfigError(BaseTvnamerException):
     """Base exception for config errors
     """
@@ -69,6 +79,14 @@ class ShowNotFound(DataRetrievalError):
     pass
 
 
+class NoGoodMatch(ShowNotFound):
+    """Raised when a search had results, but none matched the name well
+    enough. Unlike other ShowNotFound errors this depends on the matching
+    thresholds.
+    """
+    pass
+
+
 class SeasonNotFound(DataRetrievalError):
     """Raised when requested season cannot be found
     """
@@ -85,3 +103,9 @@ class EpisodeNameNotFound(DataRetrievalError):
     """Raised when the name of the episode cannot be found
     """
     pass
+
+
+class ProviderUnavailable(DataRetrievalError):
+    """Raised instead of contacting a provider which has failed repeatedly
+    """
+    pass
@@ -71,7 +71,9 @@ def same_partition(f1, f2):
 
 
 def delete_file(fpath):
-    raise NotImplementedError("delete_file not yet implimented")
+    """Deletes the file at fpath (once it has been copied elsewhere)
+    """
+    os.remove(fpath)
 
 
 def handleYear(year):